@@ -0,0 +1,38 @@
+"""
+Start-up cost: `import src` and create_app() in fresh interpreters, the
+median of several runs each. This is what every gunicorn worker pays
+without --preload, and what every CLI command and test run pays.
+
+    python benchmarks/bench_import.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+SCRIPT = '''
+import time
+started = time.perf_counter()
+import src
+imported = time.perf_counter()
+src.create_app()
+print(imported - started, time.perf_counter() - imported)
+'''
+
+
+def main(runs=7):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', SCRIPT], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        timings.append([float(value) for value in output.split()])
+    imported, created = (statistics.median(column) for column in zip(*timings))
+    print(f'import src    {imported * 1000:7.1f} ms')
+    print(f'create_app()  {created * 1000:7.1f} ms')
+    print(f'total         {(imported + created) * 1000:7.1f} ms  (median of {runs})')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
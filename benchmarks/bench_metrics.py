@@ -0,0 +1,42 @@
+"""
+Per-request cost of the /metrics instrumentation: the same requests with
+METRICS_ENABLED on and off.
+
+    python benchmarks/bench_metrics.py [requests]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import app, db
+
+
+def run(client, path, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get(path)
+    return (time.perf_counter() - started) / count
+
+
+def main(count=2000):
+    app.config['METRICS_DIR'] = tempfile.mkdtemp()
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+
+    for path in ('/api', '/api/users?limit=10'):
+        run(client, path, 100)  # warm up
+        timings = {}
+        for enabled in (False, True, False, True):
+            app.config['METRICS_ENABLED'] = enabled
+            timings.setdefault(enabled, []).append(run(client, path, count))
+        off, on = min(timings[False]), min(timings[True])
+        print(f'{path:<24} off {off * 1e6:8.1f} us  on {on * 1e6:8.1f} us  '
+              f'overhead {(on - off) * 1e6:6.1f} us/request')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,62 @@
+"""
+Sign-up throughput with password hashing on the bounded pool: concurrent
+clients POST /api/users and we count created users, 503s and latency per
+concurrency level.
+
+    python benchmarks/bench_passwords.py [signups per client]
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import app, db, User
+
+
+def signups(count, prefix, results):
+    client = app.test_client()
+    for n in range(count):
+        started = time.perf_counter()
+        response = client.post('/api/users', json={
+            'username': f'{prefix}-{n}', 'email': f'{prefix}-{n}@example.com',
+            'first_name': 'Bench', 'last_name': 'Mark', 'password': '#Jopempe2043'})
+        results.append((response.status_code, time.perf_counter() - started))
+
+
+def run(clients, count):
+    results = []
+    threads = [threading.Thread(target=signups, args=(count, uuid.uuid4().hex, results))
+               for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    created = [seconds for status, seconds in results if status == 201]
+    busy = sum(1 for status, _ in results if status == 503)
+    worst = max(seconds for _, seconds in results)
+    return len(created) / elapsed, busy, worst
+
+
+def main(count=10):
+    with app.app_context():
+        db.create_all()
+    print(f"scrypt:{app.config['PASSWORD_SCRYPT_N']}:{app.config['PASSWORD_SCRYPT_R']}:"
+          f"{app.config['PASSWORD_SCRYPT_P']}, {app.config['PASSWORD_HASH_WORKERS']} workers, "
+          f"queue {app.config['PASSWORD_HASH_QUEUE']}, {os.cpu_count()} cpus")
+    for clients in (1, 2, 4, 8, 16, 32):
+        rate, busy, worst = run(clients, count)
+        print(f'{clients:>3} clients  {rate:7.1f} signups/s  {busy:4d} x 503  '
+              f'slowest {worst * 1000:7.1f} ms')
+
+    with app.app_context():
+        db.session.execute(db.delete(User).where(User.first_name == 'Bench', User.last_name == 'Mark'))
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
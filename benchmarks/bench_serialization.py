@@ -0,0 +1,44 @@
+"""
+Compare jsonify(user), which goes through dataclasses.asdict, with the
+precompiled user_serializer on a page of in-memory users.
+
+    python benchmarks/bench_serialization.py [rows] [repeat]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import jsonify
+from src import app, User
+from src.serializers import user_serializer
+
+
+def make_users(count):
+    return [User(id=i, first_name='Maanda', last_name='Muleya', username=f'user{i}',
+                 email=f'user{i}@example.com', password='x', is_admin=False)
+            for i in range(count)]
+
+
+def main(rows=100, repeat=200):
+    users = make_users(rows)
+    rows_only = [tuple(getattr(user, field) for field in ('id', 'username')) for user in users]
+
+    cases = {
+        'jsonify(users) via dataclasses.asdict': lambda: jsonify(users),
+        'user_serializer.dump': lambda: jsonify([user_serializer.dump(user) for user in users]),
+        'user_serializer.dump_row ?fields=id,username': lambda: jsonify(
+            [user_serializer.dump_row(row, ('id', 'username')) for row in rows_only]),
+    }
+
+    with app.app_context():
+        baseline = None
+        for name, case in cases.items():
+            seconds = min(timeit.repeat(case, number=repeat, repeat=3)) / repeat
+            baseline = baseline or seconds
+            print(f'{name:<48} {seconds * 1e6:10.1f} us/page  x{baseline / seconds:.1f}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
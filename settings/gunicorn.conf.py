@@ -0,0 +1,46 @@
+# gunicorn -c settings/gunicorn.conf.py wsgi:app
+#
+# The master imports the app and runs create_app() once, before forking, so
+# workers start in milliseconds and share the loaded code copy-on-write.
+# Run `flask migrate` first: creating the app never touches the database.
+
+bind = 'unix:/run/gunicorn.sock'
+workers = 3
+# Each worker serves several requests at once on threads, so one waiting on
+# a password hash (which runs on src/passwords.py's pool, outside the GIL)
+# does not hold up the rest. There are more threads than hashing slots
+# (PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE): past those a sign-up or
+# login gets a 503 instead of every thread ending up behind scrypt.
+worker_class = 'gthread'
+threads = 8
+accesslog = '-'
+timeout = 120
+preload_app = True
+
+
+def on_starting(server):
+    # Workers of the last run are gone, their metrics live on in dead.json
+    from src.metrics import metrics
+    metrics.fold()
+
+
+def child_exit(server, worker):
+    from src.metrics import metrics
+    metrics.fold(worker.pid)
+
+
+def post_fork(server, worker):
+    # Nothing connects before the fork, but a pooled connection the master
+    # did open must never be shared with a worker
+    from src import app, db
+    from src.outbox import worker as outbox_worker
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Only workers write METRICS_DIR/<pid>.json for /metrics to add up
+    app.config['METRICS_SHARED'] = True
+    # Past the fork, so the thread is this worker's own. Sends what was left
+    # pending or due for a retry before the restart without waiting for a
+    # new message.
+    if app.config['OUTBOX_WORKER']:
+        outbox_worker.notify()
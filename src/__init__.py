@@ -2,4 +2,39 @@ from .base import app
 from .views import *
 from .models import User, db
 from .apis import *
-from .admin import admin
\ No newline at end of file
+from .metrics import metrics
+from .assets import asset_manifest
+from .images import image_manifest
+from .bundles import bundle_manifest
+from .freeze import freeze
+from .profiling import slow_queries
+from .openapi import compiled_spec
+# After metrics, so requests it turns away are still timed and counted
+from .ratelimit import rate_limiter
+
+
+def create_app():
+    """
+    The app with everything a server needs on top of its routes: the
+    Swagger UI, the admin panel and `flask db`. They are set up here rather
+    than on import because together they are most of the import time,
+    which CLI commands, tests and scripts need not pay. Nothing here
+    touches the database, so gunicorn can call it once in the master with
+    --preload and fork workers that share the result. Calling it again
+    returns the same app.
+    """
+    if 'migrate' in app.extensions:
+        return app
+
+    from flasgger import Swagger
+    from flask_migrate import Migrate
+    from .admin import admin
+    from .base import template
+    from . import openapi
+
+    Swagger(app, template=template)
+    # The docs UI loads the compiled spec instead of one built per worker
+    app.view_functions[f'flasgger.{openapi.SPEC_ENDPOINT}'] = openapi.serve_spec
+    admin.init_app(app)
+    Migrate(app, db)
+    return app
@@ -1,7 +1,125 @@
+import hashlib
+from flask import Response, flash, stream_with_context
 from flask_admin import Admin
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import FilterEqual, FilterInList
 from src import app, User, db
+from src.bulk import export_users
+from src.cache import user_cache
+from src.passwords import hash_password, is_hashed
+from src.serializers import user_serializer
 
-admin = Admin(app, name='Admin Panel', template_mode='bootstrap4')
 
-admin.add_view(ModelView(User, db.session))
+class UserAdmin(ModelView):
+    """
+    User list that stays fast on a large table. Sorting and filtering are
+    limited to indexed columns, search goes through the user_search index,
+    totals come from the user cache instead of a COUNT(*) per page, and
+    moving to the next page continues from the last row of the page before
+    instead of skipping OFFSET rows. Bulk actions work through the ids
+    BULK_BATCH_SIZE at a time, one transaction each.
+    """
+    page_size = 50
+    column_list = ('id', 'username', 'email', 'first_name', 'last_name', 'is_admin', 'updated_at')
+    column_sortable_list = ('id', 'username', 'email')  # the primary key and unique indexes
+    column_searchable_list = ('username', 'email', 'first_name', 'last_name')
+    column_filters = (
+        FilterEqual(User.username, 'Username'),
+        FilterInList(User.username, 'Username'),
+        FilterEqual(User.email, 'Email'),
+        FilterInList(User.email, 'Email'),
+    )
+    form_excluded_columns = ('version', 'updated_at')
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        search = search.strip()
+        if len(search) >= 3 and db.engine.dialect.name == 'sqlite':
+            condition = db.text('"user".id IN (SELECT rowid FROM user_search WHERE user_search MATCH :match)')
+            condition = condition.bindparams(match='"' + search.replace('"', '""') + '"')
+        else:
+            pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            condition = User.username.ilike(f'{pattern}%', escape='\\')
+        return query.filter(condition), count_query.filter(condition), joins, count_joins
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        query, count_query, joins, count_joins = self.get_query(), self.get_count_query(), {}, {}
+        if search:
+            query, count_query, joins, count_joins = self._apply_search(
+                query, count_query, joins, count_joins, search)
+        if filters and self._filters:
+            query, count_query, joins, count_joins = self._apply_filters(
+                query, count_query, joins, count_joins, filters)
+
+        signature = hashlib.sha1(repr((search, filters)).encode()).hexdigest()
+        # Dropped by the next write to the user table, like the API's lists
+        count = user_cache.get_or_load(user_cache.list_key(f'admin:count:{signature}'), count_query.scalar)
+
+        sort_name = sort_column if sort_column in self.column_sortable_list else 'id'
+        column = getattr(User, sort_name)
+        query = query.order_by(column.desc() if sort_desc else column)
+        page_size = self.page_size if page_size is None else page_size
+        if page and page_size:
+            # Where the page before ended, known when it was the last one shown
+            boundary = user_cache.get(self.boundary_key(signature, sort_name, sort_desc, page - 1))
+            if boundary is None:
+                query = query.offset(page * page_size)
+            else:
+                query = query.filter(column < boundary if sort_desc else column > boundary)
+        if page_size:
+            query = query.limit(page_size)
+
+        if not execute:
+            return count, query
+        rows = query.all()
+        if page_size and len(rows) == page_size:
+            user_cache.set(self.boundary_key(signature, sort_name, sort_desc, page or 0),
+                           getattr(rows[-1], sort_name))
+        return count, rows
+
+    def boundary_key(self, signature, sort_name, sort_desc, page):
+        return f"admin:after:{signature}:{sort_name}:{int(bool(sort_desc))}:{page}"
+
+    def on_model_change(self, form, model, is_created):
+        # A password typed into the form, the hash shown on edit stays as is
+        if model.password and not is_hashed(model.password):
+            model.password = hash_password(model.password)
+
+    def after_model_change(self, form, model, is_created):
+        user_cache.invalidate(model.id)
+
+    def after_model_delete(self, model):
+        user_cache.invalidate(model.id)
+
+    @action('delete', 'Delete', 'Are you sure you want to delete selected records?')
+    def action_delete(self, ids):
+        ids = [int(user_id) for user_id in ids]
+        size = app.config['BULK_BATCH_SIZE']
+        deleted = 0
+        try:
+            for start in range(0, len(ids), size):
+                chunk = ids[start:start + size]
+                deleted += db.session.execute(db.delete(User).where(User.id.in_(chunk))).rowcount
+                db.session.commit()
+                user_cache.invalidate_many(chunk)
+        except Exception as error:
+            db.session.rollback()
+            if not self.handle_view_exception(error):
+                raise
+            flash(f'Deleted {deleted} users before failing: {error}', 'error')
+            return
+        flash(f'{deleted} users were successfully deleted.', 'success')
+
+    @action('export', 'Export CSV')
+    def action_export(self, ids):
+        fields = user_serializer.parse_fields(None)
+        chunks = export_users(fields, 'csv', app.config['BULK_BATCH_SIZE'],
+                              ids=[int(user_id) for user_id in ids])
+        return Response(stream_with_context(chunks), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=users.csv'})
+
+
+# Attached to the app by create_app
+admin = Admin(name='Admin Panel', template_mode='bootstrap4')
+
+admin.add_view(UserAdmin(User, db.session))
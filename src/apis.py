@@ -1,6 +1,24 @@
 import uuid
-from flask import request, jsonify
+from collections import namedtuple
+from sqlalchemy.exc import IntegrityError
+from flask import request, jsonify, Response, stream_with_context
 from src import app, db, User
+from src.models import read
+from src.pagination import encode_cursor, decode_cursor, clamp_limit, wants_count
+from src.cache import user_cache
+from src.serializers import user_serializer
+from src.conditional import (user_etag, list_etag, last_modified, is_conditional,
+                             not_modified, if_match_versions, conditional_response)
+from src.bulk import (read_rows, parse_bool, import_users, CSV_TYPES, NDJSON_TYPES,
+                      export_users, gzip_stream, EXPORT_TYPES)
+from src.outbox import validate_contact, enqueue, outbox_stats
+from src.subscriptions import normalize_email, subscriptions
+from src.batch import validate_batch, run_batch
+from src.auth import issue_token, current_claims, login_required
+from src.passwords import hash_password, verify_password, needs_rehash, upgrade_password, dummy_hash
+
+# (id, version) of a user, all list_etag needs
+UserVersion = namedtuple('UserVersion', 'id version')
 
 @app.route("/api")
 def api_home():
@@ -67,6 +85,10 @@ def add_user():
         description: User registered successfully
       400:
         description: User with this username or email already exists
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
+      503:
+        description: Too many passwords being hashed, retry after Retry-After seconds
     """
     # Get data from the incoming POST request
     data = request.get_json()
@@ -88,6 +110,8 @@ def add_user():
     if not password:
         return jsonify({"message": 'Password is required'}), 400
         
+    # Hashed on the password pool, a 503 when it is saturated
+    password_hash = hash_password(str(password))
 
     # Create a new user and save it to the database
     try:
@@ -96,22 +120,156 @@ def add_user():
                         first_name=first_name, 
                         last_name=last_name,
                         is_admin=is_admin,
-                        password=password)
+                        password=password_hash)
         db.session.add(new_user)
         db.session.commit()
+        user_cache.invalidate()
 
         # return jsonify({'message': 'User added successfully'}), 201
-        return jsonify(new_user), 201
+        return jsonify(user_serializer.dump(new_user)), 201
     except:
         return jsonify({'message': 'User with similar credentials already exists'}), 400
 
-@app.route("/api/subscribe")
+@app.route('/api/users/bulk', methods=['POST'])
+def bulk_add_users():
+    """
+    Import many users in one upload
+    ---
+    tags:
+      - Users
+    summary: Stream users in as NDJSON or CSV
+    notes: Rows are validated as they are read and inserted in batches, one transaction per batch. Bad rows are reported and skipped without aborting the import. A password may be sent already hashed (werkzeug's `scrypt:N:r:p$salt$hash`) and is stored as is; only BULK_MAX_PASSWORD_HASHES plain text passwords (2000 by default) are hashed per upload, later rows with one are rejected. Hash passwords beforehand for large imports.
+    consumes:
+      - application/x-ndjson
+      - text/csv
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: One JSON object per line, or CSV with a header row, using the same fields as POST /api/users
+        schema:
+          type: string
+          example: '{"username": "johndoe", "email": "johndoe@example.com", "first_name": "Maanda", "last_name": "Muleya", "password": "#Jopempe2043"}'
+      - name: batch_size
+        in: query
+        type: integer
+        required: false
+        description: Rows per transaction (default is 500, at most 5000)
+        example: 500
+    responses:
+      200:
+        description: Import summary
+        schema:
+          type: object
+          properties:
+            inserted:
+              type: integer
+              example: 998
+            failed:
+              type: integer
+              example: 2
+            errors:
+              type: array
+              items:
+                type: object
+                properties:
+                  row:
+                    type: integer
+                    example: 17
+                  error:
+                    type: string
+                    example: "User with this email already exists"
+            errors_truncated:
+              type: boolean
+              example: false
+      415:
+        description: Body is not NDJSON or CSV
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
+    """
+    if request.mimetype not in CSV_TYPES + NDJSON_TYPES:
+        return jsonify({'message': 'Send users as application/x-ndjson or text/csv'}), 415
+
+    batch_size = request.args.get('batch_size', app.config['BULK_BATCH_SIZE'], type=int)
+    batch_size = max(1, min(batch_size, 5000))
+
+    report = import_users(read_rows(request.stream, request.mimetype), batch_size,
+                          app.config['BULK_MAX_PASSWORD_HASHES'])
+    if report.inserted:
+        user_cache.invalidate()
+    return jsonify(report.to_dict()), 200
+
+@app.route('/api/users/export', methods=['GET'])
+def export_all_users():
+    """
+    Export all users
+    ---
+    tags:
+      - Users
+    summary: Stream every user as NDJSON or CSV
+    notes: Rows are streamed from the database in batches, so the size of the table does not matter. Send `Accept-Encoding gzip` for a gzipped body.
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [ndjson, csv]
+        required: false
+        description: Output format (default is ndjson)
+        example: csv
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma separated columns out of id, first_name, last_name, username, email, is_admin
+        example: id,username,email
+    responses:
+      200:
+        description: The users, one per line
+      400:
+        description: Unknown format or field
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_TYPES:
+        return jsonify({'message': 'Format must be ndjson or csv'}), 400
+    try:
+        fields = user_serializer.parse_fields(request.args.get('fields'))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    chunks = export_users(fields, fmt)
+    headers = {'Content-Disposition': f'attachment; filename=users.{fmt}'}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(stream_with_context(chunks), mimetype=EXPORT_TYPES[fmt],
+                    headers=headers)
+
+@app.route("/api/subscribe", methods=['GET', 'POST'])
 def subscribe():
     """
-    Simple Subscribe API
+    Subscribe to the newsletter
     ---
     tags:
       - Basic Views
+    summary: POST an email address to subscribe it
+    notes: Sign-ups are buffered in memory and stored in batches, so they show up in the database within SUBSCRIBE_FLUSH_INTERVAL seconds. Accepts JSON or a form post; form posts get a plain OK, which is what the site's form script expects. A GET only returns the message.
+    consumes:
+      - application/json
+      - multipart/form-data
+      - application/x-www-form-urlencoded
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          required:
+            - email
+          properties:
+            email:
+              type: string
+              example: johndoe@example.com
     responses:
       200:
         description: Returns a feedback message
@@ -121,10 +279,119 @@ def subscribe():
             message:
               type: string
               example: "You are now subscribed to our newsletter!."
+      202:
+        description: Subscription accepted
+      400:
+        description: Not a valid email address
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
     """
-    return jsonify({
-        "message": "You are now subscribed to our newsletter!."
-    })
+    if request.method == 'GET':
+        return jsonify({
+            "message": "You are now subscribed to our newsletter!."
+        })
+
+    form = not request.is_json
+    data = request.form if form else (request.get_json(silent=True) or {})
+    try:
+        email = normalize_email(data.get('email'))
+    except ValueError as error:
+        if form:
+            return Response(str(error), status=400, mimetype='text/plain')
+        return jsonify({'message': str(error)}), 400
+
+    subscriptions.add(email)
+    if form:
+        return Response('OK', status=202, mimetype='text/plain')
+    return jsonify({"message": "You are now subscribed to our newsletter!."}), 202
+
+@app.route('/api/contact', methods=['POST'])
+def submit_contact():
+    """
+    Send a message through the contact form
+    ---
+    tags:
+      - Basic Views
+    summary: Queue a contact form message for delivery
+    notes: The message is stored in an outbox and mailed by a background worker, so the response never waits for the mail server. Accepts JSON or a form post; form posts get a plain OK, which is what the site's form script expects.
+    consumes:
+      - application/json
+      - multipart/form-data
+      - application/x-www-form-urlencoded
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - name
+            - email
+            - subject
+            - message
+          properties:
+            name:
+              type: string
+              example: Maanda Muleya
+            email:
+              type: string
+              example: johndoe@example.com
+            subject:
+              type: string
+              example: Blocked drain
+            message:
+              type: string
+              example: The kitchen sink will not drain, can you come out this week?
+    responses:
+      202:
+        description: Message queued
+      400:
+        description: A field is missing, too long or not valid
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
+    """
+    form = not request.is_json
+    data = request.form if form else (request.get_json(silent=True) or {})
+    try:
+        fields = validate_contact(data)
+    except ValueError as error:
+        if form:
+            return Response(str(error), status=400, mimetype='text/plain')
+        return jsonify({'message': str(error)}), 400
+
+    message = enqueue(fields)
+    if form:
+        return Response('OK', status=202, mimetype='text/plain')
+    return jsonify({'message': 'Your message has been queued', 'id': message.id}), 202
+
+@app.route('/api/contact/stats', methods=['GET'])
+def contact_stats():
+    """
+    Contact outbox statistics
+    ---
+    tags:
+      - Basic Views
+    summary: Queue depth of the contact outbox and how far delivery is behind
+    responses:
+      200:
+        description: Outbox counters
+        schema:
+          type: object
+          properties:
+            pending:
+              type: integer
+              example: 2
+            sent:
+              type: integer
+              example: 120
+            failed:
+              type: integer
+              example: 0
+            oldest_pending_seconds:
+              type: number
+              example: 4.2
+    """
+    return jsonify(outbox_stats())
 
 @app.route('/api/users/<int:user_id>', methods=['GET'])
 def get_user_fast(user_id):
@@ -142,6 +409,12 @@ def get_user_fast(user_id):
         required: true
         description: The unique ID of the user
         example: 1
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma separated fields to return out of id, first_name, last_name, username, email, is_admin
+        example: id,username
     responses:
       200:
         description: User details retrieved successfully
@@ -163,14 +436,62 @@ def get_user_fast(user_id):
             email:
               type: string
               example: "cr56m@gms.com"
+      400:
+        description: Unknown field
       404:
         description: User not found
     """
+    try:
+        fields = user_serializer.parse_fields(request.args.get('fields'))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
 
-    user = User.query.get(user_id)  # Returns None if user not found
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    return jsonify(user)
+    # Only a narrowed projection needs its own tag
+    projection = fields if fields != user_serializer.fields else None
+
+    key = user_cache.user_key(user_id)
+    entry = user_cache.get(key)
+
+    if entry is None and is_conditional():
+        # Revalidation only needs the version, not the row
+        row = read(
+            db.select(User.version, User.updated_at).where(User.id == user_id)).first()
+        if not row:
+            return jsonify({'error': 'User not found'}), 404
+        etag = user_etag(user_id, row.version, projection)
+        modified = last_modified(row.updated_at)
+        if not_modified(etag, modified):
+            return conditional_response(None, etag, modified)
+
+    if entry is None:
+        generation = user_cache.generation()
+        entry = load_user(user_id)
+        if not entry:
+            return jsonify({'error': 'User not found'}), 404
+        user_cache.set(key, entry, generation)
+
+    return conditional_response(lambda: user_serializer.project(entry['user'], fields),
+                                user_etag(user_id, entry['version'], projection),
+                                entry['last_modified'])
+
+
+USER_ENTRY_COLUMNS = user_serializer.fields + ('version', 'updated_at')
+
+
+def load_user(user_id):
+    row = read(user_serializer.select(USER_ENTRY_COLUMNS).where(User.id == user_id)).first()
+    if not row:
+        return None
+    return user_entry(row)
+
+
+def user_entry(row):
+    # What the cache keeps per user
+    return {
+        'user': user_serializer.dump_row(row, user_serializer.fields),
+        'version': row.version,
+        'last_modified': last_modified(row.updated_at),
+    }
 
 # Delete User by ID
 @app.route('/api/users/<int:user_id>', methods=['DELETE'])
@@ -201,12 +522,11 @@ def delete_user(user_id):
       404:
         description: User not found
     """
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-    
-    db.session.delete(user)
+    deleted = db.session.execute(db.delete(User).where(User.id == user_id)).rowcount
     db.session.commit()
+    if not deleted:
+        return jsonify({'error': 'User not found'}), 404
+    user_cache.invalidate(user_id)
     
     return jsonify({'message': 'User deleted successfully'}), 200
 
@@ -259,36 +579,10 @@ def put_user(user_id):
         description: User not found
       400:
         description: Invalid request data
+      412:
+        description: The If-Match header no longer matches the user's ETag
     """
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-
-    data = request.get_json()
-    last_name = data.get('last_name')
-    first_name = data.get('first_name')
-    username = data.get('username')
-    email = data.get('email')
-    is_admin = data.get('is_admin')
-    password = data.get('password')
-
-    if username:
-        user.username = username
-    if email:
-        user.email = email
-    if first_name:
-        user.first_name = first_name
-    if last_name:
-        user.last_name = last_name
-
-    if password:
-        user.password = password
-    if is_admin:
-        user.is_admin = is_admin
-
-    db.session.commit()
-    
-    return jsonify({'message': 'User updated successfully', "user": user}), 200
+    return save_user(user_id)
 
 @app.route('/api/users/<int:user_id>', methods=['UPDATE'])
 def update_user(user_id):
@@ -338,37 +632,199 @@ def update_user(user_id):
         description: User not found
       400:
         description: Invalid request data
+      412:
+        description: The If-Match header no longer matches the user's ETag
     """
-    user = User.query.get(user_id)
-    if not user:
+    return save_user(user_id)
+
+@app.route('/api/users/<int:user_id>', methods=['PATCH'])
+def patch_user(user_id):
+    """
+    Partially update User by ID
+    ---
+    tags:
+      - Users
+    summary: Change only the supplied user fields
+    notes: Unlike PUT, every field present in the body is written, including false and empty values. Send If-Match with the user's ETag to avoid overwriting someone else's change.
+    parameters:
+      - name: user_id
+        in: path
+        type: integer
+        required: true
+        description: The unique ID of the user to update
+        example: 1
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            username:
+              type: string
+              example: "new_username"
+            email:
+              type: string
+              example: "new_email@example.com"
+            first_name:
+              type: string
+              example: "Pythongton"
+            last_name:
+              type: string
+              example: "Mudau"
+            is_admin:
+              type: boolean
+              example: false
+    responses:
+      200:
+        description: User updated successfully
+      404:
+        description: User not found
+      400:
+        description: Invalid request data
+      412:
+        description: The If-Match header no longer matches the user's ETag
+    """
+    return save_user(user_id, partial=True)
+
+
+# Columns a client may write through PUT, UPDATE and PATCH
+WRITABLE_FIELDS = ('username', 'email', 'first_name', 'last_name', 'password', 'is_admin')
+
+
+def save_user(user_id, partial=False):
+    """
+    Shared body of PUT, UPDATE and PATCH: one UPDATE ... RETURNING statement
+    that also checks If-Match, instead of loading the user first.
+
+    PUT and UPDATE skip empty values as they always have, PATCH writes every
+    field that is present in the body.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Invalid request data'}), 400
+
+    if partial:
+        changes = {field: data[field] for field in WRITABLE_FIELDS if field in data}
+        if any(value is None or value == '' for field, value in changes.items() if field != 'is_admin'):
+            return jsonify({'message': 'Fields cannot be empty'}), 400
+    else:
+        changes = {field: data[field] for field in WRITABLE_FIELDS if data.get(field)}
+    if 'is_admin' in changes:
+        changes['is_admin'] = parse_bool(changes['is_admin'])
+    if 'password' in changes:
+        changes['password'] = hash_password(str(changes['password']))
+
+    columns = user_serializer.columns() + [User.version, User.updated_at]
+    if changes:
+        statement = (db.update(User)
+                     .where(User.id == user_id)
+                     .values(version=User.version + 1, **changes)
+                     .returning(*columns))
+    else:
+        statement = db.select(*columns).where(User.id == user_id)
+
+    versions = if_match_versions(user_id)
+    if versions is not None:
+        statement = statement.where(User.version.in_(versions))
+
+    try:
+        row = db.session.execute(statement).first()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': 'User with similar credentials already exists'}), 400
+
+    if row is None:
+        exists = versions is not None and db.session.execute(
+            db.select(User.id).where(User.id == user_id)).first()
+        if exists:
+            return jsonify({'error': 'User was changed by someone else'}), 412
         return jsonify({'error': 'User not found'}), 404
 
-    data = request.get_json()
-    last_name = data.get('last_name')
-    first_name = data.get('first_name')
-    username = data.get('username')
-    email = data.get('email')
+    if changes:
+        user_cache.invalidate(user_id)
+    return conditional_response({'message': 'User updated successfully', "user": user_serializer.dump(row)},
+                                user_etag(user_id, row.version), last_modified(row.updated_at))
+
+
+@app.route('/api/login', methods=['POST'])
+def login():
+    """
+    Log in
+    ---
+    tags:
+      - Users
+    summary: Exchange a username (or email) and password for an access token
+    notes: Send the token as `Authorization Bearer <token>`. It is signed with the app's secret key and expires after TOKEN_MAX_AGE seconds; checking it needs no database lookup.
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - username
+            - password
+          properties:
+            username:
+              type: string
+              example: johndoe
+            password:
+              type: string
+              example: "#Jopempe2043"
+    responses:
+      200:
+        description: Access token
+        schema:
+          type: object
+          properties:
+            access_token:
+              type: string
+            token_type:
+              type: string
+              example: Bearer
+            expires_in:
+              type: integer
+              example: 3600
+      400:
+        description: Username or password missing
+      401:
+        description: Wrong username or password
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
+      503:
+        description: Too many passwords being checked, retry after Retry-After seconds
+    """
+    data = request.get_json(silent=True) or {}
+    login_name = data.get('username') or data.get('email')
     password = data.get('password')
-    is_admin = data.get('is_admin')
+    if not isinstance(login_name, str) or not isinstance(password, str) or not password:
+        return jsonify({'message': 'Username and password are required'}), 400
 
-    if username:
-        user.username = username
-    if email:
-        user.email = email
-    if first_name:
-        user.first_name = first_name
-    if last_name:
-        user.last_name = last_name
-    if password:
-        user.password = password
-    if is_admin:
-        user.is_admin = is_admin
+    user = read(
+        db.select(User.id, User.password, User.is_admin)
+        .where((User.username == login_name) | (User.email == login_name))).first()
+    # A hash is checked even without a user, or the response time would tell
+    # which usernames exist
+    matched = verify_password(user.password if user else dummy_hash(), password)
+    if not user or not matched:
+        return jsonify({'message': 'Invalid username or password'}), 401
+    if needs_rehash(user.password):
+        # Plain text from before hashing, or older cost parameters
+        upgrade_password(user.id, user.password, password)
+
+    return jsonify({
+        'access_token': issue_token(user.id, user.is_admin),
+        'token_type': 'Bearer',
+        'expires_in': app.config['TOKEN_MAX_AGE'],
+    })
+
+
+ME_FIELDS = ('id', 'username', 'email')
 
-    db.session.commit()
-    
-    return jsonify({'message': 'User updated successfully', "user": user}), 200
 
 @app.route('/api/users/me', methods=['GET'])
+@login_required
 def get_my_profile():
     """
     Get my profile
@@ -376,6 +832,7 @@ def get_my_profile():
     tags:
       - Users
     summary: Retrieve details of the currently authenticated user
+    notes: Needs `Authorization Bearer <token>` from POST /api/login. The user comes from the token and the shared user cache, so this usually runs no query at all.
     responses:
       200:
         description: User profile details
@@ -391,32 +848,51 @@ def get_my_profile():
             email:
               type: string
               example: johndoe@example.com
+      401:
+        description: Missing, invalid or expired token
+      404:
+        description: The token's user no longer exists
     """
-    # In a real app, you'd extract the logged-in user from a JWT token
-    # Example: user_id = get_jwt_identity()
-    user = User.query.first()  # Simulate getting the logged-in user
-    
-    return jsonify({'id': user.id, 'username': user.username, 'email': user.email})
+    user_id = current_claims()['sub']
+    entry = user_cache.get_or_load(user_cache.user_key(user_id), lambda: load_user(user_id))
+    if not entry:
+        return jsonify({'error': 'User not found'}), 404
+
+    return conditional_response(lambda: user_serializer.project(entry['user'], ME_FIELDS),
+                                user_etag(user_id, entry['version'], ME_FIELDS),
+                                entry['last_modified'])
 
 
 @app.route('/api/users/search', methods=['GET'])
 def search_users():
     """
-    Search users by username
+    Search users by username, email or name
     ---
     tags:
       - Users
-    summary: Find users by a partial username
+    summary: Find users by part of their username, email, first or last name
+    notes: Results are ranked by relevance and capped by `limit`. Pass `after` (empty for the first page) to page through them with `next_cursor`.
     parameters:
       - name: query
         in: query
         type: string
         required: true
-        description: Part of the username to search for
+        description: Text to search for. From 3 characters a case-insensitive substring match, shorter queries match the start of usernames case-sensitively
         example: john
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: The maximum number of results (default is 20, at most 100)
+        example: 20
+      - name: after
+        in: query
+        type: string
+        required: false
+        description: Opaque cursor from a previous `next_cursor`, or empty for the first page
     responses:
       200:
-        description: List of matching users
+        description: List of matching users, or in cursor mode an object with `users` and `next_cursor`
         schema:
           type: array
           items:
@@ -431,14 +907,90 @@ def search_users():
               email:
                 type: string
                 example: johndoe@example.com
+      400:
+        description: Invalid cursor
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
     """
-    query = request.args.get('query', '')
-    
-    users = User.query.filter(User.username.ilike(f"%{query}%")).all()
-    
-    return jsonify([
-        {'id': user.id, 'username': user.username, 'email': user.email} for user in users
-    ])
+    query = request.args.get('query', '').strip()
+    limit = clamp_limit(request.args.get('limit', type=int), default=20)
+
+    after = None
+    if request.args.get('after'):
+        try:
+            score, after_id = decode_cursor(request.args['after'])
+            after = (float(score), int(after_id))
+        except (ValueError, TypeError):
+            return jsonify({'message': 'Invalid cursor'}), 400
+
+    rows = rank_users(query, limit + 1, after)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    users = [{'id': row.id, 'username': row.username, 'email': row.email} for row in rows]
+    if 'after' not in request.args:
+        return jsonify(users)
+
+    last = rows[-1] if has_more else None
+    return jsonify({
+        'users': users,
+        'next_cursor': encode_cursor(last.score, last.id) if last else None,
+    })
+
+
+def rank_users(query, limit, after=None):
+    """
+    Best matches first, as (id, username, email, score) rows ordered by
+    (score, id), or by username for prefixes.
+
+    Uses the user_search trigram index on SQLite. Queries shorter than a
+    trigram match username prefixes through the username index, other
+    databases fall back to a plain LIKE. Both score 0.
+    """
+    if len(query) >= 3 and db.engine.dialect.name == 'sqlite':
+        # bm25 is negative and smaller for better matches; username hits weigh most
+        sql = """
+            SELECT id, username, email, score FROM (
+                SELECT u.id AS id, u.username AS username, u.email AS email,
+                       bm25(user_search, 10.0, 5.0, 1.0, 1.0) AS score
+                FROM user_search JOIN "user" AS u ON u.id = user_search.rowid
+                WHERE user_search MATCH :match
+            )
+            WHERE :after_score IS NULL OR score > :after_score
+               OR (score = :after_score AND id > :after_id)
+            ORDER BY score, id
+            LIMIT :limit
+        """
+        return read(db.text(sql), {
+            'match': '"' + query.replace('"', '""') + '"',
+            'after_score': after[0] if after else None,
+            'after_id': after[1] if after else None,
+            'limit': limit,
+        }).all()
+
+    columns = (User.id, User.username, User.email, db.literal(0.0).label('score'))
+    if len(query) < 3:
+        # A range on the username index, so type-ahead's first keystrokes
+        # cost the same however many users there are. Case-sensitive, unlike
+        # the trigram search. Ordered by username, which is unique, so the
+        # page after a cursor starts after its user's username.
+        statement = (db.select(*columns)
+                     .where(User.username >= query, User.username < query + '\U0010ffff')
+                     .order_by(User.username)
+                     .limit(limit))
+        if after:
+            statement = statement.where(
+                User.username > db.select(User.username).where(User.id == after[1]).scalar_subquery())
+        return read(statement).all()
+
+    pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    statement = (db.select(*columns)
+                 .where(User.username.ilike(f'%{pattern}%', escape='\\'))
+                 .order_by(User.id)
+                 .limit(limit))
+    if after:
+        statement = statement.where(User.id > after[1])
+    return read(statement).all()
 
 @app.route('/api/users', methods=['GET'])
 def get_users():
@@ -448,6 +1000,7 @@ def get_users():
     tags:
       - Users
     summary: Retrieve a list of users
+    notes: Pass `after` (empty for the first page) to switch to cursor paging, which costs the same for every page.
     parameters:
       - name: page
         in: query
@@ -459,11 +1012,34 @@ def get_users():
         in: query
         type: integer
         required: false
-        description: The number of users per page (default is 10)
+        description: The number of users per page (default is 10, at most 100 in cursor mode)
         example: 10
+      - name: after
+        in: query
+        type: string
+        required: false
+        description: Opaque cursor from a previous `next_cursor`, or empty for the first page
+      - name: count
+        in: query
+        type: boolean
+        required: false
+        description: Include the total number of users in cursor mode
+        example: false
+      - name: ids
+        in: query
+        type: string
+        required: false
+        description: Comma separated ids (at most 100) to fetch just those users in one query; the response is an object with `users` in the order asked for and the `missing` ids
+        example: 1,2,3
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma separated fields to return out of id, first_name, last_name, username, email, is_admin
+        example: id,username
     responses:
       200:
-        description: A list of users
+        description: A list of users, or in cursor mode an object with `users`, `next_cursor` and optionally `count`, or with `ids` an object with `users` and `missing`
         schema:
           type: array
           items:
@@ -478,13 +1054,237 @@ def get_users():
               email:
                 type: string
                 example: johndoe@example.com
+      400:
+        description: Invalid cursor, ids or unknown field
     """
+    try:
+        fields = user_serializer.parse_fields(request.args.get('fields'))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    if 'ids' in request.args:
+        try:
+            ids = parse_ids(request.args['ids'])
+        except ValueError as error:
+            return jsonify({'message': str(error)}), 400
+        return get_users_by_ids(ids, fields)
+
+    if 'after' in request.args:
+        after_id = None
+        if request.args['after']:
+            try:
+                (after_id,) = decode_cursor(request.args['after'])
+                after_id = int(after_id)
+            except (ValueError, TypeError):
+                return jsonify({'message': 'Invalid cursor'}), 400
+        limit = clamp_limit(request.args.get('limit', type=int))
+        count = wants_count()
+
+        # Fetch one extra row to find out whether there is a next page
+        statement = db.select(User).order_by(User.id).limit(limit + 1)
+        if after_id is not None:
+            statement = statement.where(User.id > after_id)
+
+        key = user_cache.list_key(f"after:{after_id}:{limit}:{count}:{','.join(fields)}")
+        return list_response(key, statement, fields,
+                             lambda rows: get_users_after(rows, limit, fields, count),
+                             revalidate=not count)
+
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 10, type=int)
-    
-    users = User.query.paginate(page=page, per_page=limit, error_out=False)
-    
-    return jsonify([
+
+    # Same defaults as paginate(error_out=False), without its COUNT(*)
+    page = max(page, 1)
+    limit = limit if limit > 0 else 20
+    statement = db.select(User).order_by(User.id).limit(limit).offset((page - 1) * limit)
+
+    key = user_cache.list_key(f"page:{page}:{limit}:{','.join(fields)}")
+    return list_response(key, statement, fields, lambda rows: [
         # {'id': user.id, 'username': user.username, 'email': user.email} 
-        user for user in users.items
+        user_serializer.dump(row, fields) for row in rows
     ])
+
+
+def parse_ids(value):
+    """
+    Distinct ids out of "1,2,3", in the order given
+    """
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except ValueError:
+        raise ValueError('ids must be comma separated integers')
+    if not ids:
+        raise ValueError('ids must be comma separated integers')
+    if len(ids) > app.config['USERS_MAX_IDS']:
+        raise ValueError(f"At most {app.config['USERS_MAX_IDS']} ids per request")
+    return ids
+
+
+def get_users_by_ids(ids, fields):
+    """
+    Users by id in the order asked for. Cached users come from one cache
+    lookup, all the others from one IN query, instead of a request each.
+    """
+    keys = {user_id: user_cache.user_key(user_id) for user_id in ids}
+    cached = user_cache.get_many(list(keys.values()))
+    entries = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+
+    missing = [user_id for user_id in ids if user_id not in entries]
+    if missing:
+        generation = user_cache.generation()
+        loaded = {row.id: user_entry(row) for row in read(
+            user_serializer.select(USER_ENTRY_COLUMNS).where(User.id.in_(missing)))}
+        user_cache.set_many({keys[user_id]: entry for user_id, entry in loaded.items()}, generation)
+        entries.update(loaded)
+
+    found = [user_id for user_id in ids if user_id in entries]
+    etag = list_etag([UserVersion(user_id, entries[user_id]['version']) for user_id in found],
+                     ','.join(fields), 'ids', ','.join(map(str, ids)))
+    return conditional_response(lambda: {
+        'users': [user_serializer.project(entries[user_id]['user'], fields) for user_id in found],
+        'missing': [user_id for user_id in ids if user_id not in entries],
+    }, etag)
+
+
+def get_users_after(rows, limit, fields, count):
+    """
+    Keyset page of users ordered by primary key, so page 1000 costs the same as page 1
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    response = {
+        'users': [user_serializer.dump(row, fields) for row in rows],
+        'next_cursor': encode_cursor(rows[-1].id) if has_more else None,
+    }
+    if count:
+        response['count'] = read(db.select(db.func.count(User.id))).scalar()
+    return response
+
+
+def list_response(key, statement, fields, build, revalidate=True):
+    """
+    Serve a list of users from the cache or the database with an ETag built
+    from the (id, version) of its rows.
+
+    statement picks the rows. A conditional request that misses the cache
+    first runs it for just id and version, and answers 304 without loading
+    or encoding the rows when the client's copy is current.
+    """
+    validators = (User.id, User.version, User.updated_at)
+    entry = user_cache.get(key)
+
+    if entry is None and revalidate and is_conditional():
+        rows = read(statement.with_only_columns(*validators)).all()
+        etag = list_etag(rows, ','.join(fields), '')
+        if not_modified(etag):
+            return conditional_response(None, etag, last_modified(*(row.updated_at for row in rows)))
+
+    if entry is None:
+        columns = dict.fromkeys(user_serializer.columns(fields) + list(validators))
+        rows = read(statement.with_only_columns(*columns)).all()
+        body = build(rows)
+        entry = {
+            'body': body,
+            # count is only known after the load, so it joins the tag here
+            'etag': list_etag(rows, ','.join(fields), body.get('count', '') if isinstance(body, dict) else ''),
+            'last_modified': last_modified(*(row.updated_at for row in rows)),
+        }
+        user_cache.set(key, entry)
+
+    return conditional_response(entry['body'], entry['etag'], entry['last_modified'],
+                                check_modified=False)
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Run several API requests in one
+    ---
+    tags:
+      - Basic Views
+    summary: Send up to 20 API requests in one exchange
+    notes: Each item runs in order against the normal routes, with the batch's Authorization header unless it brings its own, and gets its own status. One failing item does not affect the others.
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - requests
+          properties:
+            requests:
+              type: array
+              items:
+                type: object
+                required:
+                  - path
+                properties:
+                  method:
+                    type: string
+                    example: GET
+                  path:
+                    type: string
+                    example: /api/users/1?fields=id,username
+                  headers:
+                    type: object
+                    example: {"If-None-Match": '"user-1-v3"'}
+                  body:
+                    type: object
+    responses:
+      200:
+        description: One result per request, in order
+        schema:
+          type: object
+          properties:
+            responses:
+              type: array
+              items:
+                type: object
+                properties:
+                  status:
+                    type: integer
+                    example: 200
+                  headers:
+                    type: object
+                    example: {"ETag": '"user-1-v3"'}
+                  body:
+                    type: object
+      400:
+        description: Not a list of requests, too many, or a path outside /api/
+      429:
+        description: Too many requests from this client, retry after Retry-After seconds
+    """
+    try:
+        items = validate_batch(request.get_json(silent=True))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+    return jsonify({'responses': run_batch(items, request.headers, request.remote_addr)})
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    User cache statistics
+    ---
+    tags:
+      - Basic Views
+    summary: Hit and miss counters of the shared user cache, summed over all workers
+    responses:
+      200:
+        description: Cache counters
+        schema:
+          type: object
+          properties:
+            hits:
+              type: integer
+              example: 950
+            misses:
+              type: integer
+              example: 50
+            hit_ratio:
+              type: number
+              example: 0.95
+    """
+    return jsonify(user_cache.stats())
@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import click
+from flask import request, send_from_directory
+from werkzeug.exceptions import NotFound
+from decouple import config
+from src import app
+from src.pages import brotli, page_cache
+
+# Content-hashed copies of src/static, written by `flask assets`
+app.config['ASSETS_DIR'] = config('ASSETS_DIR', default=os.path.join(os.path.dirname(app.root_path), 'build', 'static'))
+
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Worth precompressing, images and fonts like woff2 are compressed already
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.txt', '.xml', '.ttf', '.eot', '.otf')
+# Sources that are never served
+SKIP_DIRS = ('scss',)
+
+
+class AssetManifest:
+    """
+    Maps static filenames to their content-hashed names and back. Loaded from
+    ASSETS_DIR/manifest.json the first time it is needed. Without a build
+    every lookup misses and static files are served as before.
+    """
+
+    def __init__(self):
+        self.assets = None
+        self.originals = None
+        self.version = None
+
+    def load(self):
+        path = os.path.join(app.config['ASSETS_DIR'], MANIFEST)
+        try:
+            with open(path) as file:
+                assets = json.load(file)
+        except (OSError, ValueError):
+            assets = {}
+        self.assets = assets
+        self.originals = {hashed: name for name, hashed in assets.items()}
+        self.version = hashlib.sha1(json.dumps(assets, sort_keys=True).encode()).hexdigest()
+        # Rendered pages hold asset URLs from the previous manifest
+        page_cache.clear()
+
+    def hashed(self, filename):
+        if self.assets is None:
+            self.load()
+        return self.assets.get(filename)
+
+    def original(self, filename):
+        if self.originals is None:
+            self.load()
+        return self.originals.get(filename)
+
+
+asset_manifest = AssetManifest()
+
+
+def hashed_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{digest[:12]}{ext}'
+
+
+def build_assets(static_dir, output_dir):
+    """
+    Copy every static file to output_dir under a content-hashed name, with
+    .gz/.br siblings for text assets, and write the manifest. Files whose
+    hashed copy already exists are left alone. Returns (manifest, written).
+    """
+    manifest, written = {}, 0
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as file:
+                data = file.read()
+
+            hashed = hashed_name(filename, hashlib.sha256(data).hexdigest())
+            manifest[filename] = hashed
+            target = os.path.join(output_dir, hashed)
+            if os.path.exists(target):
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if filename.endswith(COMPRESSIBLE):
+                with open(target + '.gz', 'wb') as file:
+                    file.write(gzip.compress(data, 9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as file:
+                        file.write(brotli.compress(data, quality=11))
+            written += 1
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest, written
+
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    """
+    Make url_for('static', filename=...) point at the hashed copy
+    """
+    if endpoint == 'static' and 'filename' in values:
+        hashed = asset_manifest.hashed(values['filename'])
+        if hashed:
+            values['filename'] = hashed
+
+
+def send_precompressed(directory, filename, mimetype):
+    """
+    A content-hashed file as immutable, or its .br/.gz sibling when there is
+    one and the client accepts it
+    """
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz'), (None, '')):
+        if encoding and not (request.accept_encodings[encoding]
+                             and os.path.exists(os.path.join(directory, filename + suffix))):
+            continue
+        response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        break
+
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def serve_static(filename):
+    """
+    Hashed names are served from ASSETS_DIR as immutable, precompressed when
+    the client accepts it. Anything else is a plain static file.
+    """
+    original = asset_manifest.original(filename)
+    if original is None:
+        return app.send_static_file(filename)
+
+    mimetype = mimetypes.guess_type(original)[0] or 'application/octet-stream'
+    try:
+        return send_precompressed(app.config['ASSETS_DIR'], filename, mimetype)
+    except NotFound:
+        # The manifest is there but the build is gone
+        return app.send_static_file(original)
+
+
+app.view_functions['static'] = serve_static
+
+
+@app.cli.command('assets')
+@click.option('--output', default=None, help='Directory to write to, defaults to ASSETS_DIR.')
+def assets_command(output):
+    """Write content-hashed, precompressed copies of src/static."""
+    output = output or app.config['ASSETS_DIR']
+    manifest, written = build_assets(app.static_folder, output)
+    click.echo(f'{len(manifest)} assets, {written} new, written to {output}')
@@ -0,0 +1,59 @@
+from functools import wraps
+from flask import g, request, jsonify
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from decouple import config
+from src import app
+
+# Seconds an access token from POST /api/login stays valid
+app.config['TOKEN_MAX_AGE'] = config('TOKEN_MAX_AGE', default=3600, cast=int)
+
+TOKEN_SALT = 'access-token'
+
+
+def token_serializer():
+    # Built per call so a changed SECRET_KEY (tests, key rotation) takes effect
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def issue_token(user_id, is_admin=False):
+    """
+    Signed, timestamped access token carrying the user's id and admin flag
+    """
+    return token_serializer().dumps({'sub': user_id, 'adm': bool(is_admin)})
+
+
+def verify_token(token):
+    """
+    The claims of a valid token, checked against SECRET_KEY and
+    TOKEN_MAX_AGE only, so no database is involved. None when the token is
+    forged, mangled or expired.
+    """
+    try:
+        claims = token_serializer().loads(token, max_age=app.config['TOKEN_MAX_AGE'])
+    except (SignatureExpired, BadSignature):
+        return None
+    return claims if isinstance(claims, dict) and isinstance(claims.get('sub'), int) else None
+
+
+def current_claims():
+    """
+    Claims of the request's Bearer token, worked out once per request
+    """
+    if 'claims' not in g:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        g.claims = verify_token(token.strip()) if scheme.lower() == 'bearer' and token else None
+    return g.claims
+
+
+def login_required(view):
+    """
+    401 with a Bearer challenge unless the request carries a valid token
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_claims() is None:
+            response = jsonify({'message': 'A valid access token is required'})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        return view(*args, **kwargs)
+    return wrapper
@@ -1,5 +1,4 @@
 from flask import Flask
-from flasgger import Swagger
 from decouple import config
 
 app = Flask(__name__, 
@@ -32,8 +31,47 @@ template = {
 }
 
 
+app.config['SQLALCHEMY_DATABASE_URI'] = config('DATABASE_URL', default='sqlite:///adventure.db')  # Using SQLite
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Optional but recommended
+# An in-memory database lives in one connection, so it gets neither a pool
+# nor a second engine to read through
+IN_MEMORY_DB = app.config['SQLALCHEMY_DATABASE_URI'] in ('sqlite://', 'sqlite:///:memory:') or \
+    'mode=memory' in app.config['SQLALCHEMY_DATABASE_URI']
 
-swagger = Swagger(app, template=template)
+# Every gunicorn worker gets its own pool, with a connection for each of
+# its threads (settings/gunicorn.conf.py) between pool and overflow.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': False}
+if not IN_MEMORY_DB:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': config('DB_POOL_SIZE', default=4, cast=int),
+        'max_overflow': config('DB_MAX_OVERFLOW', default=4, cast=int),
+        'pool_timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+    })
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///adventure.db'  # Using SQLite
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Optional but recommended
\ No newline at end of file
+# Applied to every new SQLite connection, see src/models.py. WAL lets
+# readers carry on while a writer holds the lock, and busy_timeout makes
+# writers wait for each other instead of failing with "database is locked".
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='WAL'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),  # ms
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=268435456, cast=int),  # bytes
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-20000, cast=int),  # negative means KiB
+    'temp_store': 'MEMORY',
+}
+
+# GET endpoints read through a second engine whose connections are
+# query_only, so reads never wait for a pooled connection held by a writer
+if config('DB_READ_ENGINE', default=True, cast=bool) and not IN_MEMORY_DB and \
+        app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:///'):
+    app.config['SQLALCHEMY_BINDS'] = {'readonly': app.config['SQLALCHEMY_DATABASE_URI']}
+
+# Rows per transaction for POST /api/users/bulk
+app.config['BULK_BATCH_SIZE'] = config('BULK_BATCH_SIZE', default=500, cast=int)
+# Plain text passwords one upload may hash, about 30 s of scrypt at the bulk
+# cost. Rows past it are rejected, send their passwords already hashed.
+app.config['BULK_MAX_PASSWORD_HASHES'] = config('BULK_MAX_PASSWORD_HASHES', default=2000, cast=int)
+
+# Most ids GET /api/users?ids= resolves, and sub-requests POST /api/batch runs, per call
+app.config['USERS_MAX_IDS'] = config('USERS_MAX_IDS', default=100, cast=int)
+app.config['BATCH_MAX_REQUESTS'] = config('BATCH_MAX_REQUESTS', default=20, cast=int)
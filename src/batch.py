@@ -0,0 +1,75 @@
+import json
+from werkzeug.test import EnvironBuilder
+from src import app
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'UPDATE')
+# Passed on from the batch request to every sub-request
+INHERITED_HEADERS = ('Authorization', 'Cookie', 'X-Forwarded-For', 'X-Real-IP')
+# Where the client is, always the batch request's: the rate limiter keys on
+# them, so a sub-request setting its own would get a bucket of its own
+CLIENT_HEADERS = ('x-forwarded-for', 'x-real-ip')
+# Sub-request headers worth handing back
+RETURNED_HEADERS = ('ETag', 'Last-Modified', 'Location', 'Retry-After')
+
+
+def validate_batch(data):
+    """
+    The list of sub-requests in a POST /api/batch body, or ValueError
+    """
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError('requests must be a non-empty list')
+    if len(items) > app.config['BATCH_MAX_REQUESTS']:
+        raise ValueError(f"At most {app.config['BATCH_MAX_REQUESTS']} requests per batch")
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise ValueError(f'requests[{index}] needs a path')
+        if item.get('method', 'GET').upper() not in METHODS:
+            raise ValueError(f'requests[{index}] has an unsupported method')
+        path = item['path'].split('?')[0]
+        if not path.startswith('/api/') or path.rstrip('/') == '/api/batch':
+            raise ValueError(f'requests[{index}] must be an /api/ path other than /api/batch')
+        if not isinstance(item.get('headers', {}), dict):
+            raise ValueError(f'requests[{index}] headers must be an object')
+    return items
+
+
+def run_batch(items, headers, remote_addr):
+    """
+    Run each sub-request through the app in order, as if it had come in on
+    its own from the same client, and collect {status, headers, body} for
+    each. A failing item does not stop the ones after it.
+    """
+    inherited = {name: headers[name] for name in INHERITED_HEADERS if name in headers}
+    return [run_one(item, inherited, remote_addr) for item in items]
+
+
+def run_one(item, inherited, remote_addr):
+    path, _, query = item['path'].partition('?')
+    own = {name: value for name, value in item.get('headers', {}).items() if name.lower() not in CLIENT_HEADERS}
+    builder = EnvironBuilder(
+        path=path,
+        query_string=query,
+        method=item.get('method', 'GET').upper(),
+        headers={**inherited, **own},
+        json=item['body'] if 'body' in item else None,
+        environ_base={'REMOTE_ADDR': remote_addr},
+    )
+    try:
+        # An app context of its own, or the sub-request would find the token
+        # claims and metrics the one before it left in g
+        with app.app_context():
+            response = app.response_class.from_app(app.wsgi_app, builder.get_environ(), buffered=True)
+    finally:
+        builder.close()
+
+    data = response.get_data(as_text=True)
+    if response.is_json:
+        body = json.loads(data) if data else None
+    else:
+        body = data or None
+    return {
+        'status': response.status_code,
+        'headers': {name: response.headers[name] for name in RETURNED_HEADERS if name in response.headers},
+        'body': body,
+    }
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+import zlib
+from sqlalchemy.exc import IntegrityError
+from src import db, User
+from src.models import read
+from src.serializers import user_serializer
+from src.passwords import hash_passwords, is_hashed, is_valid_hash
+
+# Only this many row errors are echoed back, the rest are just counted
+MAX_REPORTED_ERRORS = 100
+
+REQUIRED_FIELDS = ('username', 'email', 'password', 'first_name', 'last_name')
+
+CSV_TYPES = ('text/csv',)
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+EXPORT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def read_rows(stream, mimetype):
+    """
+    Yield (row number, dict) pairs from an NDJSON or CSV upload one line at a
+    time. Lines that cannot be parsed come through as (row number, error).
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    if mimetype in CSV_TYPES:
+        for row_no, row in enumerate(csv.DictReader(text), start=1):
+            yield row_no, row
+        return
+
+    for row_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield row_no, 'Invalid JSON'
+            continue
+        yield row_no, row if isinstance(row, dict) else 'Each line must be a JSON object'
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def validate_row(row):
+    """
+    Returns (values, None) for a row we can insert, or (None, error message)
+    """
+    if isinstance(row, str):
+        return None, row
+
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        return None, f"{', '.join(missing)} required"
+
+    values = {field: str(row[field]).strip() for field in REQUIRED_FIELDS}
+    if is_hashed(values['password']) and not is_valid_hash(values['password']):
+        return None, 'password looks like a hash but is not a valid one'
+    values['is_admin'] = parse_bool(row.get('is_admin', False))
+    return values, None
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.to_hash = 0
+
+    def error(self, row_no, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_no, 'error': message})
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def import_users(rows, batch_size, max_hashes):
+    """
+    Validate rows as they stream in and insert them batch_size at a time, one
+    transaction per batch. Only the current batch is ever held in memory.
+    Passwords already hashed (werkzeug's method$salt$hash) are stored as they
+    are, so a large import costs no hashing. Only max_hashes plain text ones
+    are hashed, the rows after that are rejected: hashing is what would
+    keep the request running for minutes.
+    """
+    report = ImportReport()
+    batch = []
+
+    for row_no, row in rows:
+        values, error = validate_row(row)
+        if not error and not is_hashed(values['password']):
+            if report.to_hash >= max_hashes:
+                error = f'Only {max_hashes} plain text passwords per upload, send the rest hashed'
+            else:
+                report.to_hash += 1
+        if error:
+            report.error(row_no, error)
+            continue
+        batch.append((row_no, values))
+        if len(batch) >= batch_size:
+            insert_batch(batch, report)
+            batch = []
+
+    if batch:
+        insert_batch(batch, report)
+    return report
+
+
+def insert_batch(batch, report):
+    usernames = {values['username'] for _, values in batch}
+    emails = {values['email'] for _, values in batch}
+
+    # One query finds every row in this batch that clashes with the table
+    taken = db.session.execute(
+        db.select(User.username, User.email)
+        .where(User.username.in_(usernames) | User.email.in_(emails))
+    ).all()
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email for _, email in taken}
+
+    accepted = []
+    for row_no, values in batch:
+        if values['username'] in taken_usernames:
+            report.error(row_no, 'User with this username already exists')
+        elif values['email'] in taken_emails:
+            report.error(row_no, 'User with this email already exists')
+        else:
+            # Also catches duplicates between rows of the same batch
+            taken_usernames.add(values['username'])
+            taken_emails.add(values['email'])
+            accepted.append((row_no, values))
+
+    if not accepted:
+        return
+
+    # Only rows that will be inserted are worth the hashing time
+    plain = [values for _, values in accepted if not is_hashed(values['password'])]
+    for values, password_hash in zip(plain, hash_passwords([values['password'] for values in plain])):
+        values['password'] = password_hash
+
+    try:
+        db.session.execute(db.insert(User), [values for _, values in accepted])
+        db.session.commit()
+        report.inserted += len(accepted)
+    except IntegrityError:
+        # Somebody else inserted a clashing user meanwhile, retry row by row
+        db.session.rollback()
+        for row_no, values in accepted:
+            try:
+                db.session.execute(db.insert(User), values)
+                db.session.commit()
+                report.inserted += 1
+            except IntegrityError:
+                db.session.rollback()
+                report.error(row_no, 'User with similar credentials already exists')
+
+
+def export_users(fields, fmt, batch_size=1000, ids=None):
+    """
+    Yield the whole user table, or the users in ids, as encoded NDJSON or CSV
+    chunks, one chunk per batch_size rows. Rows are fetched with yield_per so
+    only one batch is ever loaded.
+    """
+    statement = (user_serializer.select(fields)
+                 .order_by(User.id)
+                 .execution_options(yield_per=batch_size))
+    if ids is not None:
+        statement = statement.where(User.id.in_(ids))
+    result = read(statement)
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for partition in result.partitions():
+            writer.writerows(partition)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+        return
+
+    for partition in result.partitions():
+        yield ''.join(json.dumps(user_serializer.dump_row(row, fields)) + '\n' for row in partition).encode()
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Gzip a stream of byte chunks without buffering the whole body
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
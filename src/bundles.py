@@ -0,0 +1,341 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+from html.parser import HTMLParser
+import click
+from flask import request, url_for
+from markupsafe import Markup
+from decouple import config
+from src import app
+from src.pages import brotli, page_cache, page_routes, render_uncached
+from src.assets import asset_manifest, send_precompressed
+from src.images import image_manifest
+from src.storage import atomic_write
+
+# One CSS and one JS bundle per set of vendors a page needs, written by `flask bundles`
+app.config['BUNDLES_DIR'] = config('BUNDLES_DIR', default=os.path.join(os.path.dirname(app.root_path), 'build', 'static', 'bundles'))
+
+MANIFEST = 'bundles.json'
+
+# In load order. A vendor goes into a page's bundle when the page has the
+# marker, a class or (for [name]) an attribute; None means every page.
+VENDORS = (
+    ('bootstrap', None, ['vendor/bootstrap/css/bootstrap.min.css'], ['vendor/bootstrap/js/bootstrap.bundle.min.js']),
+    ('bootstrap-icons', None, ['vendor/bootstrap-icons/bootstrap-icons.css'], []),
+    ('php-email-form', 'php-email-form', [], ['vendor/php-email-form/validate.js']),
+    ('aos', '[data-aos]', ['vendor/aos/aos.css'], ['vendor/aos/aos.js']),
+    ('glightbox', 'glightbox', ['vendor/glightbox/css/glightbox.min.css'], ['vendor/glightbox/js/glightbox.min.js']),
+    ('waypoints', 'skills-animation', [], ['vendor/waypoints/noframework.waypoints.js']),
+    ('purecounter', 'purecounter', [], ['vendor/purecounter/purecounter_vanilla.js']),
+    ('swiper', 'init-swiper', ['vendor/swiper/swiper-bundle.min.css'], ['vendor/swiper/swiper-bundle.min.js']),
+    ('isotope', 'isotope-layout', [], ['vendor/imagesloaded/imagesloaded.pkgd.min.js',
+                                      'vendor/isotope-layout/isotope.pkgd.min.js']),
+    ('main', None, ['css/main.css'], ['js/main.js']),
+)
+
+STRING_OR_COMMENT = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)''', re.S)
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+SOURCE_MAP = re.compile(r'^\s*//# sourceMappingURL=.*$', re.M)
+PSEUDO = re.compile(r'::?[\w-]+(\((?:[^()]|\([^()]*\))*\))?')
+ATTRIBUTE = re.compile(r'\[\s*([\w-]+)[^\]]*\]')
+SELECTOR_TOKEN = re.compile(r'([.#]?)(-?[_a-zA-Z][\w-]*)')
+# At-rules whose blocks hold more rules, filtered like the top level
+NESTED_AT_RULES = ('@media', '@supports', '@layer')
+
+
+class PageScan(HTMLParser):
+    """
+    Tags, classes, ids and attributes of a rendered page: all of them, and
+    those above the fold, taken as everything up to the end of the first
+    <section>. Script and link tags are skipped, they name every vendor.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.markers = set()
+        self.fold = {'html', 'body'}
+        self.above = True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'link'):
+            return
+        found = {tag}
+        for name, value in attrs:
+            found.add(f'[{name}]')
+            if name == 'class' and value:
+                found.update('.' + cls for cls in value.split())
+            elif name == 'id' and value:
+                found.add('#' + value)
+        self.markers |= found
+        if self.above:
+            self.fold |= found
+
+    def handle_endtag(self, tag):
+        if tag == 'section':
+            self.above = False
+
+
+class BundleManifest:
+    """
+    The bundles and critical CSS of every page, keyed by endpoint, loaded
+    from BUNDLES_DIR/bundles.json the first time it is needed
+    """
+
+    def __init__(self):
+        self.pages = None
+        self.version = None
+
+    def load(self):
+        path = os.path.join(app.config['BUNDLES_DIR'], MANIFEST)
+        try:
+            with open(path) as file:
+                pages = json.load(file)
+        except (OSError, ValueError):
+            pages = {}
+        self.pages = pages
+        self.version = hashlib.sha1(json.dumps(pages, sort_keys=True).encode()).hexdigest()
+        # Rendered pages hold the tags of the previous bundles
+        page_cache.clear()
+
+    def get(self, endpoint):
+        if self.pages is None:
+            self.load()
+        return self.pages.get(endpoint)
+
+
+bundle_manifest = BundleManifest()
+
+
+def vendors_for(markers):
+    return [vendor for vendor in VENDORS
+            if vendor[1] is None or (vendor[1] if vendor[1].startswith('[') else '.' + vendor[1]) in markers]
+
+
+def static_url(path):
+    """
+    Where a file referenced from a bundle is served: a resized image, the
+    hashed copy, or the plain static file
+    """
+    image = image_manifest.get(path)
+    if image:
+        name = image['variants'][-1][1][-1][0]
+        return f'/static/images/{name}'
+    return '/static/' + (asset_manifest.hashed(path) or path)
+
+
+def rebase_urls(css, path):
+    """
+    Point relative url()s of a stylesheet at /static, the bundle is served
+    from a different directory
+    """
+    base = posixpath.dirname(path)
+
+    def rebase(match):
+        url = match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+        target, _, query = url.partition('?')
+        return f'url("{static_url(posixpath.normpath(posixpath.join(base, target)))}")'
+
+    return CSS_URL.sub(rebase, css)
+
+
+def minify_css(css):
+    """
+    Drop comments (bar /*! licences */) and the whitespace around braces,
+    semicolons and commas. Strings are left as they are.
+    """
+    kept = []
+
+    def hold(match):
+        if match.group(2) and not match.group(2).startswith('/*!'):
+            return ' '
+        kept.append(match.group(0))
+        return f'\0{len(kept) - 1}\0'
+
+    css = re.sub(r'\s+', ' ', STRING_OR_COMMENT.sub(hold, css))
+    css = re.sub(r' ?([{};,]) ?', r'\1', css).replace(';}', '}').strip()
+    return re.sub(r'\0(\d+)\0', lambda match: kept[int(match.group(1))], css)
+
+
+def parse_rules(css):
+    """
+    Top-level (prelude, block) pairs of a stylesheet. Statements without a
+    block, like @charset or @import, come back with block None.
+    """
+    rules, start, depth, index, quote = [], 0, 0, 0, None
+    prelude = None
+    while index < len(css):
+        char = css[index]
+        if quote:
+            if char == '\\':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                prelude, start = css[start:index].strip(), index + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append((prelude, css[start:index]))
+                start = index + 1
+        elif char == ';' and depth == 0:
+            rules.append((css[start:index].strip(), None))
+            start = index + 1
+        index += 1
+    return rules
+
+
+def selector_matches(selector, seen):
+    """
+    Whether every tag, class, id and attribute the selector names is in seen.
+    States like :hover are ignored, selectors of nothing but vendor pseudo
+    elements (::-webkit-...) never match.
+    """
+    simple = PSEUDO.sub('', selector)
+    if any(f'[{name}]' not in seen for name in ATTRIBUTE.findall(simple)):
+        return False
+    tokens = SELECTOR_TOKEN.findall(ATTRIBUTE.sub('', simple))
+    if not tokens:
+        return '*' in simple or ':root' in selector or '[' in simple
+    return all((kind + name if kind else name.lower()) in seen for kind, name in tokens)
+
+
+def critical_css(css, seen):
+    """
+    The rules of css that can style anything in seen, with the selectors
+    that cannot dropped. What the page needs before the first paint.
+    """
+    kept = []
+    for prelude, block in parse_rules(css):
+        if block is None:
+            continue
+        if prelude.startswith(NESTED_AT_RULES):
+            inner = critical_css(block, seen)
+            if inner:
+                kept.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@font-face'):
+            kept.append(f'{prelude}{{{block}}}')
+        elif not prelude.startswith('@'):
+            selectors = [selector for selector in prelude.split(',') if selector_matches(selector, seen)]
+            if selectors:
+                kept.append(f"{','.join(selectors)}{{{block}}}")
+    return ''.join(kept)
+
+
+def read_static(path):
+    with open(os.path.join(app.static_folder, path), encoding='utf-8') as file:
+        return file.read()
+
+
+def bundle_css(vendors):
+    return minify_css('\n'.join(rebase_urls(read_static(path), path)
+                                for vendor in vendors for path in vendor[2]))
+
+
+def bundle_js(vendors):
+    # Vendors ship minified builds, and JS cannot be minified safely without
+    # parsing it. Each file is its own statement, a missing ; must not merge two.
+    return ';\n'.join(SOURCE_MAP.sub('', read_static(path)).strip()
+                      for vendor in vendors for path in vendor[3]) + ';\n'
+
+
+def write_bundle(output_dir, content, ext):
+    """
+    Write content under its hash with .gz/.br siblings, unless it is there
+    already. Returns the file name.
+    """
+    data = content.encode()
+    name = f'{hashlib.sha256(data).hexdigest()[:16]}{ext}'
+    path = os.path.join(output_dir, name)
+    if not os.path.exists(path):
+        variants = {'': data, '.gz': gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, body in variants.items():
+            atomic_write(path + suffix, body)
+    return name
+
+
+def build_bundles(output_dir):
+    """
+    Render every marketing page, bundle the vendors it uses and cut its
+    critical CSS. Pages that use the same vendors share bundles. Returns the
+    manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest, bundles = {}, {}
+    for rule in page_routes():
+        response = render_uncached(rule.rule)
+        if response.status_code != 200:
+            raise click.ClickException(f'{rule.rule} answered {response.status_code}')
+        page = PageScan()
+        page.feed(response.get_data(as_text=True))
+
+        vendors = vendors_for(page.markers)
+        key = tuple(vendor[0] for vendor in vendors)
+        if key not in bundles:
+            css = bundle_css(vendors)
+            bundles[key] = (css, write_bundle(output_dir, css, '.css'),
+                            write_bundle(output_dir, bundle_js(vendors), '.js'))
+        css, css_name, js_name = bundles[key]
+        manifest[rule.endpoint] = {'vendors': list(key), 'css': css_name, 'js': js_name,
+                                   'critical': critical_css(css, page.fold)}
+
+    with open(os.path.join(output_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+@app.template_global('page_bundle')
+def page_bundle():
+    """
+    The bundles of the page being rendered, None when it has none and the
+    separate stylesheets and scripts are used
+    """
+    return bundle_manifest.get(request.endpoint)
+
+
+@app.template_global('bundle_styles')
+def bundle_styles(bundle):
+    """
+    Critical CSS inline, the full bundle loaded without blocking the first
+    paint, and the script bundle preloaded. Preloading lives in the page
+    rather than a Link header, since nginx serves the frozen pages itself.
+    """
+    href = url_for('bundle', filename=bundle['css'])
+    script = url_for('bundle', filename=bundle['js'])
+    return Markup(f'<style>{bundle["critical"]}</style>\n'
+                  f'  <link href="{href}" rel="preload" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">\n'
+                  f'  <noscript><link href="{href}" rel="stylesheet"></noscript>\n'
+                  f'  <link href="{script}" rel="preload" as="script">')
+
+
+@app.template_global('bundle_scripts')
+def bundle_scripts(bundle):
+    return Markup(f'<script src="{url_for("bundle", filename=bundle["js"])}" defer></script>')
+
+
+@app.route('/static/bundles/<path:filename>', endpoint='bundle')
+def serve_bundle(filename):
+    mimetype = 'text/css' if filename.endswith('.css') else 'text/javascript'
+    return send_precompressed(app.config['BUNDLES_DIR'], filename, mimetype)
+
+
+@app.cli.command('bundles')
+@click.option('--output', default=None, help='Directory to write to, defaults to BUNDLES_DIR.')
+def bundles_command(output):
+    """Bundle the stylesheets and scripts of each page and cut its critical CSS."""
+    output = output or app.config['BUNDLES_DIR']
+    manifest = build_bundles(output)
+    for endpoint, bundle in sorted(manifest.items()):
+        click.echo(f"{endpoint:10} {bundle['css']} {bundle['js']} critical {len(bundle['critical'])} bytes, "
+                   f"{', '.join(bundle['vendors'])}")
+    bundle_manifest.load()
@@ -0,0 +1,327 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from decouple import config
+from sqlalchemy import event
+from src import app, User
+from src.storage import SqliteStore
+
+
+class MemoryCache:
+    """
+    LRU cache with a TTL that lives inside one process. Good enough for
+    tests and the development server, but every gunicorn worker would get
+    its own copy, so production uses SqliteCache.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.time():
+                self.entries.pop(key, None)
+                self._incr('misses')
+                return None
+            self.entries.move_to_end(key)
+            self._incr('hits')
+            return entry[0]
+
+    def set(self, key, value, generation=None):
+        with self.lock:
+            if generation is not None and self.counters.get('generation', 0) != generation:
+                return
+            self.entries[key] = (value, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_many(self, keys):
+        return {key: value for key in keys if (value := self.get(key)) is not None}
+
+    def set_many(self, items, generation=None):
+        for key, value in items.items():
+            self.set(key, value, generation)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, name):
+        with self.lock:
+            return self._incr(name)
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    def flush(self):
+        pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+    def _incr(self, name):
+        self.counters[name] = self.counters.get(name, 0) + 1
+        return self.counters[name]
+
+
+class SqliteCache(SqliteStore):
+    """
+    LRU cache with a TTL kept in a small SQLite file next to the database, so
+    all gunicorn workers on the machine share entries, invalidations and
+    counters. It is a separate file from the main database and never
+    competes with it for the write lock.
+
+    A hit is only a read: hits and misses are counted in memory and written
+    by flush (which the metrics call once per flush interval), and an
+    entry's last access is only moved on when it is TOUCH_INTERVAL seconds
+    old, so eviction order is approximate. A trigger keeps the entry count
+    in the counters table, so no write has to count the table.
+    """
+
+    TOUCH_INTERVAL = 60
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, value TEXT NOT NULL,
+            expires_at REAL NOT NULL, accessed_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TRIGGER IF NOT EXISTS entries_added AFTER INSERT ON entries BEGIN
+            INSERT INTO counters (name, value) VALUES ('entries', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS entries_removed AFTER DELETE ON entries BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'entries';
+        END;
+        INSERT OR IGNORE INTO counters (name, value) SELECT 'entries', count(*) FROM entries;
+    """
+
+    # Stores an entry, or nothing once the generation has moved past the
+    # one its value was read at, in the same statement
+    INSERT = (
+        'INSERT INTO entries (key, value, expires_at, accessed_at) '
+        'SELECT ?, ?, ?, ? WHERE ? IS NULL OR '
+        "coalesce((SELECT value FROM counters WHERE name = 'generation'), 0) = ? "
+        'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+        'expires_at = excluded.expires_at, accessed_at = excluded.accessed_at')
+
+    def __init__(self, path, max_entries=10000, ttl=300):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        connection = self.connection
+        row = connection.execute(
+            'SELECT value, expires_at, accessed_at FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                with connection:
+                    connection.execute('DELETE FROM entries WHERE key = ? AND expires_at < ?', (key, now))
+            self._count('misses')
+            return None
+        if row[2] < now - self.TOUCH_INTERVAL:
+            with connection:
+                connection.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count('hits')
+        return json.loads(row[0])
+
+    def set(self, key, value, generation=None):
+        now = time.time()
+        with self.connection as connection:
+            connection.execute(
+                self.INSERT, (key, json.dumps(value), now + self.ttl, now, generation, generation))
+            self._evict(connection)
+
+    def get_many(self, keys):
+        """
+        The live entries out of keys, in one query
+        """
+        if not keys:
+            return {}
+        now = time.time()
+        placeholders = ','.join('?' * len(keys))
+        connection = self.connection
+        rows = connection.execute(
+            f'SELECT key, value, expires_at, accessed_at FROM entries WHERE key IN ({placeholders})',
+            list(keys)).fetchall()
+        found = {key: value for key, value, expires_at, _ in rows if expires_at >= now}
+        expired = [(key, now) for key, _, expires_at, _ in rows if expires_at < now]
+        stale = [(now, key) for key, _, expires_at, accessed_at in rows
+                 if expires_at >= now and accessed_at < now - self.TOUCH_INTERVAL]
+        if expired or stale:
+            with connection:
+                connection.executemany('DELETE FROM entries WHERE key = ? AND expires_at < ?', expired)
+                connection.executemany('UPDATE entries SET accessed_at = ? WHERE key = ?', stale)
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        return {key: json.loads(value) for key, value in found.items()}
+
+    def set_many(self, items, generation=None):
+        if not items:
+            return
+        now = time.time()
+        with self.connection as connection:
+            connection.executemany(
+                self.INSERT,
+                [(key, json.dumps(value), now + self.ttl, now, generation, generation)
+                 for key, value in items.items()])
+            self._evict(connection)
+
+    def delete(self, key):
+        with self.connection as connection:
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def incr(self, name):
+        with self.connection as connection:
+            return self._incr(connection, name)
+
+    def counter(self, name):
+        row = self.connection.execute(
+            'SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+        return (row[0] if row else 0) + self.pending.get(name, 0)
+
+    def flush(self):
+        """
+        Write the hits and misses counted since the last flush
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            with self.connection as connection:
+                for name, amount in pending.items():
+                    self._incr(connection, name, amount)
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+        with self.connection as connection:
+            connection.execute('DELETE FROM entries')
+            connection.execute('DELETE FROM counters')
+
+    def _count(self, name, amount=1):
+        if amount:
+            with self.lock:
+                self.pending[name] = self.pending.get(name, 0) + amount
+
+    def _evict(self, connection):
+        (size,) = connection.execute(
+            "SELECT coalesce((SELECT value FROM counters WHERE name = 'entries'), 0)").fetchone()
+        if size > self.max_entries:
+            connection.execute(
+                'DELETE FROM entries WHERE key IN '
+                '(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)',
+                (size - self.max_entries,))
+
+    def _incr(self, connection, name, amount=1):
+        return connection.execute(
+            'INSERT INTO counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value RETURNING value',
+            (name, amount)).fetchone()[0]
+
+
+class UserCache:
+    """
+    Read-through cache for user lookups. Single users are keyed by id, list
+    responses by a generation number that every write bumps, so one write
+    drops every cached list at once without having to find them. A value
+    loaded from the database is stored with the generation read before the
+    load, and not at all when a write came in between: otherwise a worker
+    that read just before another's invalidation would put the old row
+    back for a whole TTL.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, generation=None):
+        self.backend.set(key, value, generation)
+
+    def get_many(self, keys):
+        return self.backend.get_many(keys)
+
+    def set_many(self, items, generation=None):
+        self.backend.set_many(items, generation)
+
+    def generation(self):
+        """
+        Read before loading a value from the database, and passed to set
+        """
+        return self.backend.counter('generation')
+
+    def get_or_load(self, key, loader):
+        value = self.backend.get(key)
+        if value is None:
+            generation = self.generation()
+            value = loader()
+            if value is not None:
+                self.backend.set(key, value, generation)
+        return value
+
+    def user_key(self, user_id):
+        return f'user:{user_id}'
+
+    def list_key(self, name):
+        return f"users:{self.backend.counter('generation')}:{name}"
+
+    def invalidate(self, user_id=None):
+        """
+        Drop a user's entry (if given) and every cached list
+        """
+        if user_id is not None:
+            self.backend.delete(self.user_key(user_id))
+        self.backend.incr('generation')
+
+    def invalidate_many(self, user_ids):
+        for user_id in user_ids:
+            self.backend.delete(self.user_key(user_id))
+        self.backend.incr('generation')
+
+    def flush(self):
+        self.backend.flush()
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        hits = self.backend.counter('hits')
+        misses = self.backend.counter('misses')
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+
+def make_backend():
+    backend = config('USER_CACHE_BACKEND', default='sqlite')
+    max_entries = config('USER_CACHE_MAX_ENTRIES', default=10000, cast=int)
+    ttl = config('USER_CACHE_TTL', default=300, cast=int)
+
+    if backend == 'memory':
+        return MemoryCache(max_entries=max_entries, ttl=ttl)
+    path = config('USER_CACHE_PATH', default=os.path.join(app.instance_path, 'cache.db'))
+    return SqliteCache(path, max_entries=max_entries, ttl=ttl)
+
+
+user_cache = UserCache(make_backend())
+
+# Recreating the user table reuses ids, so nothing cached may outlive it
+event.listen(User.__table__, 'after_drop', lambda target, connection, **kw: user_cache.clear())
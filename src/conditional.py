@@ -0,0 +1,96 @@
+import hashlib
+from datetime import datetime, timezone
+from flask import request, jsonify
+from werkzeug.http import http_date, parse_date
+from src import app
+
+# Response headers for anything we hand out an ETag for: clients may keep
+# the body but must revalidate it, which costs them a 304 at most
+REVALIDATE = 'no-cache'
+
+
+def user_etag(user_id, version, fields=None):
+    """
+    Strong ETag of one user. A ?fields= projection is a different
+    representation and so gets a different tag.
+    """
+    etag = f'user-{user_id}-v{version}'
+    if fields:
+        etag += '-' + '+'.join(fields)
+    return etag
+
+
+def list_etag(rows, *parts):
+    """
+    Strong ETag for a list response built from the (id, version) of every
+    row on it, plus whatever else shapes the body (fields, limit, ...)
+    """
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode())
+    for row in rows:
+        digest.update(f';{row.id}.{row.version}'.encode())
+    return digest.hexdigest()
+
+
+def last_modified(*timestamps):
+    """
+    HTTP date of the newest updated_at, which the database stores as naive UTC
+    """
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    if not timestamps:
+        return None
+    return http_date(max(timestamps).replace(tzinfo=timezone.utc))
+
+
+def settled(modified):
+    """
+    True once the second of an HTTP date is over. Until then a later write
+    in the same second would carry the same date, so it proves nothing.
+    """
+    return parse_date(modified) < datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def is_conditional():
+    return bool(request.if_none_match or request.if_modified_since)
+
+
+def not_modified(etag, modified=None):
+    """
+    True when the client's copy is still current. If-None-Match wins over
+    If-Modified-Since, as RFC 9110 asks. Pass modified=None where a date
+    cannot prove freshness, e.g. for lists, which also change on deletes.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and modified and settled(modified):
+        return parse_date(modified) <= request.if_modified_since
+    return False
+
+
+def if_match_versions(user_id):
+    """
+    Versions of the user an If-Match header accepts, so a write can check
+    them in its WHERE clause. None means no header (or *): anything goes.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = f'user-{user_id}-v'
+    return [int(etag[len(prefix):]) for etag in request.if_match.as_set()
+            if etag.startswith(prefix) and etag[len(prefix):].isdigit()]
+
+
+def conditional_response(body, etag, modified=None, check_modified=True):
+    """
+    304 without touching body when the client is up to date, otherwise body
+    (or what calling it returns) as JSON. Both carry the validators.
+    """
+    if not_modified(etag, modified if check_modified else None):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(body() if callable(body) else body)
+    response.set_etag(etag)
+    # Only a date no later write can share, or a client holding it could be
+    # told a newer version is not modified. The ETag covers the meantime.
+    if modified and settled(modified):
+        response.headers['Last-Modified'] = modified
+    response.headers['Cache-Control'] = REVALIDATE
+    return response
@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+from xml.sax.saxutils import escape
+import click
+from flask import template_rendered
+from jinja2 import meta
+from decouple import config
+from src import app
+from src.pages import brotli, page_routes, render_uncached
+from src.assets import asset_manifest
+from src.images import image_manifest
+from src.bundles import bundle_manifest
+from src.storage import atomic_write
+from src.views import site_globals
+
+app.config['FREEZE_DIR'] = config('FREEZE_DIR', default=os.path.join(os.path.dirname(app.root_path), 'build', 'site'))
+app.config['SITE_URL'] = config('SITE_URL', default='https://www.drainexperts.co.za')
+
+MANIFEST = '.freeze.json'
+
+
+def output_path(route):
+    # nginx looks these up with try_files $uri.html $uri/index.html
+    if route == '/':
+        return 'index.html'
+    return route.strip('/') + '.html'
+
+
+def template_dependencies(name, seen=None):
+    """
+    A template plus everything it extends, includes or imports
+    """
+    seen = seen if seen is not None else set()
+    if name in seen:
+        return seen
+    seen.add(name)
+    source = app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+    for child in meta.find_referenced_templates(app.jinja_env.parse(source)):
+        if child:
+            template_dependencies(child, seen)
+    return seen
+
+
+def fingerprint(templates):
+    """
+    Hash of every template a page is built from and of the context they all
+    share. When it matches the last build, the page would come out the same.
+    """
+    digest = hashlib.sha1()
+    for name in sorted(templates):
+        digest.update(name.encode())
+        digest.update(app.jinja_env.loader.get_source(app.jinja_env, name)[0].encode())
+    digest.update(json.dumps(freeze_context(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def freeze_context():
+    # Asset, image and bundle URLs end up in the pages, so new builds count too
+    return {'globals': site_globals(datetime.now().year), 'assets': asset_manifest.version,
+            'images': image_manifest.version, 'bundles': bundle_manifest.version}
+
+
+def render_route(route):
+    """
+    Render one page through the app and return (html, templates used)
+    """
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(template.name)
+
+    # A page cache hit would render nothing to record
+    with template_rendered.connected_to(record, app):
+        response = render_uncached(route)
+    if response.status_code != 200:
+        raise click.ClickException(f'{route} answered {response.status_code}')
+
+    templates = set()
+    for name in rendered:
+        template_dependencies(name, templates)
+    return response.get_data(), templates
+
+
+def write_page(output_dir, name, html):
+    """
+    Write the page plus the .gz (and .br) siblings nginx serves with
+    gzip_static / brotli_static
+    """
+    path = os.path.join(output_dir, name)
+    atomic_write(path, html)
+    atomic_write(path + '.gz', gzip.compress(html, 9, mtime=0))
+    if brotli is not None:
+        atomic_write(path + '.br', brotli.compress(html, quality=11))
+
+
+def sitemap(routes):
+    base = app.config['SITE_URL'].rstrip('/')
+    urls = ''.join(f'  <url><loc>{escape(base + route)}</loc></url>\n' for route in routes)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+            f'{urls}</urlset>\n').encode()
+
+
+def freeze(output_dir, force=False):
+    """
+    Render every marketing page to output_dir. Pages whose templates and
+    context are unchanged since the last run are skipped. Returns the lists
+    of (built, skipped) routes.
+    """
+    # Pick up builds that ran since this process started
+    asset_manifest.load()
+    image_manifest.load()
+    bundle_manifest.load()
+
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = {}
+
+    built, skipped = [], []
+    routes = [rule.rule for rule in page_routes()]
+    for route in routes:
+        name = output_path(route)
+        previous = manifest.get(route)
+        if not force and previous and os.path.exists(os.path.join(output_dir, name)) \
+                and fingerprint(previous['templates']) == previous['fingerprint']:
+            skipped.append(route)
+            continue
+
+        html, templates = render_route(route)
+        write_page(output_dir, name, html)
+        manifest[route] = {'templates': sorted(templates), 'fingerprint': fingerprint(templates)}
+        built.append(route)
+
+    # Pages whose route is gone must not linger in front of the app
+    for route in set(manifest) - set(routes):
+        for suffix in ('', '.gz', '.br'):
+            path = os.path.join(output_dir, output_path(route) + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+        del manifest[route]
+
+    write_page(output_dir, 'sitemap.xml', sitemap(routes))
+    atomic_write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return built, skipped
+
+
+@app.cli.command('freeze')
+@click.option('--output', default=None, help='Directory to write to, defaults to FREEZE_DIR.')
+@click.option('--force', is_flag=True, help='Rebuild every page, even unchanged ones.')
+def freeze_command(output, force):
+    """Render the marketing pages to static files for nginx."""
+    output = output or app.config['FREEZE_DIR']
+    built, skipped = freeze(output, force=force)
+    for route in built:
+        click.echo(f'built    {route}')
+    for route in skipped:
+        click.echo(f'skipped  {route}')
+    click.echo(f'{len(built)} built, {len(skipped)} unchanged, written to {output}')
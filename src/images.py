@@ -0,0 +1,191 @@
+import hashlib
+import io
+import json
+import os
+import click
+from flask import url_for, send_from_directory
+from markupsafe import Markup, escape
+from decouple import config
+from src import app
+from src.pages import page_cache
+from src.assets import IMMUTABLE
+from src.storage import atomic_write
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is only needed to build, serving reads the manifest
+    Image = None
+
+# Resized copies of src/static/img, written by `flask images`
+app.config['IMAGES_DIR'] = config('IMAGES_DIR', default=os.path.join(os.path.dirname(app.root_path), 'build', 'static', 'images'))
+
+MANIFEST = 'images.json'
+SOURCE_TYPES = ('.jpg', '.jpeg', '.png')
+WIDTHS = (320, 640, 960, 1280, 1920)
+# Preferred first, the last one is what <img> itself points at. PNG sources
+# fall back to PNG so transparency survives.
+FORMATS = ('avif', 'webp')
+QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80, 'png': None}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+class ImageManifest:
+    """
+    Derivatives of every source image, keyed by its static filename, as
+    {'width', 'height', 'variants': [[mimetype, [[name, width], ...]], ...]},
+    variants in order of preference.
+    Loaded from IMAGES_DIR/images.json the first time it is needed.
+    """
+
+    def __init__(self):
+        self.images = None
+        self.version = None
+
+    def load(self):
+        path = os.path.join(app.config['IMAGES_DIR'], MANIFEST)
+        try:
+            with open(path) as file:
+                images = json.load(file)
+        except (OSError, ValueError):
+            images = {}
+        self.images = images
+        self.version = hashlib.sha1(json.dumps(images, sort_keys=True).encode()).hexdigest()
+        # Rendered pages hold <img> tags from the previous manifest
+        page_cache.clear()
+
+    def get(self, filename):
+        if self.images is None:
+            self.load()
+        return self.images.get(filename)
+
+
+image_manifest = ImageManifest()
+
+
+def target_widths(width):
+    # Never upscale, and keep the original size when it is below the largest
+    return [w for w in WIDTHS if w < width] + [min(width, WIDTHS[-1])]
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if features.check(fmt)]
+
+
+def save_derivative(image, path, fmt):
+    """
+    Save without exif, comments or other metadata, Pillow only writes those
+    when asked to
+    """
+    options = {'optimize': True}
+    if QUALITY[fmt]:
+        options['quality'] = QUALITY[fmt]
+    if fmt == 'jpeg':
+        options['progressive'] = True
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.upper(), **options)
+    atomic_write(path, buffer.getvalue())
+
+
+def build_images(static_dir, output_dir):
+    """
+    Write every source image under static_dir/img at WIDTHS in each format
+    Pillow can encode, and the manifest. Derivatives are named after the
+    source's content hash, so identical sources share one set of files and
+    existing files are not encoded again. Returns (manifest, written).
+    """
+    manifest, by_digest, written = {}, {}, 0
+    formats = available_formats()
+    os.makedirs(output_dir, exist_ok=True)
+    for root, dirs, files in os.walk(os.path.join(static_dir, 'img')):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(SOURCE_TYPES):
+                continue
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as file:
+                digest = hashlib.sha256(file.read()).hexdigest()[:16]
+            if digest in by_digest:
+                manifest[filename] = by_digest[digest]
+                continue
+
+            with Image.open(source) as original:
+                # Bake the exif orientation into the pixels before exif is dropped
+                image = ImageOps.exif_transpose(original)
+                image.load()
+            fallback = 'png' if filename.lower().endswith('.png') else 'jpeg'
+            entry = {'width': image.width, 'height': image.height, 'variants': []}
+            for fmt in formats + [fallback]:
+                variants = []
+                entry['variants'].append([MIMETYPES[fmt], variants])
+                for width in target_widths(image.width):
+                    derived = f'{digest}-{width}.{EXTENSIONS[fmt]}'
+                    variants.append([derived, width])
+                    path = os.path.join(output_dir, derived)
+                    if os.path.exists(path):
+                        continue
+                    height = max(1, round(image.height * width / image.width))
+                    resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                    save_derivative(resized, path, fmt)
+                    written += 1
+            manifest[filename] = by_digest[digest] = entry
+
+    with open(os.path.join(output_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest, written
+
+
+@app.template_global('image')
+def responsive_image(filename, alt='', sizes='100vw', lazy=True, **attrs):
+    """
+    <picture> for a static image with a srcset per format and the intrinsic
+    width/height, so the browser picks the smallest file that fits and
+    reserves the space before it loads. Falls back to a plain <img> of the
+    original when the image has not been built.
+    """
+    entry = image_manifest.get(filename)
+    attrs['alt'] = alt
+    if lazy:
+        attrs.update(loading='lazy', decoding='async')
+    if entry is None:
+        attrs['src'] = url_for('static', filename=filename)
+        return Markup(f'<img{html_attributes(attrs)}>')
+
+    *preferred, (_, fallback) = entry['variants']
+    sources = ''.join(f'<source{html_attributes({"type": mimetype, "srcset": srcset(variants), "sizes": sizes})}>'
+                      for mimetype, variants in preferred)
+    attrs.update(src=url_for('image', filename=fallback[-1][0]), srcset=srcset(fallback),
+                 sizes=sizes, width=entry['width'], height=entry['height'])
+    return Markup(f'<picture>{sources}<img{html_attributes(attrs)}></picture>')
+
+
+def srcset(variants):
+    return ', '.join(f"{url_for('image', filename=name)} {width}w" for name, width in variants)
+
+
+def html_attributes(attrs):
+    return ''.join(f' {name.rstrip("_")}="{escape(value)}"' for name, value in attrs.items())
+
+
+@app.route('/static/images/<path:filename>', endpoint='image')
+def serve_image(filename):
+    """
+    Derivatives are named after their content and never change
+    """
+    response = send_from_directory(app.config['IMAGES_DIR'], filename)
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+@app.cli.command('images')
+@click.option('--output', default=None, help='Directory to write to, defaults to IMAGES_DIR.')
+def images_command(output):
+    """Write resized AVIF/WebP/JPEG copies of src/static/img."""
+    if Image is None:
+        raise click.ClickException('Building images needs Pillow: pip install pillow')
+    output = output or app.config['IMAGES_DIR']
+    manifest, written = build_images(app.static_folder, output)
+    unique = len({id(entry) for entry in manifest.values()})
+    click.echo(f'{len(manifest)} images, {unique} unique, {written} files written to {output}')
@@ -0,0 +1,258 @@
+import glob
+import json
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src import app
+from src.cache import user_cache
+from src.outbox import outbox_stats
+from src.storage import atomic_write
+
+app.config['METRICS_ENABLED'] = config('METRICS_ENABLED', default=True, cast=bool)
+# Every worker writes its own totals here, /metrics adds them all up
+app.config['METRICS_DIR'] = config('METRICS_DIR', default=os.path.join(app.instance_path, 'metrics'))
+app.config['METRICS_FLUSH_INTERVAL'] = config('METRICS_FLUSH_INTERVAL', default=1.0, cast=float)
+# Set by gunicorn's post_fork. Anything else, flask commands rendering pages
+# through the test client included, keeps its totals to itself.
+app.config['METRICS_SHARED'] = False
+
+# Totals of workers that have exited, folded in by the gunicorn master
+DEAD_FILE = 'dead.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Metrics:
+    """
+    Per-process request totals, keyed by endpoint, method and status.
+
+    Gunicorn workers cannot see each other's memory, so each one dumps its
+    totals to METRICS_DIR/<pid>.json at most once per flush interval, and
+    whichever worker serves /metrics sums every file. When a worker exits
+    the master folds its file into dead.json, so totals only ever go up,
+    which is what Prometheus expects from counters and histograms.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+        self.flushed_at = 0.0
+
+    def observe(self, endpoint, method, status, seconds, sql_count, sql_seconds, size):
+        key = f'{endpoint}|{method}|{status}'
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    'count': 0,
+                    'latency_buckets': [0] * len(LATENCY_BUCKETS),
+                    'latency_sum': 0.0,
+                    'size_buckets': [0] * len(SIZE_BUCKETS),
+                    'size_sum': 0,
+                    'sql_count': 0,
+                    'sql_seconds': 0.0,
+                }
+            series['count'] += 1
+            series['latency_sum'] += seconds
+            series['size_sum'] += size
+            series['sql_count'] += sql_count
+            series['sql_seconds'] += sql_seconds
+            add_to_buckets(series['latency_buckets'], LATENCY_BUCKETS, seconds)
+            add_to_buckets(series['size_buckets'], SIZE_BUCKETS, size)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.flushed_at < app.config['METRICS_FLUSH_INTERVAL']:
+            return
+        self.flushed_at = now
+        if app.config['METRICS_SHARED']:
+            with self.lock:
+                data = json.dumps(self.series)
+            atomic_write(os.path.join(app.config['METRICS_DIR'], f'{os.getpid()}.json'), data.encode())
+        # The user cache counts its hits in memory too, on the same schedule
+        user_cache.flush()
+
+    def collect(self):
+        """
+        Totals of every worker that has written a file, this one included
+        """
+        self.flush(force=True)
+        totals = read_totals(glob.glob(os.path.join(app.config['METRICS_DIR'], '*.json')))
+        if not app.config['METRICS_SHARED']:
+            with self.lock:
+                add_totals(totals, json.loads(json.dumps(self.series)))
+        return totals
+
+    def fold(self, pid=None):
+        """
+        Add the files of exited workers, all of them when pid is None, to
+        dead.json and remove them. Only the gunicorn master calls this, when
+        it starts and after each worker exits, so nothing folds concurrently.
+        """
+        directory = app.config['METRICS_DIR']
+        if pid is None:
+            paths = [path for path in glob.glob(os.path.join(directory, '*.json'))
+                     if os.path.basename(path) != DEAD_FILE]
+        else:
+            paths = [path for path in [os.path.join(directory, f'{pid}.json')] if os.path.exists(path)]
+        if not paths:
+            return
+        dead = os.path.join(directory, DEAD_FILE)
+        atomic_write(dead, json.dumps(read_totals([dead] + paths)).encode())
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def read_totals(paths):
+    totals = {}
+    for path in paths:
+        try:
+            with open(path) as file:
+                add_totals(totals, json.load(file))
+        except (OSError, ValueError):
+            continue
+    return totals
+
+
+def add_totals(totals, worker):
+    for key, series in worker.items():
+        total = totals.get(key)
+        if total is None:
+            totals[key] = series
+            continue
+        for name, value in series.items():
+            if isinstance(value, list):
+                total[name] = [a + b for a, b in zip(total[name], value)]
+            else:
+                total[name] += value
+
+
+def add_to_buckets(counts, bounds, value):
+    # Cumulative buckets are built when rendering, here each value lands once
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            counts[index] += 1
+            return
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, not the connection: a
+    # statement that raises never gets after_cursor_execute, and its start
+    # time goes away with its context
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    state = g.get('metrics') if has_request_context() else None
+    if state is not None:
+        state[1] += 1
+        if started is not None:
+            state[2] += time.perf_counter() - started
+
+
+@app.before_request
+def start_request_metrics():
+    if app.config['METRICS_ENABLED']:
+        # [started, SQL statements, SQL seconds], one g lookup per update
+        g.metrics = [time.perf_counter(), 0, 0.0]
+
+
+@app.after_request
+def record_request_metrics(response):
+    state = g.get('metrics')
+    if state is not None:
+        metrics.observe(
+            request.endpoint or 'none',
+            request.method,
+            response.status_code,
+            time.perf_counter() - state[0],
+            state[1],
+            state[2],
+            # Streamed responses have no length up front and count as 0
+            response.content_length or 0,
+        )
+        metrics.flush()
+    return response
+
+
+def render_prometheus(totals):
+    lines = []
+
+    def header(name, kind, text):
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def histogram(name, buckets_key, sum_key, bounds):
+        for key, series in sorted(totals.items()):
+            labels = series_labels(key)
+            cumulative = 0
+            for bound, count in zip(bounds, series[buckets_key]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'{name}_sum{{{labels}}} {series[sum_key]}')
+            lines.append(f'{name}_count{{{labels}}} {series["count"]}')
+
+    def counter(name, value_key):
+        for key, series in sorted(totals.items()):
+            lines.append(f'{name}{{{series_labels(key)}}} {series[value_key]}')
+
+    header('http_request_duration_seconds', 'histogram', 'Time spent serving requests.')
+    histogram('http_request_duration_seconds', 'latency_buckets', 'latency_sum', LATENCY_BUCKETS)
+    header('http_response_size_bytes', 'histogram', 'Size of response bodies, 0 when streamed.')
+    histogram('http_response_size_bytes', 'size_buckets', 'size_sum', SIZE_BUCKETS)
+    header('http_request_sql_statements_total', 'counter', 'SQL statements run while serving requests.')
+    counter('http_request_sql_statements_total', 'sql_count')
+    header('http_request_sql_seconds_total', 'counter', 'Time spent in SQL while serving requests.')
+    counter('http_request_sql_seconds_total', 'sql_seconds')
+
+    stats = user_cache.stats()
+    header('user_cache_hits_total', 'counter', 'Shared user cache hits.')
+    lines.append(f"user_cache_hits_total {stats['hits']}")
+    header('user_cache_misses_total', 'counter', 'Shared user cache misses.')
+    lines.append(f"user_cache_misses_total {stats['misses']}")
+
+    outbox = outbox_stats()
+    header('contact_outbox_messages', 'gauge', 'Contact messages in the outbox by status.')
+    for status in ('pending', 'sent', 'failed'):
+        lines.append(f'contact_outbox_messages{{status="{status}"}} {outbox[status]}')
+    header('contact_outbox_oldest_pending_seconds', 'gauge', 'Age of the oldest unsent contact message.')
+    lines.append(f"contact_outbox_oldest_pending_seconds {outbox['oldest_pending_seconds']}")
+
+    # Imported here, the limiter registers its hook after the metrics ones
+    from src.ratelimit import rate_limiter
+    header('rate_limited_requests_total', 'counter', 'Requests turned away by the rate limiter.')
+    for endpoint, count in sorted(rate_limiter.throttled().items()):
+        lines.append(f'rate_limited_requests_total{{endpoint="{endpoint}"}} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def series_labels(key):
+    endpoint, method, status = key.split('|')
+    return f'endpoint="{endpoint}",method="{method}",status="{status}"'
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Request metrics of all workers in the Prometheus text format. Keep this
+    route internal (e.g. deny it in nginx), it is not part of the API.
+    """
+    return app.response_class(render_prometheus(metrics.collect()),
+                              mimetype='text/plain; version=0.0.4')
@@ -1,10 +1,36 @@
 from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+import click
 from src import app
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import event
 
 db = SQLAlchemy(app)
-migrate = Migrate(app, db)  # Initialize Flask-Migrate
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record, readonly=False):
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    if readonly:
+        cursor.execute('PRAGMA query_only = ON')
+    cursor.close()
+
+
+with app.app_context():
+    for bind_key, engine in db.engines.items():
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', partial(apply_sqlite_pragmas, readonly=bind_key == 'readonly'))
+
+
+def read(statement, params=None):
+    """
+    Execute a SELECT on the read-only engine, or the default one when the
+    database has no separate read engine (e.g. in-memory SQLite)
+    """
+    engine = db.engines.get('readonly', db.engine)
+    return db.session.execute(statement, params, bind_arguments={'bind': engine})
 
 # Define a model (Table) for the database
 @dataclass
@@ -16,18 +42,138 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)  # Store hashed passwords
     is_admin = db.Column(db.Boolean, default=False, nullable=False)  # Admin flag
+    version = db.Column(db.Integer, default=1, nullable=False)  # Bumped on every write, used for ETags
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # UTC
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<User {self.username}>'
     
-    id: str
+    id: int
     first_name: str
     last_name: str
     username: str
     email: str
-    is_admin: str
+    is_admin: bool
 
-# Create the database tables (if they don't exist)
-with app.app_context():
+class ContactMessage(db.Model):
+    """
+    A contact form submission waiting in the outbox until src/outbox.py has
+    mailed it. next_attempt_at is when a worker may pick it up: on arrival,
+    after a backoff, or when the worker that claimed it died mid-send.
+    """
+    __tablename__ = 'outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), default='pending', nullable=False)  # pending, sent or failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # UTC
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # UTC
+    sent_at = db.Column(db.DateTime)  # UTC
+
+    __table_args__ = (db.Index('ix_outbox_due', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f'<ContactMessage {self.id} {self.status}>'
+
+class Subscriber(db.Model):
+    """
+    A newsletter subscription, written in batches by src/subscriptions.py
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)  # Lower case
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # UTC
+
+    def __repr__(self):
+        return f'<Subscriber {self.email}>'
+
+# Full-text index over the searchable User columns. The trigram tokenizer
+# lets MATCH find any substring of 3+ characters without scanning the table,
+# and the triggers keep it in step with every insert, update and delete.
+USER_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+        username, email, first_name, last_name,
+        content='user', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON "user" BEGIN
+        INSERT INTO user_search(rowid, username, email, first_name, last_name)
+        VALUES (new.id, new.username, new.email, new.first_name, new.last_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON "user" BEGIN
+        INSERT INTO user_search(user_search, rowid, username, email, first_name, last_name)
+        VALUES ('delete', old.id, old.username, old.email, old.first_name, old.last_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_search_au
+    AFTER UPDATE OF username, email, first_name, last_name ON "user" BEGIN
+        INSERT INTO user_search(user_search, rowid, username, email, first_name, last_name)
+        VALUES ('delete', old.id, old.username, old.email, old.first_name, old.last_name);
+        INSERT INTO user_search(rowid, username, email, first_name, last_name)
+        VALUES (new.id, new.username, new.email, new.first_name, new.last_name);
+    END""",
+]
+
+
+def create_search_index(connection):
+    """
+    Create the user_search index and its triggers, backfilling it when the
+    user table already had rows. Only SQLite has FTS5, other backends fall
+    back to LIKE in search_users.
+    """
+    if connection.dialect.name != 'sqlite':
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'user_search'").first()
+    for ddl in USER_SEARCH_DDL:
+        connection.exec_driver_sql(ddl)
+    if not exists:
+        connection.exec_driver_sql("INSERT INTO user_search(user_search) VALUES ('rebuild')")
+
+
+def upgrade_user_table(connection):
+    """
+    Add the version and updated_at columns to user tables created before
+    they existed
+    """
+    if connection.dialect.name != 'sqlite':
+        return
+    columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info("user")')}
+    if 'version' not in columns:
+        connection.exec_driver_sql('ALTER TABLE "user" ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    if 'updated_at' not in columns:
+        connection.exec_driver_sql('ALTER TABLE "user" ADD COLUMN updated_at DATETIME')
+        connection.exec_driver_sql('UPDATE "user" SET updated_at = CURRENT_TIMESTAMP')
+
+
+def drop_search_index(connection):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql("DROP TABLE IF EXISTS user_search")
+
+
+event.listen(User.__table__, 'after_create',
+                lambda target, connection, **kw: create_search_index(connection))
+event.listen(User.__table__, 'before_drop',
+                lambda target, connection, **kw: drop_search_index(connection))
+
+def create_schema():
+    """
+    Create missing tables, add the columns older user tables lack and build
+    the search index. Run once per deploy by `flask migrate`, so starting a
+    worker never touches the database.
+    """
     db.create_all()
+    with db.engine.begin() as connection:
+        upgrade_user_table(connection)
+        create_search_index(connection)
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Create or upgrade the database schema, before the workers start."""
+    create_schema()
+    click.echo('Database schema is up to date')
 
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import click
+from flask import request, send_from_directory
+from decouple import config
+from src import app
+from src.conditional import not_modified, REVALIDATE
+from src.storage import atomic_write
+
+# Where `flask openapi` writes the compiled spec the docs UI loads
+app.config['OPENAPI_DIR'] = config('OPENAPI_DIR', default=os.path.join(os.path.dirname(app.root_path), 'build', 'openapi'))
+
+SPEC_FILE = 'openapi.json'
+# Fingerprint of the docstrings a compiled spec was built from
+SOURCES_FILE = 'openapi.sources'
+SPEC_ENDPOINT = 'apispec_1'
+
+
+def build_spec():
+    """
+    The spec flasgger would build from the route docstrings, parsed afresh
+    """
+    swagger = app.swag
+    swagger.apispecs.pop(SPEC_ENDPOINT, None)
+    with app.test_request_context():
+        return swagger.get_apispecs(SPEC_ENDPOINT)
+
+
+def encode_spec(spec):
+    return json.dumps(spec, sort_keys=True, separators=(',', ':'), default=str).encode()
+
+
+def spec_etag(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def spec_sources():
+    """
+    Hash of what the spec is built from, the route docstrings and the
+    Swagger template. Cheap next to building the spec, no YAML is parsed.
+    """
+    digest = hashlib.sha256()
+    for endpoint, view in sorted(app.view_functions.items()):
+        digest.update(f'{endpoint}\0{view.__doc__ or ""}\0'.encode())
+    digest.update(json.dumps(app.swag.template, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:20]
+
+
+def write_spec(directory, data, sources):
+    """
+    Write the compiled spec, its gzipped copy and the fingerprint of its
+    sources
+    """
+    files = ((SPEC_FILE, data), (SPEC_FILE + '.gz', gzip.compress(data, 9, mtime=0)),
+             (SOURCES_FILE, sources.encode()))
+    for name, content in files:
+        atomic_write(os.path.join(directory, name), content)
+
+
+class CompiledSpec:
+    """
+    The ETag of OPENAPI_DIR/openapi.json, read the first time the spec is
+    asked for. When there is no build, or it was built from other
+    docstrings than the running code's, the first request compiles it, so
+    the YAML is parsed once per deploy rather than once per worker.
+    """
+
+    def __init__(self):
+        self.etag = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.etag is None:
+                directory, sources = app.config['OPENAPI_DIR'], spec_sources()
+                try:
+                    with open(os.path.join(directory, SOURCES_FILE)) as file:
+                        if file.read() != sources:
+                            raise OSError('stale')
+                    with open(os.path.join(directory, SPEC_FILE), 'rb') as file:
+                        data = file.read()
+                except OSError:
+                    data = encode_spec(build_spec())
+                    write_spec(directory, data, sources)
+                self.etag = spec_etag(data)
+        return self.etag
+
+
+compiled_spec = CompiledSpec()
+
+
+def serve_spec():
+    """
+    The compiled spec with an ETag, gzipped when the client accepts it.
+    Replaces flasgger's view in create_app, so the docs UI loads it.
+    """
+    etag = compiled_spec.etag or compiled_spec.load()
+    if not_modified(etag):
+        response = app.response_class(status=304)
+    else:
+        directory = app.config['OPENAPI_DIR']
+        if request.accept_encodings['gzip'] and os.path.exists(os.path.join(directory, SPEC_FILE + '.gz')):
+            response = send_from_directory(directory, SPEC_FILE + '.gz', mimetype='application/json', etag=False)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(directory, SPEC_FILE, mimetype='application/json', etag=False)
+    # Weak, the plain and gzipped bodies are the same document
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = REVALIDATE
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def spec_drift(compiled, current):
+    """
+    Paths and methods whose documentation differs between two specs, plus
+    'top level' when anything outside paths does
+    """
+    changes = []
+    paths = set(compiled.get('paths', {})) | set(current.get('paths', {}))
+    for path in sorted(paths):
+        old, new = compiled.get('paths', {}).get(path, {}), current.get('paths', {}).get(path, {})
+        for method in sorted(set(old) | set(new)):
+            if old.get(method) != new.get(method):
+                state = 'added' if method not in old else 'removed' if method not in new else 'changed'
+                changes.append(f'{method.upper()} {path} {state}')
+    if {k: v for k, v in compiled.items() if k != 'paths'} != {k: v for k, v in current.items() if k != 'paths'}:
+        changes.append('top level changed')
+    return changes
+
+
+@app.cli.command('openapi')
+@click.option('--check', is_flag=True, help='Fail when the compiled spec is out of date, write nothing.')
+@click.option('--output', default=None, help='Directory to write to, defaults to OPENAPI_DIR.')
+def openapi_command(check, output):
+    """Compile the OpenAPI spec from the route docstrings."""
+    output = output or app.config['OPENAPI_DIR']
+    data = encode_spec(build_spec())
+    if check:
+        try:
+            with open(os.path.join(output, SPEC_FILE), 'rb') as file:
+                compiled = json.loads(file.read())
+        except (OSError, ValueError):
+            raise click.ClickException(f'No compiled spec in {output}, run `flask openapi`')
+        changes = spec_drift(compiled, json.loads(data))
+        for change in changes:
+            click.echo(change, err=True)
+        if changes:
+            raise click.ClickException('The compiled spec is out of date, run `flask openapi`')
+        click.echo('The compiled spec matches the docstrings')
+        return
+    write_spec(output, data, spec_sources())
+    click.echo(f'{SPEC_FILE} {len(data)} bytes, etag {spec_etag(data)}')
+    compiled_spec.etag = None
@@ -0,0 +1,238 @@
+import os
+import random
+import re
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import click
+from decouple import config
+from sqlalchemy import select, update, func
+from src import app, db
+from src.models import ContactMessage, read
+
+app.config['SMTP_HOST'] = config('SMTP_HOST', default='localhost')
+app.config['SMTP_PORT'] = config('SMTP_PORT', default=25, cast=int)
+app.config['SMTP_USERNAME'] = config('SMTP_USERNAME', default='')
+app.config['SMTP_PASSWORD'] = config('SMTP_PASSWORD', default='')
+app.config['SMTP_STARTTLS'] = config('SMTP_STARTTLS', default=False, cast=bool)
+app.config['SMTP_TIMEOUT'] = config('SMTP_TIMEOUT', default=10, cast=float)
+app.config['CONTACT_SENDER'] = config('CONTACT_SENDER', default='website@drainexperts.co.za')
+app.config['CONTACT_RECIPIENT'] = config('CONTACT_RECIPIENT', default='hello@drainexperts.co.za')
+# Send from a thread in every app process. Turn it off to run `flask outbox` instead.
+app.config['OUTBOX_WORKER'] = config('OUTBOX_WORKER', default=True, cast=bool)
+app.config['OUTBOX_BATCH_SIZE'] = config('OUTBOX_BATCH_SIZE', default=20, cast=int)
+app.config['OUTBOX_POLL_INTERVAL'] = config('OUTBOX_POLL_INTERVAL', default=30.0, cast=float)
+app.config['OUTBOX_MAX_ATTEMPTS'] = config('OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+app.config['OUTBOX_RETRY_DELAY'] = config('OUTBOX_RETRY_DELAY', default=30, cast=int)  # seconds, doubled per attempt
+# How long a claimed message is left alone, a worker killed mid-send hands it back after this
+app.config['OUTBOX_LEASE'] = config('OUTBOX_LEASE', default=120, cast=int)
+
+MAX_RETRY_DELAY = 3600
+FIELD_LIMITS = {'name': 100, 'email': 120, 'subject': 200, 'message': 5000}
+# Go into mail headers, where a line break would end the header
+SINGLE_LINE_FIELDS = ('name', 'email', 'subject')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def validate_contact(data):
+    """
+    The form fields, stripped, or ValueError naming the first bad one
+    """
+    fields = {}
+    for name, limit in FIELD_LIMITS.items():
+        value = data.get(name)
+        value = value.strip() if isinstance(value, str) else ''
+        if not value:
+            raise ValueError(f'{name} is required')
+        if len(value) > limit:
+            raise ValueError(f'{name} is longer than {limit} characters')
+        if name in SINGLE_LINE_FIELDS and ('\r' in value or '\n' in value):
+            raise ValueError(f'{name} must be a single line')
+        fields[name] = value
+    if not EMAIL_PATTERN.match(fields['email']):
+        raise ValueError('email is not a valid email address')
+    return fields
+
+
+def enqueue(fields):
+    """
+    Store a message in the outbox and wake the worker. Nothing here talks
+    to the mail server.
+    """
+    message = ContactMessage(**fields)
+    db.session.add(message)
+    db.session.commit()
+    if app.config['OUTBOX_WORKER']:
+        worker.notify()
+    return message
+
+
+def claim(limit):
+    """
+    Take up to limit due messages for this worker, pushing their next
+    attempt past the lease so no other worker sends them meanwhile
+    """
+    now = datetime.utcnow()
+    due = (select(ContactMessage.id)
+           .where(ContactMessage.status == 'pending', ContactMessage.next_attempt_at <= now)
+           .order_by(ContactMessage.next_attempt_at, ContactMessage.id)
+           .limit(limit))
+    statement = (update(ContactMessage)
+                 .where(ContactMessage.id.in_(due.scalar_subquery()))
+                 .values(next_attempt_at=now + timedelta(seconds=app.config['OUTBOX_LEASE']))
+                 .returning(ContactMessage.id, ContactMessage.name, ContactMessage.email,
+                            ContactMessage.subject, ContactMessage.message, ContactMessage.attempts))
+    rows = db.session.execute(statement).all()
+    db.session.commit()
+    return rows
+
+
+def build_email(row):
+    email = EmailMessage()
+    email['From'] = app.config['CONTACT_SENDER']
+    email['To'] = app.config['CONTACT_RECIPIENT']
+    email['Reply-To'] = row.email
+    email['Subject'] = f'[Contact] {row.subject}'
+    email.set_content(f'From: {row.name} <{row.email}>\n\n{row.message}\n')
+    return email
+
+
+def smtp_connection():
+    smtp = smtplib.SMTP(app.config['SMTP_HOST'], app.config['SMTP_PORT'],
+                        timeout=app.config['SMTP_TIMEOUT'])
+    if app.config['SMTP_STARTTLS']:
+        smtp.starttls()
+    if app.config['SMTP_USERNAME']:
+        smtp.login(app.config['SMTP_USERNAME'], app.config['SMTP_PASSWORD'])
+    return smtp
+
+
+def retry_delay(attempts):
+    # Exponential backoff with some jitter, so failed messages do not all
+    # come back at the same moment
+    delay = min(app.config['OUTBOX_RETRY_DELAY'] * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def deliver_batch():
+    """
+    Send one batch of due messages over a single SMTP connection. Returns
+    (sent, failed) counts. Failures are rescheduled with backoff until
+    OUTBOX_MAX_ATTEMPTS, then marked failed. A message that cannot be made
+    into an email is marked failed straight away, retrying would not help.
+    """
+    rows = claim(app.config['OUTBOX_BATCH_SIZE'])
+    if not rows:
+        return 0, 0
+
+    sent, failed, emails = [], [], []
+    for row in rows:
+        try:
+            emails.append((row, build_email(row)))
+        except (ValueError, TypeError) as error:
+            failed.append((row, error, True))
+
+    if emails:
+        try:
+            smtp = smtp_connection()
+        except (smtplib.SMTPException, OSError) as error:
+            failed += [(row, error, False) for row, _ in emails]
+        else:
+            with smtp:
+                for row, email in emails:
+                    try:
+                        smtp.send_message(email)
+                        sent.append(row.id)
+                    except (smtplib.SMTPException, OSError) as error:
+                        failed.append((row, error, False))
+
+    now = datetime.utcnow()
+    if sent:
+        db.session.execute(update(ContactMessage).where(ContactMessage.id.in_(sent))
+                           .values(status='sent', sent_at=now, last_error=None))
+    for row, error, permanent in failed:
+        attempts = row.attempts + 1
+        gave_up = permanent or attempts >= app.config['OUTBOX_MAX_ATTEMPTS']
+        db.session.execute(update(ContactMessage).where(ContactMessage.id == row.id).values(
+            attempts=attempts,
+            status='failed' if gave_up else 'pending',
+            next_attempt_at=now if gave_up else now + retry_delay(attempts),
+            last_error=str(error)[:255] or type(error).__name__,
+        ))
+    db.session.commit()
+    return len(sent), len(failed)
+
+
+def outbox_stats():
+    """
+    Queue depth by status and the age of the oldest unsent message, which is
+    how far delivery is behind
+    """
+    counts = dict(read(
+        select(ContactMessage.status, func.count()).group_by(ContactMessage.status)).all())
+    oldest = read(
+        select(func.min(ContactMessage.created_at)).where(ContactMessage.status == 'pending')).scalar()
+    lag = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    return {
+        'pending': counts.get('pending', 0),
+        'sent': counts.get('sent', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_pending_seconds': round(lag, 3),
+    }
+
+
+class OutboxWorker:
+    """
+    Background thread that sends queued messages. It sleeps until a message
+    is queued in this process or the poll interval passes, which also picks
+    up retries and messages queued by other workers. gunicorn's post_fork
+    starts it in every worker, so messages left over from before a restart
+    go out straight away. Never started on import, so a master that
+    preloads the app does not fork a running thread. Elsewhere (the
+    development server) the first message queued starts it.
+    """
+
+    def __init__(self):
+        self.wake = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def notify(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive() or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='outbox', daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.clear()
+            try:
+                with app.app_context():
+                    sent, failed = deliver_batch()
+            except Exception:
+                app.logger.exception('Outbox delivery failed')
+                sent, failed = 0, 0
+            if sent + failed < app.config['OUTBOX_BATCH_SIZE']:
+                self.wake.wait(app.config['OUTBOX_POLL_INTERVAL'])
+
+
+worker = OutboxWorker()
+
+
+@app.cli.command('outbox')
+@click.option('--once', is_flag=True, help='Send what is due and exit.')
+def outbox_command(once):
+    """Send queued contact messages, for when OUTBOX_WORKER is off."""
+    while True:
+        sent, failed = deliver_batch()
+        if sent or failed:
+            click.echo(f'{sent} sent, {failed} failed')
+        if sent + failed < app.config['OUTBOX_BATCH_SIZE']:
+            if once:
+                return
+            time.sleep(app.config['OUTBOX_POLL_INTERVAL'])
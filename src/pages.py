@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import os
+import threading
+from datetime import datetime
+from flask import request, render_template
+from decouple import config
+from src import app
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always there
+    brotli = None
+
+app.config['PAGE_CACHE_ENABLED'] = config('PAGE_CACHE_ENABLED', default=True, cast=bool)
+app.config['PAGE_CACHE_MAX_AGE'] = config('PAGE_CACHE_MAX_AGE', default=300, cast=int)
+
+# Templates every page extends, a change to any of them changes every page
+LAYOUT_TEMPLATES = ('base.html',)
+
+
+class Page:
+    """
+    One rendered page with its precompressed variants
+    """
+
+    def __init__(self, version, html):
+        self.version = version
+        self.etag = hashlib.sha1(html).hexdigest()
+        self.bodies = {'identity': html, 'gzip': gzip.compress(html, 9)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(html, quality=11)
+
+    def negotiate(self, accept_encodings):
+        """
+        Smallest variant the client accepts, as (encoding, body)
+        """
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encodings[encoding]:
+                return encoding, self.bodies[encoding]
+        return 'identity', self.bodies['identity']
+
+
+class PageCache:
+    """
+    Rendered marketing pages, keyed by endpoint. An entry is used as long as
+    its templates have not been touched since it was rendered, so a deploy
+    that changes templates invalidates it by itself.
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def get(self, endpoint, template, context_key=None):
+        version = (template_mtime(template), context_key)
+        page = self.pages.get(endpoint)
+        if page is None or page.version != version:
+            page = Page(version, render_template(template).encode())
+            with self.lock:
+                self.pages[endpoint] = page
+        return page
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+
+
+def template_mtime(template):
+    folder = os.path.join(app.root_path, app.template_folder)
+    return max(os.stat(os.path.join(folder, name)).st_mtime_ns
+               for name in (template,) + LAYOUT_TEMPLATES)
+
+
+page_cache = PageCache()
+
+
+def page_routes():
+    """
+    URL rules of the marketing pages: GET routes from src/views.py that take
+    no arguments
+    """
+    rules = []
+    for rule in app.url_map.iter_rules():
+        view = app.view_functions.get(rule.endpoint)
+        if view is None or view.__module__ != 'src.views':
+            continue
+        if 'GET' in rule.methods and not rule.arguments:
+            rules.append(rule)
+    return sorted(rules, key=lambda rule: rule.rule)
+
+
+def render_uncached(route):
+    """
+    Response of a page rendered from its templates, going around page_cache
+    """
+    enabled = app.config['PAGE_CACHE_ENABLED']
+    app.config['PAGE_CACHE_ENABLED'] = False
+    try:
+        return app.test_client().get(route)
+    finally:
+        app.config['PAGE_CACHE_ENABLED'] = enabled
+
+
+def render_page(template):
+    """
+    render_template for pages that look the same to every visitor, served
+    from page_cache with a strong ETag and answered with 304 when the
+    client's copy is current
+    """
+    if not app.config['PAGE_CACHE_ENABLED']:
+        return render_template(template)
+
+    # The copyright year is the only thing in the context that changes
+    page = page_cache.get(request.endpoint, template, datetime.now().year)
+    encoding, body = page.negotiate(request.accept_encodings)
+    # Each encoding is a different representation and needs its own tag
+    etag = page.etag if encoding == 'identity' else f'{page.etag}-{encoding}'
+
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f"public, max-age={app.config['PAGE_CACHE_MAX_AGE']}"
+    return response
@@ -0,0 +1,44 @@
+import base64
+import json
+from flask import request
+
+# Largest page a client may ask for in cursor mode
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(*values):
+    """
+    Turn the sort key of the last row on a page into an opaque cursor string
+    """
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverse of encode_cursor. Raises ValueError for anything we did not issue
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or not values:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def clamp_limit(limit, default=10):
+    """
+    Keep a requested page size between 1 and MAX_PAGE_SIZE
+    """
+    if limit is None:
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def wants_count():
+    """
+    Totals are opt-in in cursor mode since COUNT(*) scans the whole table
+    """
+    return request.args.get('count', '').lower() in ('1', 'true', 'yes')
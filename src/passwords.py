@@ -0,0 +1,175 @@
+import hmac
+import os
+import re
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from flask import jsonify
+from werkzeug.security import generate_password_hash, check_password_hash
+from src import app, db, User
+
+# scrypt cost. Raising any of these rehashes each user's password the next
+# time they log in.
+app.config['PASSWORD_SCRYPT_N'] = config('PASSWORD_SCRYPT_N', default=2 ** 15, cast=int)
+app.config['PASSWORD_SCRYPT_R'] = config('PASSWORD_SCRYPT_R', default=8, cast=int)
+app.config['PASSWORD_SCRYPT_P'] = config('PASSWORD_SCRYPT_P', default=1, cast=int)
+# Bulk imports hash at this lighter N, about 15 ms a password instead of
+# 150, so an import of a few thousand users fits in gunicorn's timeout.
+# needs_rehash sees the difference, so the first login rehashes at full cost.
+app.config['PASSWORD_BULK_SCRYPT_N'] = config('PASSWORD_BULK_SCRYPT_N', default=2 ** 12, cast=int)
+# Hashes computed at once per process, and how many more may wait for a
+# worker. Past that a request waits PASSWORD_HASH_WAIT seconds for room, then
+# gets a 503. Together they must stay below gunicorn's threads per worker,
+# see settings/gunicorn.conf.py, or the limit is never reached.
+app.config['PASSWORD_HASH_WORKERS'] = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+app.config['PASSWORD_HASH_QUEUE'] = config('PASSWORD_HASH_QUEUE', default=2, cast=int)
+app.config['PASSWORD_HASH_WAIT'] = config('PASSWORD_HASH_WAIT', default=0.5, cast=float)
+
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+# A whole werkzeug hash, method$salt$hex
+HASH_PATTERN = re.compile(r'^(scrypt:\d+:\d+:\d+|pbkdf2:\w+(:\d+)?)\$[^$]+\$[0-9a-f]+$')
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def hash_method(n=None):
+    return 'scrypt:{}:{}:{}'.format(n or app.config['PASSWORD_SCRYPT_N'], app.config['PASSWORD_SCRYPT_R'],
+                                    app.config['PASSWORD_SCRYPT_P'])
+
+
+def is_hashed(stored):
+    # Anything else is a password stored verbatim before hashing came in
+    return stored.startswith(HASH_PREFIXES)
+
+
+def is_valid_hash(value):
+    return bool(HASH_PATTERN.match(value))
+
+
+def needs_rehash(stored):
+    """
+    True when the stored value is plain text or was hashed with other
+    parameters than the current ones
+    """
+    return not is_hashed(stored) or stored.split('$', 1)[0] != hash_method()
+
+
+class PasswordHasher:
+    """
+    Runs scrypt on a small thread pool. hashlib.scrypt releases the GIL, so
+    the pool hashes on as many cores as it has workers, while the number of
+    hashes in flight stays bounded: a burst of sign-ups or logins is turned
+    away with HasherBusy instead of piling up behind the CPU. Started
+    lazily, so a forked worker gets its own pool.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.slots = None
+        self.pid = None
+
+    def start(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                workers = max(app.config['PASSWORD_HASH_WORKERS'], 1)
+                self.executor = ThreadPoolExecutor(workers, thread_name_prefix='passwords')
+                self.slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE'])
+        return self.executor
+
+    def run(self, function, *args):
+        """
+        Run function on the pool and wait for its result, or HasherBusy when
+        the pool stays full for PASSWORD_HASH_WAIT seconds
+        """
+        executor = self.start()
+        if not self.slots.acquire(timeout=app.config['PASSWORD_HASH_WAIT']):
+            raise HasherBusy()
+        try:
+            return executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def map(self, function, items):
+        """
+        Run function over items on the pool, in order. Each item takes a slot
+        like a single hash does, and at most one per worker is in flight, so
+        the rest of the queue stays free for logins. Waits for slots rather
+        than failing, since a bulk import should not give up half way.
+        """
+        executor = self.start()
+        slots, window = self.slots, max(app.config['PASSWORD_HASH_WORKERS'], 1)
+        results, pending = [], deque()
+        for item in items:
+            if len(pending) >= window:
+                results.append(pending.popleft().result())
+            slots.acquire()
+            try:
+                future = executor.submit(function, item)
+            except BaseException:
+                slots.release()
+                raise
+            future.add_done_callback(lambda _: slots.release())
+            pending.append(future)
+        results.extend(future.result() for future in pending)
+        return results
+
+
+hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return hasher.run(generate_password_hash, password, hash_method())
+
+
+def hash_passwords(passwords):
+    method = hash_method(app.config['PASSWORD_BULK_SCRYPT_N'])
+    return hasher.map(lambda password: generate_password_hash(password, method), passwords)
+
+
+# A hash of a random password per cost setting, made the first time it is
+# needed. Checked when no user matches a login, so an unknown username takes
+# as long to turn away as a wrong password.
+dummy_hashes = {}
+
+
+def dummy_hash():
+    method = hash_method()
+    if method not in dummy_hashes:
+        dummy_hashes[method] = generate_password_hash(secrets.token_urlsafe(16), method)
+    return dummy_hashes[method]
+
+
+def verify_password(stored, password):
+    if not is_hashed(stored):
+        # Constant time, so response times do not give away how much matched
+        return hmac.compare_digest(stored.encode(), password.encode())
+    return hasher.run(check_password_hash, stored, password)
+
+
+def upgrade_password(user_id, stored, password):
+    """
+    Store a fresh hash of a password that was just verified against an
+    outdated one. Skipped when the pool is busy, the next login tries again.
+    The stored value is compared, so a password changed meanwhile stays.
+    """
+    try:
+        new_hash = hash_password(password)
+    except HasherBusy:
+        return False
+    result = db.session.execute(
+        db.update(User).where(User.id == user_id, User.password == stored).values(password=new_hash))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    response = jsonify({'message': 'Too many password checks in progress, try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
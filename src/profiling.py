@@ -0,0 +1,219 @@
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, request, has_request_context
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src import app
+from src.auth import current_claims
+
+# Admins can profile a single request by sending `X-Profile: 1` (or
+# ?profile=1) with their access token. Turn it off to ignore the flag.
+app.config['PROFILE_ENABLED'] = config('PROFILE_ENABLED', default=True, cast=bool)
+app.config['PROFILE_DIR'] = config('PROFILE_DIR', default=os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_SAMPLE_INTERVAL'] = config('PROFILE_SAMPLE_INTERVAL', default=0.001, cast=float)
+# Statements slower than this many milliseconds go to the slow query log,
+# with their EXPLAIN QUERY PLAN. 0 turns the log off.
+app.config['SLOW_QUERY_MS'] = config('SLOW_QUERY_MS', default=100, cast=float)
+app.config['SLOW_QUERY_LOG'] = config('SLOW_QUERY_LOG', default=os.path.join(app.instance_path, 'slow_queries.log'))
+
+MAX_PARAMETER_LENGTH = 100
+# Parameters of statements that mention a password column are left out of
+# the log, they can hold a hash or the password a user just typed
+SECRET_COLUMN = re.compile(r'\bpassword\b', re.IGNORECASE)
+REDACTED = '[redacted]'
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every interval seconds from a thread of
+    its own, counting each distinct stack. The counts are what flame graph
+    tools read as collapsed stacks.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+# Set while this thread runs a profiled request, so the sub-requests of a
+# profiled /api/batch do not start profilers of their own
+profiling = threading.local()
+
+
+def wants_profile():
+    if not app.config['PROFILE_ENABLED'] or getattr(profiling, 'active', False):
+        return False
+    if request.headers.get('X-Profile') != '1' and request.args.get('profile') != '1':
+        return False
+    claims = current_claims()
+    return bool(claims and claims.get('adm'))
+
+
+@app.before_request
+def start_profile():
+    if not wants_profile():
+        return
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), app.config['PROFILE_SAMPLE_INTERVAL'])
+    g.profile = (profiler, sampler, time.perf_counter())
+    profiling.active = True
+    sampler.start()
+    profiler.enable()
+
+
+def stop_profile():
+    state = g.pop('profile', None)
+    if state is not None:
+        profiler, sampler, _ = state
+        profiler.disable()
+        sampler.stop()
+        profiling.active = False
+    return state
+
+
+@app.after_request
+def save_profile(response):
+    """
+    Write the profile of this request as <name>.pstats, for pstats or
+    snakeviz, and <name>.folded, for flamegraph.pl or speedscope
+    """
+    state = stop_profile()
+    if state is None:
+        return response
+    profiler, sampler, started = state
+
+    name = '{}-{}-{}'.format(datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f'),
+                             request.endpoint or 'none', os.getpid())
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, f'{name}.pstats'))
+    with open(os.path.join(directory, f'{name}.folded'), 'w') as file:
+        file.write(sampler.collapsed())
+
+    response.headers['X-Profile'] = name
+    response.headers['X-Profile-Seconds'] = f'{time.perf_counter() - started:.6f}'
+    return response
+
+
+@app.teardown_request
+def discard_profile(error):
+    # after_request also runs on responses from error handlers and on the 500
+    # handle_exception makes, but not when an exception propagates out of
+    # handle_exception (PROPAGATE_EXCEPTIONS, on in debug and testing) or
+    # an after_request function raises. The profiler has to stop then too.
+    stop_profile()
+
+
+def short_parameter(value):
+    # Cut down to something JSON can hold and a reader can take in
+    if isinstance(value, str):
+        return value if len(value) <= MAX_PARAMETER_LENGTH else value[:MAX_PARAMETER_LENGTH] + '...'
+    return value if isinstance(value, (int, float, bool, type(None))) else short_parameter(repr(value))
+
+
+def query_plan(cursor, statement, parameters):
+    """
+    EXPLAIN QUERY PLAN of a statement that just ran, on a cursor of its own
+    so the caller's results are left alone. Only SQLite has one.
+    """
+    try:
+        plan = cursor.connection.cursor().execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+        return [row[-1] for row in plan.fetchall()]
+    except Exception as error:
+        return [f'unavailable: {error}']
+
+
+class SlowQueryLog:
+    """
+    Appends a JSON line per slow statement to SLOW_QUERY_LOG: how long it
+    took, the endpoint that ran it, its parameters (long values cut short,
+    secret ones redacted) and its query plan. `scans` lists full table scans, which are what a
+    missing index looks like.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def record(self, cursor, statement, parameters, executemany, seconds, dialect):
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        plan = query_plan(cursor, statement, parameters) if dialect == 'sqlite' else []
+        secret = SECRET_COLUMN.search(statement)
+        show = (lambda value: REDACTED) if secret else short_parameter
+        if isinstance(parameters, dict):
+            shown = {name: show(value) for name, value in parameters.items()}
+        else:
+            shown = [show(value) for value in parameters or ()]
+        entry = {
+            'at': datetime.utcnow().isoformat(timespec='milliseconds'),
+            'ms': round(seconds * 1000, 3),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'statement': ' '.join(statement.split()),
+            'parameters': shown,
+            'executemany': executemany,
+            'plan': plan,
+            'scans': [step for step in plan if step.startswith('SCAN ') and ' USING ' not in step],
+        }
+        if entry['scans']:
+            app.logger.warning('Slow query (%.1f ms) scans %s: %s', entry['ms'],
+                               ', '.join(entry['scans']), entry['statement'])
+        path = app.config['SLOW_QUERY_LOG']
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self.lock, open(path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+
+slow_queries = SlowQueryLog()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, like the metrics, so failed statements leave nothing behind
+    if context is not None:
+        context.slow_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def log_slow_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'slow_query_started', None)
+    threshold = app.config['SLOW_QUERY_MS']
+    if started is None or not threshold:
+        return
+    seconds = time.perf_counter() - started
+    if seconds * 1000 >= threshold and not statement.startswith('EXPLAIN'):
+        try:
+            slow_queries.record(cursor, statement, parameters, executemany, seconds, conn.dialect.name)
+        except Exception:
+            app.logger.exception('Could not write the slow query log')
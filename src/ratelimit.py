@@ -0,0 +1,198 @@
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from flask import request, jsonify
+from decouple import config
+from src import app
+from src.auth import current_claims
+from src.storage import SqliteStore
+
+
+def parse_budgets(value):
+    """
+    {endpoint: (capacity, seconds)} from 'endpoint=capacity/seconds,...'
+    """
+    budgets = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        endpoint, _, budget = item.partition('=')
+        capacity, _, seconds = budget.partition('/')
+        budgets[endpoint.strip()] = (int(capacity), float(seconds))
+    return budgets
+
+
+app.config['RATE_LIMIT_ENABLED'] = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+# endpoint=requests/seconds: a bucket of `requests` tokens per client, refilled
+# evenly over `seconds`, so bursts up to the bucket size get through. The
+# sub-requests of a batch are charged to the caller as if sent on their own.
+app.config['RATE_LIMITS'] = config(
+    'RATE_LIMITS',
+    default='add_user=5/60,batch=10/10,bulk_add_users=2/60,login=10/60,search_users=30/10,'
+            'subscribe=5/60,submit_contact=5/60',
+    cast=parse_budgets)
+
+
+class MemoryBuckets:
+    """
+    Token buckets inside one process, for tests and the development server.
+    Every gunicorn worker would get its own, so production uses SqliteBuckets.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        """
+        Take a token, returns 0 when one was left, otherwise the seconds
+        until there is one
+        """
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+    def prune(self, before):
+        with self.lock:
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[1] >= before}
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def counts(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+            self.counters.clear()
+
+
+class SqliteBuckets(SqliteStore):
+    """
+    Token buckets every worker process shares through a small SQLite file,
+    separate from the main database like the user cache. A token is taken
+    with one upsert that only writes when the refilled bucket has one, so
+    concurrent workers cannot both take the last token.
+    """
+
+    TAKE = """
+        INSERT INTO buckets (key, tokens, updated_at) VALUES (:key, :capacity - 1, :now)
+        ON CONFLICT (key) DO UPDATE
+        SET tokens = min(:capacity, tokens + (:now - updated_at) * :rate) - 1, updated_at = :now
+        WHERE min(:capacity, tokens + (:now - updated_at) * :rate) >= 1
+        RETURNING tokens
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS buckets_updated_at ON buckets (updated_at);
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+
+    def take(self, key, capacity, rate, now):
+        with self.connection as connection:
+            params = {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}
+            if connection.execute(self.TAKE, params).fetchone() is not None:
+                return 0
+            tokens, updated_at = connection.execute(
+                'SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        return (1 - tokens) / rate
+
+    def prune(self, before):
+        with self.connection as connection:
+            connection.execute('DELETE FROM buckets WHERE updated_at < ?', (before,))
+
+    def incr(self, name):
+        with self.connection as connection:
+            connection.execute(
+                'INSERT INTO counters (name, value) VALUES (?, 1) '
+                'ON CONFLICT (name) DO UPDATE SET value = value + 1', (name,))
+
+    def counts(self):
+        return dict(self.connection.execute('SELECT name, value FROM counters').fetchall())
+
+    def clear(self):
+        with self.connection as connection:
+            connection.execute('DELETE FROM buckets')
+            connection.execute('DELETE FROM counters')
+
+
+class RateLimiter:
+    """
+    Per-client token buckets for the endpoints in RATE_LIMITS. A client is
+    the user of a valid access token, otherwise the address nginx passes in
+    X-Real-IP. Rejected requests are counted per endpoint for /metrics.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def check(self, endpoint, client):
+        """
+        0 when the request may go ahead, otherwise seconds to wait
+        """
+        budget = app.config['RATE_LIMITS'].get(endpoint)
+        if budget is None:
+            return 0
+        capacity, seconds = budget
+        now = time.time()
+        wait = self.backend.take(f'{endpoint}:{client}', capacity, capacity / seconds, now)
+        if wait:
+            self.backend.incr(endpoint)
+        elif random.random() < 0.001:
+            # A bucket idle for longer than any refill is full, same as a missing one
+            longest = max(seconds for _, seconds in app.config['RATE_LIMITS'].values())
+            self.backend.prune(now - longest)
+        return wait
+
+    def throttled(self):
+        return self.backend.counts()
+
+    def clear(self):
+        self.backend.clear()
+
+
+def make_backend():
+    if config('RATE_LIMIT_BACKEND', default='sqlite') == 'memory':
+        return MemoryBuckets()
+    return SqliteBuckets(config('RATE_LIMIT_PATH', default=os.path.join(app.instance_path, 'ratelimit.db')))
+
+
+rate_limiter = RateLimiter(make_backend())
+
+
+def client_key():
+    claims = current_claims()
+    if claims:
+        return f"user:{claims['sub']}"
+    return request.headers.get('X-Real-IP') or request.remote_addr or 'unknown'
+
+
+@app.before_request
+def enforce_rate_limit():
+    # Runs before the view, so a throttled request never reaches the database
+    if not app.config['RATE_LIMIT_ENABLED'] or request.endpoint not in app.config['RATE_LIMITS']:
+        return None
+    try:
+        wait = rate_limiter.check(request.endpoint, client_key())
+    except sqlite3.Error:
+        # A limiter that cannot count lets requests through rather than failing them
+        app.logger.exception('Rate limiter unavailable')
+        return None
+    if not wait:
+        return None
+    response = jsonify({'message': 'Too many requests, slow down'})
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response, 429
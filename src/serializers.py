@@ -0,0 +1,69 @@
+from functools import lru_cache
+from operator import attrgetter
+from src import db, User
+
+
+class ModelSerializer:
+    """
+    Turns model instances or column rows into JSON-ready dicts.
+
+    The field list is fixed when the serializer is built, so dumping a row
+    is a single attrgetter call and a zip, instead of the recursive deep copy
+    dataclasses.asdict does for jsonify(model).
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+
+    def parse_fields(self, value):
+        """
+        Turn ?fields=id,username into a tuple of field names, raising
+        ValueError for anything this serializer does not expose
+        """
+        if not value:
+            return self.fields
+        fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return fields
+
+    def columns(self, fields=None):
+        """
+        Columns to put in a SELECT so only the requested fields are loaded
+        """
+        return [getattr(self.model, field) for field in fields or self.fields]
+
+    def select(self, fields=None):
+        return db.select(*self.columns(fields))
+
+    def dump(self, instance, fields=None):
+        fields = fields or self.fields
+        return dict(zip(fields, _getter(fields)(instance)))
+
+    def dump_row(self, row, fields=None):
+        """
+        Dump a row that came from select(fields)
+        """
+        return dict(zip(fields or self.fields, row))
+
+    def project(self, data, fields=None):
+        """
+        Narrow an already dumped dict, e.g. one read from the cache
+        """
+        if not fields or fields == self.fields:
+            return data
+        return {field: data[field] for field in fields}
+
+
+@lru_cache(maxsize=128)
+def _getter(fields):
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda instance: (getter(instance),)
+    return getter
+
+
+# Everything but the password hash
+user_serializer = ModelSerializer(User, ('id', 'first_name', 'last_name', 'username', 'email', 'is_admin'))
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import threading
+
+
+def atomic_write(path, data):
+    """
+    Write data to path through a temporary file replaced in one step, so a
+    worker reading meanwhile gets the old or the new file, never half
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(data)
+    os.replace(tmp, path)
+
+
+class SqliteStore:
+    """
+    A small SQLite file every worker process shares, separate from the main
+    database. Subclasses set SCHEMA, which is created on first connect.
+    """
+
+    SCHEMA = ''
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        # One connection per thread, and a fresh one after gunicorn forks
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(self.SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
@@ -0,0 +1,133 @@
+import atexit
+import os
+import threading
+from datetime import datetime
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from src import app, db
+from src.models import Subscriber
+from src.outbox import EMAIL_PATTERN
+
+# A flush happens when this many new addresses are waiting, or when the
+# oldest has waited this long, whichever comes first
+app.config['SUBSCRIBE_BATCH_SIZE'] = config('SUBSCRIBE_BATCH_SIZE', default=500, cast=int)
+app.config['SUBSCRIBE_FLUSH_INTERVAL'] = config('SUBSCRIBE_FLUSH_INTERVAL', default=2.0, cast=float)
+# Addresses this process has stored, so repeat sign-ups cost nothing
+app.config['SUBSCRIBE_KNOWN_MAX'] = config('SUBSCRIBE_KNOWN_MAX', default=100000, cast=int)
+
+INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def normalize_email(value):
+    """
+    Lower-cased address, or ValueError when it is not one
+    """
+    email = value.strip().lower() if isinstance(value, str) else ''
+    if not email or len(email) > 120 or not EMAIL_PATTERN.match(email):
+        raise ValueError('A valid email address is required')
+    return email
+
+
+class SubscriptionBuffer:
+    """
+    Write-behind buffer for sign-ups. add() only touches memory: duplicates
+    of an address that is waiting or already stored are dropped, and the
+    rest go to the database in one transaction per flush. Whatever is still
+    waiting when the process exits is flushed by an atexit hook, which
+    gunicorn runs on a graceful worker shutdown.
+    """
+
+    def __init__(self):
+        self.pending = set()
+        self.known = set()
+        self.lock = threading.Lock()
+        self.timer = None
+        self.pid = None
+        self.flushes = 0
+
+    def add(self, email):
+        """
+        Queue an address, returns False when it was seen before
+        """
+        with self.lock:
+            if email in self.pending or email in self.known:
+                return False
+            self.pending.add(email)
+            full = len(self.pending) >= app.config['SUBSCRIBE_BATCH_SIZE']
+            if not full:
+                self.schedule()
+        if full:
+            self.flush()
+        return True
+
+    def schedule(self):
+        # A timer per waiting batch makes sure a quiet minute still gets
+        # flushed. Started lazily, so a forked worker gets its own.
+        if self.pid != os.getpid() or self.timer is None or not self.timer.is_alive():
+            self.pid = os.getpid()
+            self.timer = threading.Timer(app.config['SUBSCRIBE_FLUSH_INTERVAL'], self.flush_in_context)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_in_context(self):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception:
+            # Kept in the buffer, the next sign-up schedules another try
+            app.logger.exception('Could not store %d buffered subscriptions', len(self.pending))
+
+    def flush(self):
+        """
+        Store every waiting address in one transaction. On failure they go
+        back to the buffer for the next flush.
+        """
+        with self.lock:
+            batch, self.pending = self.pending, set()
+        if not batch:
+            return 0
+
+        now = datetime.utcnow()
+        rows = [{'email': email, 'created_at': now} for email in sorted(batch)]
+        try:
+            insert = INSERTS.get(db.engine.dialect.name)
+            if insert is not None:
+                db.session.execute(insert(Subscriber).on_conflict_do_nothing(index_elements=['email']), rows)
+            else:
+                stored = set(db.session.execute(
+                    db.select(Subscriber.email).where(Subscriber.email.in_(batch))).scalars())
+                db.session.execute(db.insert(Subscriber), [row for row in rows if row['email'] not in stored])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                self.pending |= batch
+            raise
+
+        with self.lock:
+            if len(self.known) + len(batch) > app.config['SUBSCRIBE_KNOWN_MAX']:
+                self.known.clear()
+            self.known |= batch
+            self.flushes += 1
+        return len(batch)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+            self.known.clear()
+
+
+subscriptions = SubscriptionBuffer()
+
+# Addresses known to be stored are not once the table is recreated
+event.listen(Subscriber.__table__, 'after_drop', lambda target, connection, **kw: subscriptions.clear())
+
+
+@atexit.register
+def flush_subscriptions():
+    try:
+        with app.app_context():
+            subscriptions.flush()
+    except Exception:
+        app.logger.exception('Could not store %d buffered subscriptions', len(subscriptions.pending))
@@ -1,10 +1,16 @@
 
 from datetime import datetime
-from flask import render_template
+from functools import lru_cache
 from src import app
+from src.pages import render_page
 
 @app.context_processor
 def inject_globals():
+    return site_globals(datetime.now().year)
+
+# Built once per year instead of on every render
+@lru_cache(maxsize=2)
+def site_globals(year):
     company = "Drain Expertz"
     return {
         "company": company,
@@ -13,36 +19,36 @@ def inject_globals():
         "title": 'Plumbing Services Near Me',
         "email": 'hello@drainexperts.co.za',
         "address": "395 Francis Baard Street</p><p>Pretoria Central, 0001/2</p><p>South Africa",
-        "copyright_notice": f"© {datetime.now().year} { company }. All rights reserved.",
-        "copyright": f"""© <span>{datetime.now().year}</span><strong class="px-1 sitename">{ company }.</strong> <span>All Rights Reserved.</span>""",
+        "copyright_notice": f"© {year} { company }. All rights reserved.",
+        "copyright": f"""© <span>{year}</span><strong class="px-1 sitename">{ company }.</strong> <span>All Rights Reserved.</span>""",
     }
 
 @app.route("/")
 def home():
-    return render_template("index.html")
+    return render_page("index.html")
 
 # @app.route("/features")
 @app.route("/about")
 def about():
-    return render_template("about.html")
+    return render_page("about.html")
 
 @app.route("/services")
 def services():
-    return render_template("services.html")
+    return render_page("services.html")
 
 @app.route("/tos")
 def tos():
-    return render_template("services.html")
+    return render_page("services.html")
 
 @app.route("/portfolio")
 def portfolio():
-    return render_template("portfolio.html")
+    return render_page("portfolio.html")
 
 @app.route("/team")
 def team():
-    return render_template("team.html")
+    return render_page("team.html")
 
 @app.route("/contact")
 def contact():
-    return render_template("contact.html")
+    return render_page("contact.html")
 
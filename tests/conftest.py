@@ -0,0 +1,7 @@
+# The tests run against the app a server gets, admin panel and docs included
+from src import app, create_app
+
+create_app()
+
+# Tests send many requests from one client, test_ratelimit.py turns it back on
+app.config['RATE_LIMIT_ENABLED'] = False
@@ -11,4 +11,41 @@ def client():
 def test_home(client):
     response = client.get('/api')
     assert response.status_code == 200
-    assert response.get_json() == {'message': 'You are now subscribed to our newsletter!.'}
\ No newline at end of file
+    assert response.get_json() == {'message': 'You are now subscribed to our newsletter!.'}
+
+def test_import_is_cheap(tmp_path):
+    """Test importing src loads no server-only extension and opens no database"""
+    import os
+    import subprocess
+    import sys
+    script = ("import sys, src; "
+              "print(','.join(m for m in ('flasgger', 'flask_admin', 'flask_migrate') if m in sys.modules))")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'fresh.db'}")
+    output = subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == ''
+    assert not (tmp_path / 'fresh.db').exists()
+
+def test_app_runs_on_an_in_memory_database(tmp_path):
+    """Test an in-memory URL gets no pool options and no separate read engine"""
+    import os
+    import subprocess
+    import sys
+    script = ("import json, src; from src import create_app, db; app = create_app(); "
+              "ctx = app.app_context(); ctx.push(); db.create_all(); client = app.test_client(); "
+              "client.post('/api/users', json={'username': 'memo', 'email': 'memo@example.com', "
+              "'first_name': 'A', 'last_name': 'B', 'password': '#Maanda2'}); "
+              "print(sorted(db.engines), [user['username'] for user in client.get('/api/users').get_json()])")
+    # Nothing shared with the test run's own app, the user cache included
+    env = dict(os.environ, DATABASE_URL='sqlite:///:memory:', PASSWORD_SCRYPT_N='128',
+               USER_CACHE_BACKEND='memory', RATE_LIMIT_BACKEND='memory', METRICS_DIR=str(tmp_path))
+    output = subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == "[None] ['memo']"
+
+def test_create_app_adds_docs_and_admin():
+    """Test the factory wires up the server-only extensions once"""
+    from src import create_app
+    assert create_app() is app
+    assert {'flasgger', 'admin'} <= set(app.blueprints)
+    assert 'migrate' in app.extensions
@@ -0,0 +1,62 @@
+import gzip
+import os
+import shutil
+import pytest
+from flask import url_for
+from src import app
+from src.assets import asset_manifest, build_assets
+
+@pytest.fixture
+def client(tmp_path):
+    """Build hashed copies of main.css and main.js into a temporary ASSETS_DIR"""
+    static_dir = tmp_path / 'static'
+    for name in ('css/main.css', 'js/main.js'):
+        os.makedirs(static_dir / os.path.dirname(name), exist_ok=True)
+        shutil.copy(os.path.join(app.static_folder, name), static_dir / name)
+
+    assets_dir = app.config['ASSETS_DIR']
+    app.config['ASSETS_DIR'] = str(tmp_path / 'build')
+    build_assets(str(static_dir), app.config['ASSETS_DIR'])
+    asset_manifest.load()
+    yield app.test_client()
+    app.config['ASSETS_DIR'] = assets_dir
+    asset_manifest.load()
+
+def test_url_for_uses_hashed_name(client):
+    with app.test_request_context():
+        url = url_for('static', filename='css/main.css')
+        assert url.startswith('/static/css/main.') and url != '/static/css/main.css'
+        assert url_for('static', filename='img/logo.png') == '/static/img/logo.png'
+
+    assert url.encode() in client.get('/about').data
+
+def test_hashed_asset_is_immutable_and_precompressed(client):
+    with app.test_request_context():
+        url = url_for('static', filename='css/main.css')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/css'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'Content-Encoding' not in response.headers
+
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.mimetype == 'text/css'
+    assert gzip.decompress(compressed.data) == response.data
+
+def test_unhashed_static_files_still_served(client):
+    response = client.get('/static/img/logo.png')
+
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+def test_build_assets_skips_existing(tmp_path):
+    static_dir = tmp_path / 'static'
+    os.makedirs(static_dir)
+    (static_dir / 'a.js').write_text('var a = 1;')
+
+    manifest, written = build_assets(str(static_dir), str(tmp_path / 'out'))
+    assert written == 1
+    assert (tmp_path / 'out' / (manifest['a.js'] + '.gz')).exists()
+    assert build_assets(str(static_dir), str(tmp_path / 'out'))[1] == 0
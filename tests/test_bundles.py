@@ -0,0 +1,55 @@
+import pytest
+from src import app
+from src.bundles import bundle_manifest, build_bundles, critical_css, minify_css, vendors_for
+
+@pytest.fixture(scope='module')
+def bundles(tmp_path_factory):
+    """Bundles of every page, built into a temporary BUNDLES_DIR"""
+    bundles_dir = app.config['BUNDLES_DIR']
+    app.config['BUNDLES_DIR'] = str(tmp_path_factory.mktemp('bundles'))
+    manifest = build_bundles(app.config['BUNDLES_DIR'])
+    bundle_manifest.load()
+    yield manifest
+    app.config['BUNDLES_DIR'] = bundles_dir
+    bundle_manifest.load()
+
+def test_minify_css_keeps_strings_and_licences():
+    css = '/*! MIT */\n/* note */\n.a , .b {\n  content: "a  ;  b" ;\n  margin : 0 auto;\n}\n'
+
+    assert minify_css(css) == '/*! MIT */ .a,.b{content: "a  ;  b";margin : 0 auto}'
+
+def test_critical_css_keeps_rules_for_seen_elements():
+    css = (':root{--x:1}*{box-sizing:border-box}.hero h1{color:red}.footer{color:blue}'
+           '.hero:hover,.footer a{color:green}[data-aos]{opacity:0}::-webkit-inner-spin-button{height:auto}'
+           '@media (min-width:768px){.hero{padding:0}.footer{padding:0}}@keyframes spin{to{opacity:1}}')
+
+    assert critical_css(css, {'.hero', 'h1', 'section'}) == (
+        ':root{--x:1}*{box-sizing:border-box}.hero h1{color:red}.hero:hover{color:green}'
+        '@media (min-width:768px){.hero{padding:0}}')
+
+def test_vendors_for_markers():
+    names = [vendor[0] for vendor in vendors_for({'.isotope-layout', '[data-aos]'})]
+
+    assert names == ['bootstrap', 'bootstrap-icons', 'aos', 'isotope', 'main']
+
+def test_page_uses_its_bundle(bundles):
+    bundle = bundles['portfolio']
+    assert 'isotope' in bundle['vendors'] and 'swiper' not in bundle['vendors']
+
+    response = app.test_client().get('/portfolio')
+    html = response.get_data(as_text=True)
+    assert f'<style>{bundle["critical"]}</style>' in html
+    assert f'/static/bundles/{bundle["js"]}" defer' in html
+    assert 'vendor/swiper' not in html
+    # In the page, which nginx serves frozen without the app's headers
+    assert f'<link href="/static/bundles/{bundle["js"]}" rel="preload" as="script">' in html
+    assert 'Link' not in response.headers
+
+def test_bundle_is_immutable_and_precompressed(bundles):
+    url = f'/static/bundles/{bundles["home"]["css"]}'
+
+    response = app.test_client().get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/css'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
@@ -0,0 +1,94 @@
+import time
+from src.cache import MemoryCache, SqliteCache, UserCache
+
+
+def test_memory_cache_lru_and_ttl():
+    """Test the oldest entry is evicted and expired entries are misses"""
+    cache = MemoryCache(max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    cache.ttl = -1
+    cache.set('d', 4)
+    assert cache.get('d') is None
+
+def test_sqlite_cache_is_shared(tmp_path):
+    """Test two workers pointing at the same file see each other's writes"""
+    path = str(tmp_path / 'cache.db')
+    worker_1 = UserCache(SqliteCache(path))
+    worker_2 = UserCache(SqliteCache(path))
+
+    loads = []
+    load = lambda: loads.append(1) or {'id': 1, 'username': 'johndoe'}
+
+    assert worker_1.get_or_load('user:1', load) == {'id': 1, 'username': 'johndoe'}
+    assert worker_2.get_or_load('user:1', load) == {'id': 1, 'username': 'johndoe'}
+    assert len(loads) == 1
+
+    key = worker_2.list_key('page:1:10')
+    worker_1.invalidate(1)
+    assert worker_2.list_key('page:1:10') != key
+    worker_2.get_or_load('user:1', load)
+    assert len(loads) == 2
+
+    # Counted in memory until flushed, which the metrics do every interval
+    worker_2.flush()
+    assert worker_1.stats() == {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333}
+
+def test_sqlite_cache_lru_and_ttl(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.db'), max_entries=2, ttl=60)
+    cache.TOUCH_INTERVAL = 0  # Exact recency, so eviction order is predictable
+    cache.set('a', 1)
+    time.sleep(0.01)
+    cache.set('b', 2)
+    time.sleep(0.01)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    cache.ttl = -1
+    cache.set('d', 4)
+    assert cache.get('d') is None
+
+def test_sqlite_cache_hits_do_not_write(tmp_path):
+    """Test a hit on a recently used entry writes nothing, and the entry count is kept up"""
+    cache = SqliteCache(str(tmp_path / 'cache.db'))
+    cache.set_many({'a': 1, 'b': 2})
+    cache.set('a', 3)
+    changes = cache.connection.total_changes
+    assert cache.get('a') == 3
+    assert cache.get_many(['a', 'b', 'c']) == {'a': 3, 'b': 2}
+    assert cache.connection.total_changes == changes
+    assert cache.counter('entries') == 2 and cache.counter('hits') == 3
+
+    cache.flush()
+    assert cache.pending == {} and cache.counter('misses') == 1
+    cache.delete('b')
+    assert cache.counter('entries') == 1
+
+def test_load_racing_an_invalidation_is_not_stored(tmp_path):
+    """Test a value read before another worker's write does not outlive the write"""
+    for backend in (MemoryCache(), SqliteCache(str(tmp_path / 'cache.db'))):
+        reader, writer = UserCache(backend), UserCache(backend)
+
+        def load_then_lose_the_race():
+            # The row is read, then a write lands before it reaches the cache
+            writer.invalidate(1)
+            return {'id': 1, 'username': 'old'}
+
+        assert reader.get_or_load('user:1', load_then_lose_the_race) == {'id': 1, 'username': 'old'}
+        assert reader.get('user:1') is None
+
+        generation = reader.generation()
+        reader.set_many({'user:1': {'id': 1}, 'user:2': {'id': 2}}, generation)
+        assert reader.get_many(['user:1', 'user:2']) == {'user:1': {'id': 1}, 'user:2': {'id': 2}}
+        writer.invalidate(3)
+        reader.set('user:3', {'id': 3}, generation)
+        assert reader.get('user:3') is None
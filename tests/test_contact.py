@@ -0,0 +1,147 @@
+import socketserver
+import threading
+from datetime import datetime
+import pytest
+from src import app, db
+from src.models import ContactMessage
+from src.outbox import deliver_batch
+
+MESSAGE = {'name': 'Maanda', 'email': 'maanda@example.com', 'subject': 'Blocked drain',
+           'message': 'The kitchen sink will not drain.'}
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail and keep it in server.received"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost')
+        while line := self.rfile.readline().decode():
+            command = line[:4].upper()
+            if command == 'EHLO' or command == 'HELO':
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while (line := self.rfile.readline().decode()) not in ('.\r\n', ''):
+                    data.append(line)
+                self.server.received.append(''.join(data))
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+    server.received = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = app.config['SMTP_HOST'], app.config['SMTP_PORT']
+    app.config['SMTP_HOST'], app.config['SMTP_PORT'] = server.server_address
+    yield server
+    app.config['SMTP_HOST'], app.config['SMTP_PORT'] = host, port
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client():
+    """Queue messages without the background worker, tests deliver them by hand"""
+    app.config['OUTBOX_WORKER'] = False
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.execute(db.delete(ContactMessage))
+        db.session.commit()
+    app.config['OUTBOX_WORKER'] = True
+
+def test_contact_is_queued(client):
+    response = client.post('/api/contact', json=MESSAGE)
+
+    assert response.status_code == 202
+    message = db.session.get(ContactMessage, response.get_json()['id'])
+    assert message.status == 'pending' and message.subject == 'Blocked drain'
+
+def test_contact_form_post_answers_ok(client):
+    response = client.post('/api/contact', data=MESSAGE)
+
+    assert response.status_code == 202
+    assert response.data == b'OK'
+
+def test_contact_validation(client):
+    response = client.post('/api/contact', json=dict(MESSAGE, email='not-an-email'))
+    assert response.status_code == 400
+    assert 'email' in response.get_json()['message']
+
+    response = client.post('/api/contact', json=dict(MESSAGE, subject='Hi\r\nBcc: everyone@example.com'))
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'subject must be a single line'
+
+    response = client.post('/api/contact', data=dict(MESSAGE, message='  '))
+    assert response.status_code == 400
+    assert response.data == b'message is required'
+
+def test_deliver_batch_sends_over_smtp(client, smtp_server):
+    client.post('/api/contact', json=MESSAGE)
+    client.post('/api/contact', json=dict(MESSAGE, subject='Geyser leak'))
+
+    assert deliver_batch() == (2, 0)
+    assert len(smtp_server.received) == 2
+    assert 'Subject: [Contact] Blocked drain' in smtp_server.received[0]
+    assert 'Reply-To: maanda@example.com' in smtp_server.received[0]
+    assert deliver_batch() == (0, 0)
+
+    stats = client.get('/api/contact/stats').get_json()
+    assert stats == {'pending': 0, 'sent': 2, 'failed': 0, 'oldest_pending_seconds': 0.0}
+
+def test_message_that_cannot_be_sent_does_not_hold_up_the_rest(client, smtp_server):
+    # Queued before single line subjects were checked
+    db.session.add(ContactMessage(**dict(MESSAGE, subject='Blocked\ndrain')))
+    db.session.commit()
+    client.post('/api/contact', json=MESSAGE)
+
+    assert deliver_batch() == (1, 1)
+    assert len(smtp_server.received) == 1
+    broken = ContactMessage.query.filter_by(subject='Blocked\ndrain').one()
+    assert broken.status == 'failed' and broken.attempts == 1 and broken.last_error
+    assert deliver_batch() == (0, 0)
+
+def test_failed_delivery_backs_off_then_gives_up(client):
+    host, port = app.config['SMTP_HOST'], app.config['SMTP_PORT']
+    app.config['SMTP_HOST'], app.config['SMTP_PORT'] = '127.0.0.1', 1  # nothing listens here
+    try:
+        message_id = client.post('/api/contact', json=MESSAGE).get_json()['id']
+        assert deliver_batch() == (0, 1)
+
+        message = db.session.get(ContactMessage, message_id)
+        assert message.status == 'pending' and message.attempts == 1
+        assert message.next_attempt_at > datetime.utcnow()
+        assert message.last_error
+        # Not due yet
+        assert deliver_batch() == (0, 0)
+
+        message.attempts = app.config['OUTBOX_MAX_ATTEMPTS'] - 1
+        message.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert deliver_batch() == (0, 1)
+        db.session.refresh(message)
+        assert message.status == 'failed'
+    finally:
+        app.config['SMTP_HOST'], app.config['SMTP_PORT'] = host, port
+
+def test_contact_page_posts_to_api(client):
+    assert b'action="/api/contact"' in client.get('/contact').data
+
+def test_gunicorn_workers_start_the_outbox(monkeypatch):
+    """Test every forked worker starts sending, not only once a message is queued"""
+    import os
+    import runpy
+    from src.outbox import worker
+    started = []
+    monkeypatch.setattr(worker, 'notify', lambda: started.append(os.getpid()))
+    monkeypatch.setitem(app.config, 'METRICS_SHARED', False)
+    settings = runpy.run_path(os.path.join(os.path.dirname(app.root_path), 'settings', 'gunicorn.conf.py'))
+    settings['post_fork'](None, None)
+    assert started == [os.getpid()]
@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+from src import app, db
+from src.models import read
+
+@pytest.fixture
+def context():
+    with app.app_context():
+        yield
+        db.session.remove()
+
+def test_sqlite_pragmas_applied(context):
+    """Test every pooled connection is tuned on connect"""
+    assert db.session.execute(db.text('PRAGMA journal_mode')).scalar() == 'wal'
+    assert db.session.execute(db.text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+    assert db.session.execute(db.text('PRAGMA busy_timeout')).scalar() == 5000
+    assert db.session.execute(db.text('PRAGMA query_only')).scalar() == 0
+
+def test_read_engine_is_query_only(context):
+    """Test GET endpoints cannot write through the read engine"""
+    assert 'readonly' in db.engines
+    assert read(db.text('PRAGMA query_only')).scalar() == 1
+
+    with pytest.raises(OperationalError):
+        read(db.text('DELETE FROM "user"'))
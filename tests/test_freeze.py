@@ -0,0 +1,36 @@
+import json
+from src import app
+from src.freeze import freeze
+from src.pages import page_routes
+
+def test_freeze_writes_every_page(tmp_path):
+    """Test every marketing route is written with a gzip sibling and a sitemap"""
+    built, skipped = freeze(str(tmp_path))
+
+    assert sorted(built) == ['/', '/about', '/contact', '/portfolio', '/services', '/team', '/tos']
+    assert skipped == []
+    assert b'Drain Expertz' in (tmp_path / 'about.html').read_bytes()
+    assert (tmp_path / 'index.html.gz').exists()
+    assert b'<loc>https://www.drainexperts.co.za/team</loc>' in (tmp_path / 'sitemap.xml').read_bytes()
+
+def test_freeze_is_incremental(tmp_path):
+    """Test unchanged pages are skipped and a changed fingerprint rebuilds one page"""
+    freeze(str(tmp_path))
+    built, skipped = freeze(str(tmp_path))
+    assert built == []
+    assert len(skipped) == len(page_routes())
+
+    manifest_path = tmp_path / '.freeze.json'
+    manifest = json.loads(manifest_path.read_text())
+    manifest['/team']['fingerprint'] = 'stale'
+    manifest_path.write_text(json.dumps(manifest))
+
+    built, skipped = freeze(str(tmp_path))
+    assert built == ['/team']
+    assert manifest['/team']['templates'] == ['base.html', 'team.html']
+
+def test_freeze_command(tmp_path):
+    result = app.test_cli_runner().invoke(args=['freeze', '--output', str(tmp_path), '--force'])
+
+    assert result.exit_code == 0
+    assert '7 built, 0 unchanged' in result.output
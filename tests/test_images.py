@@ -0,0 +1,66 @@
+import os
+import pytest
+from src import app
+from src.images import build_images, image_manifest, responsive_image
+
+Image = pytest.importorskip('PIL.Image')
+
+@pytest.fixture
+def images(tmp_path):
+    """A 1000x500 JPEG with exif and a byte-identical copy, built into a temporary IMAGES_DIR"""
+    os.makedirs(tmp_path / 'static' / 'img')
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera Maker'
+    Image.new('RGB', (1000, 500), 'teal').save(tmp_path / 'static' / 'img' / 'photo.jpg', exif=exif)
+    (tmp_path / 'static' / 'img' / 'copy.jpg').write_bytes((tmp_path / 'static' / 'img' / 'photo.jpg').read_bytes())
+
+    images_dir = app.config['IMAGES_DIR']
+    app.config['IMAGES_DIR'] = str(tmp_path / 'images')
+    manifest, written = build_images(str(tmp_path / 'static'), app.config['IMAGES_DIR'])
+    image_manifest.load()
+    yield manifest, written
+    app.config['IMAGES_DIR'] = images_dir
+    image_manifest.load()
+
+def test_build_images_dedupes_and_strips_metadata(images):
+    manifest, written = images
+    assert manifest['img/photo.jpg'] == manifest['img/copy.jpg']
+
+    entry = manifest['img/photo.jpg']
+    assert (entry['width'], entry['height']) == (1000, 500)
+    mimetype, fallback = entry['variants'][-1]
+    assert mimetype == 'image/jpeg'
+    assert [width for _, width in fallback] == [320, 640, 960, 1000]
+    # One set of files for both sources
+    assert written == len(entry['variants']) * 4
+
+    with Image.open(os.path.join(app.config['IMAGES_DIR'], fallback[0][0])) as derived:
+        assert derived.size == (320, 160)
+        assert not derived.getexif()
+
+    assert build_images(os.path.dirname(app.config['IMAGES_DIR']) + '/static', app.config['IMAGES_DIR'])[1] == 0
+
+def test_image_helper_renders_srcset(images):
+    with app.test_request_context():
+        html = responsive_image('img/photo.jpg', alt='A <photo>', sizes='50vw', class_='img-fluid')
+
+    assert html.startswith('<picture>') and html.endswith('</picture>')
+    assert 'srcset="/static/images/' in html and ' 320w, ' in html
+    assert 'width="1000" height="500"' in html
+    assert 'class="img-fluid"' in html and 'alt="A &lt;photo&gt;"' in html
+    assert 'sizes="50vw"' in html
+
+def test_image_helper_without_build():
+    with app.test_request_context():
+        html = responsive_image('img/not-built.png', lazy=False)
+
+    assert html == '<img alt="" src="/static/img/not-built.png">'
+
+def test_derivatives_are_immutable(images):
+    manifest, _ = images
+    name = manifest['img/photo.jpg']['variants'][-1][1][0][0]
+
+    response = app.test_client().get(f'/static/images/{name}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
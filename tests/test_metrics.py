@@ -0,0 +1,79 @@
+import json
+import os
+import pytest
+from src import app, db
+from src.metrics import metrics
+
+@pytest.fixture
+def client(tmp_path):
+    metrics_dir = app.config['METRICS_DIR']
+    app.config['METRICS_DIR'] = str(tmp_path)
+    metrics.series.clear()
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.drop_all()
+    app.config['METRICS_DIR'] = metrics_dir
+
+def test_metrics_counts_requests_and_sql(client):
+    """Test latency, SQL and size series are recorded per endpoint and status"""
+    client.get('/api/users')
+    client.get('/api/users/42')
+    body = client.get('/metrics').get_data(as_text=True)
+
+    labels = 'endpoint="get_users",method="GET",status="200"'
+    assert f'http_request_duration_seconds_count{{{labels}}} 1' in body
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in body
+    assert 'http_request_sql_statements_total{endpoint="get_user_fast",method="GET",status="404"} 1' in body
+    assert f'http_response_size_bytes_sum{{{labels}}} 3' in body  # "[]\n"
+    assert 'user_cache_misses_total' in body
+
+def test_metrics_adds_up_workers(client, tmp_path):
+    """Test files written by other workers are summed into the output"""
+    client.get('/api')
+    other_worker = {
+        'api_home|GET|200': {
+            'count': 4, 'latency_buckets': [4] + [0] * 10, 'latency_sum': 0.01,
+            'size_buckets': [4, 0, 0, 0, 0, 0, 0], 'size_sum': 200,
+            'sql_count': 0, 'sql_seconds': 0.0,
+        }
+    }
+    (tmp_path / '1.json').write_text(json.dumps(other_worker))
+    body = client.get('/metrics').get_data(as_text=True)
+
+    assert 'http_request_duration_seconds_count{endpoint="api_home",method="GET",status="200"} 5' in body
+
+def test_only_server_workers_write_files(client, tmp_path, monkeypatch):
+    """Test requests outside gunicorn workers, like flask freeze, leave no <pid>.json"""
+    client.get('/api')
+    metrics.flush(force=True)
+    assert list(tmp_path.iterdir()) == []
+    assert 'endpoint="api_home"' in client.get('/metrics').get_data(as_text=True)
+
+    monkeypatch.setitem(app.config, 'METRICS_SHARED', True)
+    metrics.flush(force=True)
+    assert [path.name for path in tmp_path.iterdir()] == [f'{os.getpid()}.json']
+
+def test_exited_workers_are_folded(client, tmp_path):
+    """Test the files of exited workers end up in dead.json and their totals stay"""
+    series = {'count': 1, 'latency_buckets': [1] + [0] * 10, 'latency_sum': 0.01,
+              'size_buckets': [1, 0, 0, 0, 0, 0, 0], 'size_sum': 50, 'sql_count': 0, 'sql_seconds': 0.0}
+    for pid in (1, 2, 3):
+        (tmp_path / f'{pid}.json').write_text(json.dumps({'api_home|GET|200': series}))
+
+    metrics.fold(1)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['2.json', '3.json', 'dead.json']
+    metrics.fold()
+    assert [path.name for path in tmp_path.iterdir()] == ['dead.json']
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="api_home",method="GET",status="200"} 3' in body
+
+def test_failed_statements_leave_nothing_on_the_connection(client):
+    """Test a statement that raises leaves no start time behind on its pooled connection"""
+    with db.engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(db.exc.OperationalError):
+                connection.exec_driver_sql('SELECT * FROM no_such_table')
+        assert not [value for value in connection.info.values() if isinstance(value, list) and value]
+    client.get('/api/users')
+    assert metrics.series['get_users|GET|200']['sql_seconds'] > 0
@@ -0,0 +1,57 @@
+import gzip
+import json
+import pytest
+from src import app
+from src.openapi import compiled_spec
+
+@pytest.fixture
+def client(tmp_path):
+    """Setup a test client with the compiled spec in a temp dir"""
+    app.config['OPENAPI_DIR'] = str(tmp_path)
+    compiled_spec.etag = None
+    with app.test_client() as client:
+        yield client
+    compiled_spec.etag = None
+
+def test_spec_compiled_once_and_revalidated(client, tmp_path):
+    """Test the first request compiles the spec and later ones get the file with an ETag"""
+    response = client.get('/apispec_1.json')
+    assert response.status_code == 200
+    assert '/api/users' in response.get_json()['paths']
+    assert (tmp_path / 'openapi.json').read_bytes() == response.data
+
+    etag = response.headers['ETag']
+    assert client.get('/apispec_1.json', headers={'If-None-Match': etag}).status_code == 304
+
+    zipped = client.get('/apispec_1.json', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['ETag'] == etag
+    assert gzip.decompress(zipped.data) == response.data
+
+def test_spec_recompiled_after_a_docstring_change(client, monkeypatch):
+    """Test a compiled spec from other docstrings is not served"""
+    assert app.test_cli_runner().invoke(args=['openapi']).exit_code == 0
+    view = app.view_functions['api_home']
+    monkeypatch.setattr(view, '__doc__', view.__doc__.replace('Returns a feedback message', 'Changed'))
+
+    response = client.get('/apispec_1.json')
+    assert response.get_json()['paths']['/api']['get']['responses']['200']['description'] == 'Changed'
+    assert client.get('/apispec_1.json', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+def test_docs_ui_loads_the_compiled_spec(client):
+    """Test the Swagger UI points at the compiled spec"""
+    assert '/apispec_1.json' in client.get('/apidocs/').get_data(as_text=True)
+
+def test_openapi_check_catches_drift(client, tmp_path, monkeypatch):
+    """Test `flask openapi --check` fails once a docstring changes"""
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=['openapi', '--check']).exit_code == 1
+    assert runner.invoke(args=['openapi']).exit_code == 0
+    assert json.loads((tmp_path / 'openapi.json').read_text())['paths']
+    assert runner.invoke(args=['openapi', '--check']).exit_code == 0
+
+    view = app.view_functions['api_home']
+    monkeypatch.setattr(view, '__doc__', view.__doc__.replace('Returns a feedback message', 'Changed'))
+    result = runner.invoke(args=['openapi', '--check'])
+    assert result.exit_code == 1
+    assert 'GET /api changed' in result.output
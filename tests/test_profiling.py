@@ -0,0 +1,76 @@
+import json
+import os
+import pstats
+import pytest
+from src import app, db, User
+from src.auth import issue_token
+
+@pytest.fixture
+def client(tmp_path):
+    """Setup a test client with profiles and the slow query log in a temp dir"""
+    app.config['TESTING'] = True
+    app.config['PROFILE_DIR'] = str(tmp_path / 'profiles')
+    app.config['SLOW_QUERY_LOG'] = str(tmp_path / 'slow.log')
+    threshold = app.config['SLOW_QUERY_MS']
+    client = app.test_client()
+
+    with app.app_context():
+        db.create_all()
+        yield client
+        db.drop_all()
+    app.config['SLOW_QUERY_MS'] = threshold
+
+def bearer(is_admin):
+    return {'Authorization': f'Bearer {issue_token(1, is_admin)}'}
+
+def test_admin_can_profile_a_request(client):
+    """Test an admin's flagged request leaves a pstats file and collapsed stacks"""
+    response = client.get('/api/users?limit=5', headers={'X-Profile': '1', **bearer(True)})
+    name = response.headers['X-Profile']
+    assert response.status_code == 200
+    assert 'get_users' in name
+
+    directory = app.config['PROFILE_DIR']
+    stats = pstats.Stats(os.path.join(directory, f'{name}.pstats'))
+    assert any(function == 'get_users' for _, _, function in stats.stats)
+    with open(os.path.join(directory, f'{name}.folded')) as file:
+        for line in file:
+            stack, count = line.rsplit(' ', 1)
+            assert int(count) > 0
+
+def test_profile_flag_needs_an_admin(client):
+    """Test the flag is ignored without an admin token"""
+    assert 'X-Profile' not in client.get('/api/users?profile=1').headers
+    assert 'X-Profile' not in client.get('/api/users?profile=1', headers=bearer(False)).headers
+    assert not os.path.exists(app.config['PROFILE_DIR'])
+
+def test_slow_query_log_records_plans(client):
+    """Test slow statements are logged with their endpoint and query plan"""
+    app.config['SLOW_QUERY_MS'] = 1e-6
+    client.get('/api/users/search?query=jo')
+
+    with open(app.config['SLOW_QUERY_LOG']) as file:
+        entries = [json.loads(line) for line in file]
+    (entry,) = [entry for entry in entries if 'user.username >=' in entry['statement']]
+    assert entry['endpoint'] == 'search_users'
+    assert 'jo' in entry['parameters']
+    assert any('USING' in step and 'INDEX' in step for step in entry['plan'])
+    assert entry['scans'] == []
+
+def test_slow_query_log_leaves_out_passwords(client):
+    """Test a login that upgrades a plain text password logs neither password nor hash"""
+    db.session.add(User(username='legacy', email='legacy@example.com', first_name='Maanda',
+                        last_name='Muleya', password='PlainSecret123'))
+    db.session.commit()
+    app.config['SLOW_QUERY_MS'] = 1e-6
+    app.config['PASSWORD_SCRYPT_N'], n = 2 ** 7, app.config['PASSWORD_SCRYPT_N']
+    try:
+        assert client.post('/api/login', json={'username': 'legacy', 'password': 'PlainSecret123'}).status_code == 200
+    finally:
+        app.config['PASSWORD_SCRYPT_N'] = n
+
+    with open(app.config['SLOW_QUERY_LOG']) as file:
+        log = file.read()
+    assert 'UPDATE user SET password' in log
+    assert 'PlainSecret123' not in log and 'scrypt:' not in log
+    assert '"[redacted]"' in log
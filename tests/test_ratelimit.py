@@ -0,0 +1,77 @@
+import pytest
+from src import app, db, User
+from src.metrics import metrics
+from src.ratelimit import rate_limiter, MemoryBuckets, SqliteBuckets
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Setup a test client with the limiter on and tight budgets"""
+    app.config['TESTING'] = True
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'add_user': (2, 60), 'get_users': (1, 60)})
+    monkeypatch.setitem(app.config, 'METRICS_DIR', str(tmp_path / 'metrics'))
+    monkeypatch.setattr(rate_limiter, 'backend', MemoryBuckets())
+    metrics.series.clear()
+    client = app.test_client()
+
+    with app.app_context():
+        db.create_all()
+        yield client
+        db.drop_all()
+
+def new_user(i):
+    return {'username': f'user{i}', 'email': f'user{i}@example.com', 'first_name': 'Maanda',
+            'last_name': 'Muleya', 'password': '#Maanda2043'}
+
+def test_budget_runs_out_before_the_view(client):
+    """Test a client past its budget gets 429 and Retry-After, and nothing is written"""
+    app.config['PASSWORD_SCRYPT_N'], n = 2 ** 7, app.config['PASSWORD_SCRYPT_N']
+    try:
+        assert client.post('/api/users', json=new_user(1)).status_code == 201
+        assert client.post('/api/users', json=new_user(2)).status_code == 201
+        response = client.post('/api/users', json=new_user(3))
+    finally:
+        app.config['PASSWORD_SCRYPT_N'] = n
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 30
+    assert response.get_json() == {'message': 'Too many requests, slow down'}
+    assert User.query.count() == 2
+    assert metrics.series['add_user|POST|429']['sql_count'] == 0
+
+def test_clients_have_their_own_buckets(client):
+    """Test clients behind nginx are told apart by X-Real-IP, other routes are not limited"""
+    assert client.get('/api/users', headers={'X-Real-IP': '10.0.0.1'}).status_code == 200
+    assert client.get('/api/users', headers={'X-Real-IP': '10.0.0.1'}).status_code == 429
+    assert client.get('/api/users', headers={'X-Real-IP': '10.0.0.2'}).status_code == 200
+    assert all(client.get('/api').status_code == 200 for _ in range(5))
+
+def test_throttled_requests_in_metrics(client):
+    """Test /metrics counts the requests turned away per endpoint"""
+    for _ in range(3):
+        client.get('/api/users')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'rate_limited_requests_total{endpoint="get_users"} 2' in body
+
+def test_sqlite_buckets_refill_and_prune(tmp_path):
+    """Test the shared buckets refill over time and idle ones are dropped"""
+    buckets = SqliteBuckets(str(tmp_path / 'ratelimit.db'))
+    assert buckets.take('login:a', 2, 0.5, 100.0) == 0
+    assert buckets.take('login:a', 2, 0.5, 100.0) == 0
+    assert buckets.take('login:a', 2, 0.5, 100.0) == pytest.approx(2.0)
+    assert buckets.take('login:a', 2, 0.5, 102.0) == 0
+    assert buckets.take('login:b', 2, 0.5, 102.0) == 0
+
+    buckets.prune(101.0)
+    assert buckets.connection.execute('SELECT count(*) FROM buckets').fetchone()[0] == 2
+    buckets.prune(103.0)
+    assert buckets.connection.execute('SELECT count(*) FROM buckets').fetchone()[0] == 0
+
+def test_batch_is_charged_to_the_caller(client):
+    """Test sub-requests share the caller's buckets whatever X-Real-IP they claim"""
+    app.config['RATE_LIMITS']['batch'] = (1, 60)
+    response = client.post('/api/batch', headers={'X-Real-IP': '10.0.0.1'}, json={'requests': [
+        {'path': '/api/users', 'headers': {'X-Real-IP': f'10.0.1.{i}'}} for i in range(3)]})
+    assert [result['status'] for result in response.get_json()['responses']] == [200, 429, 429]
+    assert client.get('/api/users', headers={'X-Real-IP': '10.0.0.1'}).status_code == 429
+    assert client.post('/api/batch', headers={'X-Real-IP': '10.0.0.1'},
+                       json={'requests': [{'path': '/api'}]}).status_code == 429
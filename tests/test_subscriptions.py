@@ -0,0 +1,76 @@
+import time
+import pytest
+from src import app, db
+from src.models import Subscriber
+from src.subscriptions import subscriptions, flush_subscriptions
+
+@pytest.fixture
+def client():
+    with app.app_context():
+        db.create_all()
+        subscriptions.clear()
+        yield app.test_client()
+        subscriptions.flush()
+        db.session.execute(db.delete(Subscriber))
+        db.session.commit()
+        subscriptions.clear()
+
+def stored():
+    return set(db.session.execute(db.select(Subscriber.email)).scalars())
+
+def test_subscribe_is_buffered_then_stored(client):
+    response = client.post('/api/subscribe', json={'email': ' Maanda@Example.com '})
+    assert response.status_code == 202
+    assert response.get_json() == {'message': 'You are now subscribed to our newsletter!.'}
+    assert stored() == set()
+
+    subscriptions.flush()
+    assert stored() == {'maanda@example.com'}
+
+def test_subscribe_form_post(client):
+    assert client.post('/api/subscribe', data={'email': 'a@example.com'}).data == b'OK'
+
+    response = client.post('/api/subscribe', data={'email': 'nope'})
+    assert response.status_code == 400
+    assert client.post('/api/subscribe', json={}).status_code == 400
+
+def test_burst_is_written_in_batches(client):
+    app.config['SUBSCRIBE_BATCH_SIZE'], batch_size = 250, app.config['SUBSCRIBE_BATCH_SIZE']
+    try:
+        flushes = subscriptions.flushes
+        for n in range(1000):
+            # Every address twice, the second one is dropped in memory
+            for _ in range(2):
+                client.post('/api/subscribe', json={'email': f'user{n}@example.com'})
+        assert subscriptions.flushes - flushes == 4
+        assert len(stored()) == 1000
+    finally:
+        app.config['SUBSCRIBE_BATCH_SIZE'] = batch_size
+
+def test_already_stored_address_is_not_written_again(client):
+    db.session.add(Subscriber(email='old@example.com'))
+    db.session.commit()
+
+    subscriptions.add('old@example.com')
+    assert subscriptions.flush() == 1
+    assert stored() == {'old@example.com'}
+    assert subscriptions.add('old@example.com') is False
+
+def test_quiet_buffer_flushes_on_timer(client):
+    app.config['SUBSCRIBE_FLUSH_INTERVAL'], interval = 0.05, app.config['SUBSCRIBE_FLUSH_INTERVAL']
+    try:
+        client.post('/api/subscribe', json={'email': 'timer@example.com'})
+        for _ in range(40):
+            db.session.commit()  # end the read transaction so the timer's write is visible
+            if stored():
+                break
+            time.sleep(0.05)
+        assert stored() == {'timer@example.com'}
+    finally:
+        app.config['SUBSCRIBE_FLUSH_INTERVAL'] = interval
+
+def test_exit_hook_flushes_buffer(client):
+    subscriptions.add('leaving@example.com')
+
+    flush_subscriptions()
+    assert stored() == {'leaving@example.com'}
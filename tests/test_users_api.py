@@ -1,12 +1,21 @@
+import gzip
+from datetime import datetime, timedelta, timezone
+import threading
+import time
 import pytest
 import json
+from werkzeug.http import http_date
 from src import app, db, User
+from src.cache import user_cache
+from src.passwords import hasher, HasherBusy
 
 @pytest.fixture
 def client():
     """Setup a test client and test database"""
     app.config['TESTING'] = True
     app.config['SECRET_KEY'] = "SECRET_KEY"
+    app.config['PASSWORD_SCRYPT_N'] = 2 ** 7  # Cheap hashes keep the tests fast
+    app.config['PASSWORD_BULK_SCRYPT_N'] = 2 ** 8
 
     # app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'  # Use in-memory DB
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///memory.db'  # Using SQLite
@@ -76,3 +85,566 @@ def test_create_user_invalid_data(client):
 
     assert response.status_code == 400
     assert b'required' in response.data
+
+def create_users(client, count):
+    for i in range(count):
+        client.post('/api/users',
+                    data=json.dumps({
+                        "email": f"user{i}@example.com",
+                        "first_name": "Maanda",
+                        "is_admin": False,
+                        "last_name": "Muleya",
+                        "password": "#Maanda2",
+                        "username": f"user{i}"
+                    }),
+                    content_type='application/json')
+
+def test_get_users_page_mode(client):
+    """Test the original page/limit listing still returns a plain list"""
+    create_users(client, 3)
+    response = client.get('/api/users?page=1&limit=2')
+
+    assert response.status_code == 200
+    assert [user['username'] for user in response.get_json()] == ['user0', 'user1']
+
+def test_get_users_cursor_mode(client):
+    """Test walking every page with next_cursor"""
+    create_users(client, 5)
+    response = client.get('/api/users?after=&limit=2&count=true')
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['count'] == 5
+    seen = [user['username'] for user in body['users']]
+
+    while body['next_cursor']:
+        body = client.get(f"/api/users?after={body['next_cursor']}&limit=2").get_json()
+        assert 'count' not in body
+        seen += [user['username'] for user in body['users']]
+
+    assert seen == [f'user{i}' for i in range(5)]
+
+def test_get_users_invalid_cursor(client):
+    """Test a cursor we did not issue is rejected"""
+    response = client.get('/api/users?after=not-a-cursor')
+
+    assert response.status_code == 400
+
+def test_search_users_by_email_and_name(client):
+    """Test the search index covers email and names and ranks username hits first"""
+    create_users(client, 3)
+    client.post('/api/users',
+                data=json.dumps({
+                    "email": "someone@example.com",
+                    "first_name": "Pythongton",
+                    "is_admin": False,
+                    "last_name": "Mudau",
+                    "password": "#Maanda2",
+                    "username": "user1x"
+                }),
+                content_type='application/json')
+
+    response = client.get('/api/users/search?query=USER1')
+    assert response.status_code == 200
+    assert [user['username'] for user in response.get_json()] == ['user1', 'user1x']
+
+    response = client.get('/api/users/search?query=thongt')
+    assert [user['username'] for user in response.get_json()] == ['user1x']
+
+def test_search_users_short_query_is_a_username_prefix(client):
+    """Test queries under 3 characters match username prefixes, case-sensitively, and page"""
+    create_users(client, 3)
+    response = client.get('/api/users/search?query=us')
+    assert [user['username'] for user in response.get_json()] == ['user0', 'user1', 'user2']
+    assert client.get('/api/users/search?query=US').get_json() == []
+
+    body = client.get('/api/users/search?query=u&limit=2&after=').get_json()
+    seen = [user['username'] for user in body['users']]
+    body = client.get(f"/api/users/search?query=u&limit=2&after={body['next_cursor']}").get_json()
+    assert seen + [user['username'] for user in body['users']] == ['user0', 'user1', 'user2']
+    assert body['next_cursor'] is None
+
+def test_search_users_follows_updates_and_deletes(client):
+    """Test the search index is kept in sync with the user table"""
+    create_users(client, 2)
+    client.put('/api/users/1', data=json.dumps({"username": "renamed"}),
+               content_type='application/json')
+    client.delete('/api/users/2')
+
+    response = client.get('/api/users/search?query=user1')
+    assert response.get_json() == []
+
+    response = client.get('/api/users/search?query=renamed')
+    assert [user['id'] for user in response.get_json()] == [1]
+
+def test_search_users_cursor_mode(client):
+    """Test results are capped and paged with next_cursor"""
+    create_users(client, 5)
+    body = client.get('/api/users/search?query=example&limit=2&after=').get_json()
+    seen = [user['username'] for user in body['users']]
+    assert len(seen) == 2
+
+    while body['next_cursor']:
+        body = client.get(f"/api/users/search?query=example&limit=2&after={body['next_cursor']}").get_json()
+        seen += [user['username'] for user in body['users']]
+
+    assert sorted(seen) == [f'user{i}' for i in range(5)]
+
+def test_bulk_add_users_ndjson(client):
+    """Test NDJSON import in small batches with per-row errors"""
+    create_users(client, 1)
+    lines = [
+        json.dumps({"username": "bulk1", "email": "bulk1@example.com", "first_name": "A",
+                    "last_name": "B", "password": "#Maanda2"}),
+        json.dumps({"username": "user0", "email": "taken@example.com", "first_name": "A",
+                    "last_name": "B", "password": "#Maanda2"}),
+        "not json",
+        json.dumps({"username": "bulk2", "email": "bulk2@example.com", "first_name": "A",
+                    "last_name": "B", "password": "#Maanda2", "is_admin": True}),
+        json.dumps({"username": "bulk3", "email": "bulk2@example.com", "first_name": "A",
+                    "last_name": "B", "password": "#Maanda2"}),
+        json.dumps({"username": "bulk4", "email": "bulk4@example.com"}),
+    ]
+    response = client.post('/api/users/bulk?batch_size=2', data="\n".join(lines),
+                           content_type='application/x-ndjson')
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['inserted'] == 2
+    assert [error['row'] for error in body['errors']] == [2, 3, 5, 6]
+    assert User.query.filter_by(username='bulk2').one().is_admin is True
+    # Imported at the bulk cost, rehashed at the full one on first login
+    assert User.query.filter_by(username='bulk2').one().password.startswith('scrypt:256:')
+    assert login(client, 'bulk2').status_code == 200
+    assert User.query.filter_by(username='bulk2').one().password.startswith('scrypt:128:')
+
+def test_bulk_add_users_prehashed_and_hash_budget(client, monkeypatch):
+    """Test hashed passwords are stored as sent and plain ones past the budget are rejected"""
+    from werkzeug.security import generate_password_hash
+    monkeypatch.setitem(app.config, 'BULK_MAX_PASSWORD_HASHES', 1)
+    hashed = generate_password_hash('#Maanda2', 'scrypt:256:8:1')
+    row = lambda i, password: json.dumps({"username": f"bulk{i}", "email": f"bulk{i}@example.com",
+                                          "first_name": "A", "last_name": "B", "password": password})
+    lines = [row(1, '#Maanda2'), row(2, '#Maanda2'), row(3, hashed), row(4, 'scrypt:broken')]
+    body = client.post('/api/users/bulk', data="\n".join(lines), content_type='application/x-ndjson').get_json()
+
+    assert body['inserted'] == 2
+    assert [error['row'] for error in body['errors']] == [2, 4]
+    assert 'send the rest hashed' in body['errors'][0]['error']
+    assert User.query.filter_by(username='bulk3').one().password == hashed
+    assert login(client, 'bulk3').status_code == 200
+
+def test_bulk_hashing_takes_a_slot_per_password(client):
+    """Test bulk hashing keeps one password per worker in flight and frees every slot"""
+    running, most, lock = [0], [0], threading.Lock()
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item * 2
+
+    app.config['PASSWORD_HASH_WORKERS'], workers = 2, app.config['PASSWORD_HASH_WORKERS']
+    hasher.executor = None
+    try:
+        assert hasher.map(work, range(10)) == [item * 2 for item in range(10)]
+        assert most[0] <= 2
+        hasher.executor.shutdown()  # Slots are freed by callbacks on the pool threads
+        free = app.config['PASSWORD_HASH_WORKERS'] + app.config['PASSWORD_HASH_QUEUE']
+        assert all(hasher.slots.acquire(blocking=False) for _ in range(free))
+        assert not hasher.slots.acquire(blocking=False)
+    finally:
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        hasher.executor = None
+
+def test_bulk_add_users_csv(client):
+    """Test CSV import"""
+    data = "username,email,first_name,last_name,password,is_admin\n" \
+           "csv1,csv1@example.com,A,B,#Maanda2,false\n" \
+           "csv2,csv2@example.com,A,B,#Maanda2,true\n"
+    response = client.post('/api/users/bulk', data=data, content_type='text/csv')
+
+    assert response.get_json()['inserted'] == 2
+    assert User.query.count() == 2
+
+def test_bulk_add_users_unsupported_type(client):
+    response = client.post('/api/users/bulk', data='{}', content_type='application/json')
+
+    assert response.status_code == 415
+
+def test_export_users_ndjson(client):
+    """Test streaming export with a field projection"""
+    create_users(client, 3)
+    response = client.get('/api/users/export?fields=id,username')
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in lines] == [
+        {'id': i + 1, 'username': f'user{i}'} for i in range(3)
+    ]
+
+def test_export_users_csv_gzip(client):
+    """Test gzipped CSV export never includes passwords"""
+    create_users(client, 2)
+    response = client.get('/api/users/export?format=csv',
+                          headers={'Accept-Encoding': 'gzip'})
+    data = gzip.decompress(response.get_data()).decode()
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert data.splitlines()[0] == 'id,first_name,last_name,username,email,is_admin'
+    assert len(data.splitlines()) == 3
+    assert 'Maanda2' not in data
+
+def test_export_users_unknown_field(client):
+    response = client.get('/api/users/export?fields=password')
+
+    assert response.status_code == 400
+
+def test_get_user_cache_invalidated_on_write(client):
+    """Test reads are served from the cache and writes drop stale entries"""
+    create_users(client, 2)
+    assert client.get('/api/users/1').get_json()['username'] == 'user0'
+    assert client.get('/api/users').get_json()[0]['username'] == 'user0'
+
+    client.put('/api/users/1', data=json.dumps({"username": "renamed"}),
+               content_type='application/json')
+    assert client.get('/api/users/1').get_json()['username'] == 'renamed'
+    assert client.get('/api/users').get_json()[0]['username'] == 'renamed'
+
+    client.delete('/api/users/1')
+    assert client.get('/api/users/1').status_code == 404
+    assert [user['id'] for user in client.get('/api/users').get_json()] == [2]
+
+def test_get_users_fields_projection(client):
+    """Test ?fields= narrows list, cursor and single user responses"""
+    create_users(client, 2)
+
+    assert client.get('/api/users?fields=id,username').get_json() == [
+        {'id': 1, 'username': 'user0'}, {'id': 2, 'username': 'user1'}]
+
+    body = client.get('/api/users?after=&limit=1&fields=email').get_json()
+    assert body['users'] == [{'email': 'user0@example.com'}]
+    body = client.get(f"/api/users?after={body['next_cursor']}&limit=1&fields=email").get_json()
+    assert body['users'] == [{'email': 'user1@example.com'}]
+
+    assert client.get('/api/users/2?fields=username').get_json() == {'username': 'user1'}
+    assert client.get('/api/users/2').get_json() == {
+        'id': 2, 'first_name': 'Maanda', 'last_name': 'Muleya', 'username': 'user1',
+        'email': 'user1@example.com', 'is_admin': False}
+
+def test_get_users_unknown_field(client):
+    assert client.get('/api/users?fields=password').status_code == 400
+    assert client.get('/api/users/1?fields=password').status_code == 400
+
+def test_get_user_conditional(client):
+    """Test ETag and Last-Modified revalidation of a single user"""
+    create_users(client, 1)
+    # Written in this very second: no date yet, a second write could share it
+    response = client.get('/api/users/1')
+    assert 'Last-Modified' not in response.headers
+    response = client.get('/api/users/1', headers={'If-Modified-Since': http_date(datetime.now(timezone.utc))})
+    assert response.status_code == 200
+
+    db.session.execute(db.update(User).values(updated_at=datetime.utcnow() - timedelta(seconds=5)))
+    db.session.commit()
+    user_cache.clear()
+    response = client.get('/api/users/1')
+    etag = response.headers['ETag']
+    modified = response.headers['Last-Modified']
+
+    assert client.get('/api/users/1', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/users/1?fields=id', headers={'If-None-Match': etag}).status_code == 200
+
+    # Without a cached copy the version-only query answers
+    user_cache.clear()
+    response = client.get('/api/users/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get('/api/users/1', headers={'If-Modified-Since': modified})
+    assert response.status_code == 304
+
+    client.put('/api/users/1', data=json.dumps({"first_name": "Carma"}),
+               content_type='application/json')
+    response = client.get('/api/users/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_put_user_if_match(client):
+    """Test a write based on a stale copy is rejected"""
+    create_users(client, 1)
+    etag = client.get('/api/users/1').headers['ETag']
+
+    response = client.put('/api/users/1', data=json.dumps({"first_name": "Carma"}),
+                          content_type='application/json', headers={'If-Match': etag})
+    assert response.status_code == 200
+    new_etag = response.headers['ETag']
+
+    response = client.open('/api/users/1', method='UPDATE', data=json.dumps({"first_name": "Stale"}),
+                           content_type='application/json', headers={'If-Match': etag})
+    assert response.status_code == 412
+
+    response = client.open('/api/users/1', method='UPDATE', data=json.dumps({"first_name": "Fresh"}),
+                           content_type='application/json', headers={'If-Match': new_etag})
+    assert response.status_code == 200
+    assert response.get_json()['user']['first_name'] == 'Fresh'
+
+def test_get_users_conditional(client):
+    """Test list ETags change with any row on the page"""
+    create_users(client, 3)
+    etag = client.get('/api/users?limit=2').headers['ETag']
+    assert client.get('/api/users?limit=2', headers={'If-None-Match': etag}).status_code == 304
+
+    user_cache.clear()
+    assert client.get('/api/users?limit=2', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/users?limit=2&fields=id', headers={'If-None-Match': etag}).status_code == 200
+
+    client.delete('/api/users/2')
+    response = client.get('/api/users?limit=2', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [user['id'] for user in response.get_json()] == [1, 3]
+
+    etag = client.get('/api/users?after=&limit=2').headers['ETag']
+    assert client.get('/api/users?after=&limit=2', headers={'If-None-Match': etag}).status_code == 304
+
+def test_patch_user_only_supplied_fields(client):
+    """Test PATCH writes falsy values PUT would skip and leaves the rest alone"""
+    create_users(client, 1)
+    client.put('/api/users/1', data=json.dumps({"is_admin": True}), content_type='application/json')
+    etag = client.get('/api/users/1').headers['ETag']
+
+    response = client.patch('/api/users/1', data=json.dumps({"is_admin": False}),
+                            content_type='application/json', headers={'If-Match': etag})
+    user = response.get_json()['user']
+
+    assert response.status_code == 200
+    assert user['is_admin'] is False
+    assert user['username'] == 'user0'
+    assert response.headers['ETag'] != etag
+
+    response = client.patch('/api/users/1', data=json.dumps({"email": ""}),
+                            content_type='application/json')
+    assert response.status_code == 400
+
+def test_update_user_errors(client):
+    """Test missing users and duplicate usernames"""
+    create_users(client, 2)
+
+    response = client.patch('/api/users/9', data=json.dumps({"email": "x@example.com"}),
+                            content_type='application/json')
+    assert response.status_code == 404
+
+    response = client.put('/api/users/2', data=json.dumps({"username": "user0"}),
+                          content_type='application/json')
+    assert response.status_code == 400
+    assert b'exists' in response.data
+
+    assert client.delete('/api/users/9').status_code == 404
+
+def test_get_users_by_ids(client):
+    """Test fetching several users by id in one request"""
+    create_users(client, 5)
+    ids = [user.id for user in User.query.order_by(User.id)]
+
+    response = client.get(f'/api/users?ids={ids[3]},{ids[0]},{ids[3]},999999&fields=id,username')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [user['id'] for user in body['users']] == [ids[3], ids[0]]
+    assert set(body['users'][0]) == {'id', 'username'}
+    assert body['missing'] == [999999]
+
+    # Served from the cache the second time, with the same validator
+    again = client.get(f'/api/users?ids={ids[3]},{ids[0]},{ids[3]},999999&fields=id,username')
+    assert again.get_json() == body
+    assert again.headers['ETag'] == response.headers['ETag']
+    assert client.get(f'/api/users?ids={ids[3]},{ids[0]},{ids[3]},999999&fields=id,username',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+def test_get_users_by_ids_limits(client):
+    """Test invalid and oversized id lists"""
+    assert client.get('/api/users?ids=1,two').status_code == 400
+    assert client.get('/api/users?ids=').status_code == 400
+    too_many = ','.join(str(n) for n in range(app.config['USERS_MAX_IDS'] + 1))
+    assert client.get(f'/api/users?ids={too_many}').status_code == 400
+
+def test_batch(client):
+    """Test running several requests in one"""
+    create_users(client, 2)
+    user_id = User.query.order_by(User.id).first().id
+
+    response = client.post('/api/batch', json={'requests': [
+        {'path': f'/api/users/{user_id}?fields=id,username'},
+        {'method': 'PATCH', 'path': f'/api/users/{user_id}', 'body': {'first_name': 'Batched'}},
+        {'path': f'/api/users/{user_id}'},
+        {'path': '/api/users/999999'},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['responses']
+    assert [result['status'] for result in results] == [200, 200, 200, 404]
+    assert results[0]['body'] == {'id': user_id, 'username': 'user0'}
+    assert results[0]['headers']['ETag']
+    assert results[2]['body']['first_name'] == 'Batched'
+
+def test_batch_rejects_bad_requests(client):
+    """Test batch validation"""
+    assert client.post('/api/batch', json={'requests': []}).status_code == 400
+    assert client.post('/api/batch', json={'requests': [{'path': '/api/batch'}]}).status_code == 400
+    assert client.post('/api/batch', json={'requests': [{'path': '/metrics'}]}).status_code == 400
+    too_many = [{'path': '/api'}] * (app.config['BATCH_MAX_REQUESTS'] + 1)
+    assert client.post('/api/batch', json={'requests': too_many}).status_code == 400
+
+def login(client, username='user0', password='#Maanda2'):
+    return client.post('/api/login', json={'username': username, 'password': password})
+
+def test_login_and_me(client):
+    """Test logging in and fetching the profile with the token"""
+    create_users(client, 2)
+    response = login(client, 'user1')
+    assert response.status_code == 200
+    token = response.get_json()['access_token']
+    assert response.get_json()['token_type'] == 'Bearer'
+
+    me = client.get('/api/users/me', headers={'Authorization': f'Bearer {token}'})
+    assert me.status_code == 200
+    assert me.get_json() == {'id': User.query.filter_by(username='user1').one().id,
+                             'username': 'user1', 'email': 'user1@example.com'}
+
+def test_batch_items_keep_their_own_tokens(client):
+    """Test each sub-request of a batch is authenticated by its own token"""
+    create_users(client, 2)
+    tokens = [login(client, f'user{i}').get_json()['access_token'] for i in range(2)]
+    response = client.post('/api/batch', json={'requests': [
+        {'path': '/api/users/me'},
+        {'path': '/api/users/me', 'headers': {'Authorization': f'Bearer {tokens[0]}'}},
+        {'path': '/api/users/me', 'headers': {'Authorization': f'Bearer {tokens[1]}'}},
+        {'path': '/api/users/me'},
+    ]})
+    results = response.get_json()['responses']
+    assert [result['status'] for result in results] == [401, 200, 200, 401]
+    assert [results[1]['body']['username'], results[2]['body']['username']] == ['user0', 'user1']
+
+def test_me_runs_no_query_once_cached(client):
+    """Test that the token and the user cache are all /api/users/me needs"""
+    from src.metrics import metrics
+    create_users(client, 1)
+    headers = {'Authorization': f"Bearer {login(client).get_json()['access_token']}"}
+    client.get('/api/users/me', headers=headers)
+
+    metrics.series.clear()
+    assert client.get('/api/users/me', headers=headers).status_code == 200
+    (series,) = [series for key, series in metrics.series.items() if key.startswith('get_my_profile|')]
+    assert series['sql_count'] == 0
+
+def test_login_failures(client):
+    """Test wrong passwords and missing fields"""
+    create_users(client, 1)
+    assert login(client, password='wrong').status_code == 401
+    assert login(client, username='nobody').status_code == 401
+    assert client.post('/api/login', json={'username': 'user0'}).status_code == 400
+
+def test_unknown_username_is_hashed_too(client, monkeypatch):
+    """Test a login for a username that does not exist still checks a hash"""
+    create_users(client, 1)
+    checked = []
+    run = hasher.run
+    monkeypatch.setattr(hasher, 'run', lambda function, *args: checked.append(args[0]) or run(function, *args))
+    assert login(client, username='nobody').status_code == 401
+    assert login(client, password='wrong').status_code == 401
+    assert len(checked) == 2
+    assert checked[0].startswith('scrypt:128:8:1$') and checked[0] != checked[1]
+
+def test_me_rejects_bad_tokens(client):
+    """Test missing, forged and expired tokens"""
+    create_users(client, 1)
+    token = login(client).get_json()['access_token']
+
+    response = client.get('/api/users/me')
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+    assert client.get('/api/users/me', headers={'Authorization': f'Bearer {token}x'}).status_code == 401
+
+    max_age = app.config['TOKEN_MAX_AGE']
+    app.config['TOKEN_MAX_AGE'] = -1
+    try:
+        assert client.get('/api/users/me', headers={'Authorization': f'Bearer {token}'}).status_code == 401
+    finally:
+        app.config['TOKEN_MAX_AGE'] = max_age
+
+def test_passwords_are_hashed(client):
+    """Test that sign-up and PATCH store scrypt hashes, never the password"""
+    create_users(client, 1)
+    stored = User.query.filter_by(username='user0').one().password
+    assert stored.startswith('scrypt:128:8:1$')
+    assert '#Maanda2' not in stored
+
+    client.patch('/api/users/1', json={'password': '#Changed9'})
+    assert User.query.filter_by(username='user0').one().password.startswith('scrypt:')
+    assert login(client).status_code == 401
+    assert login(client, password='#Changed9').status_code == 200
+
+def test_login_upgrades_outdated_passwords(client):
+    """Test plain text and old-cost hashes are rehashed on the next login"""
+    create_users(client, 1)
+    db.session.execute(db.update(User).values(password='#Maanda2'))
+    db.session.commit()
+    assert login(client, password='wrong').status_code == 401
+    assert login(client).status_code == 200
+    assert db.session.execute(db.select(User.password)).scalar().startswith('scrypt:128:8:1$')
+
+    app.config['PASSWORD_SCRYPT_N'] = 2 ** 8
+    assert login(client).status_code == 200
+    assert db.session.execute(db.select(User.password)).scalar().startswith('scrypt:256:8:1$')
+
+def test_password_hashing_backpressure(client, monkeypatch):
+    """Test a saturated hashing pool answers 503 with Retry-After"""
+    import threading
+    from src.passwords import hasher
+    hasher.start()
+    monkeypatch.setattr(hasher, 'slots', threading.BoundedSemaphore(1))
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WAIT', 0)
+    hasher.slots.acquire()
+    try:
+        response = client.post('/api/users', json={
+            "email": "busy@example.com", "first_name": "A", "last_name": "B",
+            "password": "#Maanda2", "username": "busy"})
+    finally:
+        hasher.slots.release()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert User.query.filter_by(username='busy').first() is None
+
+def test_gunicorn_threads_outnumber_hashing_slots(monkeypatch):
+    """Test that with the shipped worker settings a burst of hashes is turned away, not queued"""
+    import os
+    import runpy
+    settings = runpy.run_path(os.path.join(os.path.dirname(app.root_path), 'settings', 'gunicorn.conf.py'))
+    assert settings['worker_class'] == 'gthread'
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WAIT', 0.05)
+    assert settings['threads'] > 1 + app.config['PASSWORD_HASH_QUEUE']
+
+    release, busy = threading.Event(), []
+
+    def request_thread():
+        try:
+            hasher.run(release.wait, 5)
+        except HasherBusy:
+            busy.append(1)
+
+    hasher.executor = None
+    threads = [threading.Thread(target=request_thread) for _ in range(settings['threads'])]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        release.set()
+        hasher.executor = None
+    assert len(busy) == settings['threads'] - 1 - app.config['PASSWORD_HASH_QUEUE']
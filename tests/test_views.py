@@ -0,0 +1,46 @@
+import gzip
+from src import app
+from pytest import fixture
+from src.pages import page_cache
+
+@fixture
+def client():
+    page_cache.clear()
+    with app.test_client() as client:
+        yield client
+
+def test_pages_render(client):
+    for path in ('/', '/about', '/services', '/tos', '/portfolio', '/team', '/contact'):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert b'Drain Expertz' in response.data
+
+def test_page_revalidation(client):
+    """Test a cached page answers If-None-Match with 304"""
+    response = client.get('/about')
+    etag = response.headers['ETag']
+
+    assert response.headers['Cache-Control'].startswith('public, max-age=')
+    response = client.get('/about', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_page_gzip_variant(client):
+    """Test the precompressed variant is served with its own ETag"""
+    plain = client.get('/team')
+    response = client.get('/team', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == plain.data
+    assert response.headers['ETag'] != plain.headers['ETag']
+
+def test_page_rerendered_when_template_changes(client, monkeypatch):
+    """Test a newer template mtime drops the cached page"""
+    first = client.get('/contact').headers['ETag']
+    page = page_cache.pages['contact']
+
+    monkeypatch.setattr('src.pages.template_mtime', lambda template: 0)
+    client.get('/contact')
+    assert page_cache.pages['contact'] is not page
+    assert client.get('/contact').headers['ETag'] == first